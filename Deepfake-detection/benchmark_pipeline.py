@@ -0,0 +1,78 @@
+"""
+Compare input throughput of the notebook's ImageDataGenerator against the
+tf.data pipeline in data_pipeline.py.
+
+    python benchmark_pipeline.py --data data --epochs 2
+    python benchmark_pipeline.py --data data --train   # also time real Meso4 epochs
+
+Without --train only the input pipeline is timed (one full pass over the
+training split per epoch), which is the ceiling the model can be fed at.
+Epoch 1 of a cached pipeline includes decoding; later epochs read the cache.
+"""
+import argparse
+import math
+import time
+
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+from data_pipeline import make_datasets, make_tfrecord_dataset, write_tfrecords
+
+
+def time_epochs(name, make_iterable, steps, epochs, batch_size):
+    for epoch in range(1, epochs + 1):
+        iterable = make_iterable()
+        start = time.perf_counter()
+        images = 0
+        for step, (batch, _) in enumerate(iterable):
+            images += len(batch)
+            if step + 1 >= steps:
+                break
+        elapsed = time.perf_counter() - start
+        print(f"{name:24s} epoch {epoch}: {elapsed:7.2f}s  {images / elapsed:9.1f} images/sec")
+
+
+def time_training(name, train_data, epochs, steps=None):
+    from meso4 import Meso4
+    meso = Meso4()
+    meso.compile()
+    start = time.perf_counter()
+    meso.model.fit(train_data, epochs=epochs, steps_per_epoch=steps, verbose=0)
+    elapsed = time.perf_counter() - start
+    print(f"{name:24s} training: {elapsed / epochs:7.2f}s per epoch")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Meso4 input pipelines")
+    parser.add_argument('--data', default='data')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--tfrecords', help="Also benchmark sharded TFRecords written to this directory")
+    parser.add_argument('--train', action='store_true', help="Time Meso4 training epochs as well")
+    args = parser.parse_args()
+
+    datagen = ImageDataGenerator(rescale=1. / 255, validation_split=0.2)
+
+    def generator():
+        return datagen.flow_from_directory(args.data, target_size=(112, 112), batch_size=args.batch_size,
+                                           class_mode='binary', subset='training')
+
+    steps = len(generator())
+    print(f"{steps} batches of {args.batch_size} per epoch")
+
+    time_epochs("ImageDataGenerator", generator, steps, args.epochs, args.batch_size)
+
+    train_ds, _ = make_datasets(args.data, batch_size=args.batch_size)
+    time_epochs("tf.data (memory cache)", lambda: train_ds, steps, args.epochs, args.batch_size)
+
+    if args.tfrecords:
+        write_tfrecords(args.data, args.tfrecords, subset='training')
+        record_ds = make_tfrecord_dataset(f"{args.tfrecords}/training-*.tfrecord", batch_size=args.batch_size)
+        time_epochs("tf.data (tfrecords)", lambda: record_ds, math.inf, args.epochs, args.batch_size)
+
+    if args.train:
+        time_training("ImageDataGenerator", generator(), args.epochs)
+        time_training("tf.data (memory cache)", train_ds, args.epochs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+tf.data input pipeline for training Meso4 on data/Real and data/DeepFake.
+
+Drop-in replacement for the ImageDataGenerator.flow_from_directory setup in
+master_notebook.ipynb: same 112x112 inputs scaled to [0, 1], same binary
+labels (classes sorted alphabetically, so DeepFake=0 and Real=1) and the
+same per-class 80/20 training/validation split. Image decode and resize run
+in parallel, the preprocessed tensors are cached in memory or on disk after
+the first epoch, and batches are prefetched while the model trains.
+
+    from data_pipeline import make_datasets
+    train_ds, val_ds = make_datasets('data')
+    meso.model.fit(train_ds, validation_data=val_ds, epochs=4)
+"""
+import os
+
+import tensorflow as tf
+
+IMAGE_SIZE = (112, 112)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def list_files(data_dir, subset=None, validation_split=0.2):
+    """Return (paths, labels) split the same way flow_from_directory does.
+
+    flow_from_directory takes the first `validation_split` fraction of each
+    class's sorted file list as validation and the rest as training.
+    """
+    classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    paths, labels = [], []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(data_dir, class_name)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        split = int(validation_split * len(files))
+        if subset == 'validation':
+            files = files[:split]
+        elif subset == 'training':
+            files = files[split:]
+        paths.extend(os.path.join(class_dir, f) for f in files)
+        labels.extend([label] * len(files))
+    return paths, labels
+
+
+def decode_image(path, label):
+    # JPEG and PNG alike; expand_animations=False always yields a 3-D image
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    # Nearest matches ImageDataGenerator's default interpolation
+    image = tf.image.resize(image, IMAGE_SIZE, method='nearest')
+    return tf.cast(image, tf.uint8), label
+
+
+def to_float(image, label):
+    return tf.cast(image, tf.float32) / 255.0, tf.cast(label, tf.float32)
+
+
+def augment(image, label):
+    image = tf.image.random_flip_left_right(image)
+    image = tf.image.random_brightness(image, 0.1)
+    return tf.clip_by_value(image, 0.0, 1.0), label
+
+
+def build_dataset(dataset, batch_size=32, shuffle=False, augment_images=False, cache=True, seed=None):
+    """Shared tail of the pipeline: cache uint8 tensors, shuffle, augment, batch, prefetch.
+
+    cache=True caches in memory, a string caches to that file path and False
+    disables caching.
+    """
+    if cache:
+        # Cache before shuffling/augmenting so every epoch reshuffles and re-augments
+        dataset = dataset.cache(cache if isinstance(cache, str) else '')
+    if shuffle:
+        dataset = dataset.shuffle(8192, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(to_float, num_parallel_calls=AUTOTUNE)
+    if augment_images:
+        dataset = dataset.map(augment, num_parallel_calls=AUTOTUNE)
+    return dataset.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def make_dataset(data_dir, subset=None, validation_split=0.2, batch_size=32, shuffle=None,
+                 augment_images=False, cache=True, seed=None):
+    paths, labels = list_files(data_dir, subset, validation_split)
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(decode_image, num_parallel_calls=AUTOTUNE, deterministic=False)
+    if shuffle is None:
+        shuffle = subset != 'validation'
+    return build_dataset(dataset, batch_size, shuffle, augment_images, cache, seed)
+
+
+def make_datasets(data_dir='data', validation_split=0.2, batch_size=32, augment_images=False, cache=True):
+    """Training and validation datasets, equivalent to the notebook's two generators"""
+    train_cache = f"{cache}_train" if isinstance(cache, str) else cache
+    val_cache = f"{cache}_val" if isinstance(cache, str) else cache
+    train_ds = make_dataset(data_dir, 'training', validation_split, batch_size,
+                            augment_images=augment_images, cache=train_cache)
+    val_ds = make_dataset(data_dir, 'validation', validation_split, batch_size, cache=val_cache)
+    return train_ds, val_ds
+
+
+# ----------- SHARDED TFRECORDS -------------
+
+def _serialize(image, label):
+    feature = {
+        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[tf.io.serialize_tensor(image).numpy()])),
+        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+    }
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def write_tfrecords(data_dir, output_dir, subset=None, validation_split=0.2, num_shards=8):
+    """Write the preprocessed 112x112 uint8 tensors to sharded TFRecord files"""
+    os.makedirs(output_dir, exist_ok=True)
+    paths, labels = list_files(data_dir, subset, validation_split)
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels)).map(decode_image, num_parallel_calls=AUTOTUNE)
+    prefix = subset or 'all'
+    shard_paths = [os.path.join(output_dir, f"{prefix}-{i:05d}-of-{num_shards:05d}.tfrecord") for i in range(num_shards)]
+    writers = [tf.io.TFRecordWriter(path) for path in shard_paths]
+    try:
+        for i, (image, label) in enumerate(dataset):
+            writers[i % num_shards].write(_serialize(image, label))
+    finally:
+        for writer in writers:
+            writer.close()
+    print(f"Wrote {len(paths)} images to {num_shards} shards in {output_dir}")
+    return shard_paths
+
+
+def _parse_example(record):
+    parsed = tf.io.parse_single_example(record, {
+        'image': tf.io.FixedLenFeature([], tf.string),
+        'label': tf.io.FixedLenFeature([], tf.int64),
+    })
+    image = tf.io.parse_tensor(parsed['image'], tf.uint8)
+    image = tf.ensure_shape(image, IMAGE_SIZE + (3,))
+    return image, parsed['label']
+
+
+def make_tfrecord_dataset(pattern, batch_size=32, shuffle=True, augment_images=False, cache=False, seed=None):
+    """Read shards written by write_tfrecords, interleaving files in parallel"""
+    files = tf.data.Dataset.list_files(pattern, shuffle=shuffle, seed=seed)
+    dataset = files.interleave(tf.data.TFRecordDataset, num_parallel_calls=AUTOTUNE, deterministic=False)
+    dataset = dataset.map(_parse_example, num_parallel_calls=AUTOTUNE)
+    return build_dataset(dataset, batch_size, shuffle, augment_images, cache, seed)
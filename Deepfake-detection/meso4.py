@@ -0,0 +1,76 @@
+"""
+Meso4 model definition, shared by the training notebook, the data pipeline
+benchmark and the server-side scorers.
+"""
+import numpy as np
+import tensorflow as tf
+from keras.models import Model
+from keras.layers import Conv2D, MaxPooling2D, Flatten, Dropout, Dense, LeakyReLU, BatchNormalization, Input
+
+
+class Meso4:
+    def __init__(self):
+        self.model = self.create_model()
+
+    def create_model(self):
+        inputs = Input(shape=(112, 112, 3))
+
+        # First convolutional block
+        x = Conv2D(8, (3, 3), padding='same', activation='relu')(inputs)
+        x = BatchNormalization()(x)
+        x = MaxPooling2D(pool_size=(2, 2), padding='same')(x)  # Output: (56, 56, 8)
+
+        # Second convolutional block
+        x = Conv2D(16, (5, 5), padding='same', activation='relu')(x)
+        x = BatchNormalization()(x)
+        x = MaxPooling2D(pool_size=(2, 2), padding='same')(x)  # Output: (28, 28, 16)
+
+        # Third convolutional block
+        x = Conv2D(32, (5, 5), padding='same', activation='relu')(x)
+        x = BatchNormalization()(x)
+        x = MaxPooling2D(pool_size=(2, 2), padding='same')(x)  # Output: (14, 14, 32)
+
+        # Fourth convolutional block
+        x = Conv2D(64, (5, 5), padding='same', activation='relu')(x)
+        x = BatchNormalization()(x)
+        x = MaxPooling2D(pool_size=(2, 2), padding='same')(x)  # Output: (7, 7, 64)
+
+        # Flatten and Dense layers
+        x = Flatten()(x)
+        x = Dropout(0.5)(x)
+        x = Dense(64)(x)
+        x = LeakyReLU(alpha=0.1)(x)
+        x = Dropout(0.5)(x)
+        x = Dense(1, activation='sigmoid')(x)
+
+        return Model(inputs=inputs, outputs=x)
+
+    def compile(self):
+        self.model.compile(
+            optimizer='adam',
+            loss='binary_crossentropy',
+            metrics=['accuracy']
+        )
+
+    def train(self, train_data, validation_data, epochs=10):
+        return self.model.fit(
+            train_data,
+            validation_data=validation_data,
+            epochs=epochs
+        )
+
+    def save_weights(self, path):
+        self.model.save_weights(path)
+        print(f"Weights saved to {path}")
+
+    def load_weights(self, path):
+        self.model.load_weights(path)
+        print(f"Weights loaded from {path}")
+
+    def predict_frame(self, frame):
+        frame_resized = tf.image.resize(frame, (112, 112))  # Resize to match model input
+        frame_resized = frame_resized / 255.0  # Normalize
+        frame_resized = np.expand_dims(frame_resized, axis=0)  # Add batch dimension
+
+        prediction = self.model.predict(frame_resized, verbose=0)
+        return prediction[0][0]
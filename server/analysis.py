@@ -12,175 +12,631 @@ import mediapipe as mp
 import librosa
 import threading
 import time
+import queue
 from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 # Import your existing functions from the scripts
 from face import detect_face_distortion
-from frame import detect_frame_anomalies
-from audio import analyze_video
+from frame import ANOMALY_THRESHOLD, detect_frame_anomalies
+from audio import analyze_video, analyze_video_segments
+from cancellation import CancellationToken, AnalysisCancelled, run_in_subprocess
+from scoring import DEFAULT_CONFIG, RISK_LEVELS, RISK_RESULTS, score_arrays
+from signal_store import content_hash, save_signals
+from frame_index import VERDICT_FIELDS, get_index, sample_signatures
+from cascade import run_cheap_stage
+from scheduler import plan_analysis, probe_video, record_timings
+from frame_prep import DETECTION_SIZE
+from segments import (SEGMENT_CACHE, face_part, fingerprint_segments, frame_part, merge_face, merge_frame,
+                      run_segmented)
+from memory_budget import MemoryBudget
+from parallel import run_time_segments, time_segments
 
-def run_with_timeout(func, args, timeout):
-    """Run a function with a timeout using ThreadPoolExecutor"""
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(func, *args)
+def run_with_timeout(func, args, timeout, grace=5):
+    """Run func(*args, cancel_token=...) with a real deadline.
+
+    The token trips after `timeout` seconds so the stages stop between frame
+    batches and return what they have. If the worker still hasn't returned
+    after the grace period we give up on it without waiting (the executor is
+    not joined), so the request is never held for the full analysis.
+    """
+    cancel_token = CancellationToken(timeout)
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(func, *args, cancel_token=cancel_token)
+    try:
+        return future.result(timeout=timeout + grace)
+    except TimeoutError:
+        cancel_token.cancel()
+        # Cleanup any resources before raising timeout
         try:
-            return future.result(timeout=timeout)
-        except TimeoutError:
-            # Cleanup any resources before raising timeout
-            if 'video_path' in args:
-                try:
-                    import cv2
-                    cv2.destroyAllWindows()
-                except:
-                    pass
-            raise TimeoutException("Analysis timed out")
+            cv2.destroyAllWindows()
+        except:
+            pass
+        raise TimeoutException("Analysis timed out")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 class TimeoutException(Exception):
     pass
 
-def process_video_internal(video_path):
-    """Internal function to process video without timeout handling"""
-    # Initialize results dictionary
-    results = {}
-    start_time = time.time()
+def compute_scores(results, config=DEFAULT_CONFIG):
+    """Fill in the detailed scores, confidence score and verdict from the raw stage counts.
 
-    # Increase frame skipping for faster processing
-    skip_frames = 10  # Changed from 5 to 10
-
-    # Step 1: Detect face distortion (total frames, distorted faces)
-    total_frames, distorted_faces = detect_face_distortion(video_path, skip_frames=skip_frames)
-    results['total_frames'] = total_frames
-    results['distorted_faces'] = distorted_faces
-
-    # Step 2: Detect frame anomalies
-    total_frames_processed, abnormal_frames_detected = detect_frame_anomalies(video_path, skip_frames=skip_frames)
-    results['total_frames_processed'] = total_frames_processed
-    results['abnormal_frames_detected'] = abnormal_frames_detected
-
-     # Step 3: Analyze video for audio-visual mismatch
-    try:
-        metrics, face_detection_rate = analyze_video(video_path)
-        results['face_detection_rate'] = face_detection_rate
-        results['cosine_similarity'] = metrics['cosine_similarity']
-        results['mismatch_score'] = metrics['mismatch_score']
-        results['euclidean_distance'] = metrics['euclidean_distance']
-    except Exception as e:
-        print(f"Error in audio analysis: {str(e)}")
-        results['audio_analysis_error'] = str(e)
-        results['face_detection_rate'] = 0
-        results['cosine_similarity'] = 0
-        results['mismatch_score'] = 1
-        results['euclidean_distance'] = 1
-
-    # Calculate scores
-    distorted_face_ratio = distorted_faces / max(total_frames, 1)
-    abnormal_frame_ratio = abnormal_frames_detected / max(total_frames_processed, 1)
-
-    # Step 4: Determine analysis result based on mismatch score
-    if metrics['mismatch_score'] < 0.5:
-        analysis_result = "Audio and visual content are well-aligned."
-    elif 0.5 <= metrics['mismatch_score'] < 0.7:
-        analysis_result = "Potential audio-visual misalignment detected."
-    else:
-        analysis_result = "Significant audio-visual misalignment detected."
-
-    results['analysis_result'] = analysis_result
-    distorted_face_ratio = distorted_faces / max(total_frames, 1)  # Avoid division by zero
-    abnormal_frame_ratio = abnormal_frames_detected / max(total_frames_processed, 1)  # Avoid division by zero
-
-       # Calculate individual scores (0-100 scale)
-    face_score = 100 * (1 - distorted_face_ratio) * results.get('face_detection_rate', 0)
-    frame_score = 100 * (1 - abnormal_frame_ratio)
-    
-    # Audio-visual sync score
-    av_sync_score = 100 * (
-        0.4 * results.get('cosine_similarity', 0) +
-        0.4 * (1 - results.get('mismatch_score', 1)) +
-        0.2 * (1 - results.get('euclidean_distance', 1))
-    )
+    Without audio metrics (the audio stage was skipped or hasn't finished) the
+    verdict is weighted over the face and frame stages alone, and the face
+    detection rate comes from the face stage (frames_with_faces).
+    """
+    has_audio = 'cosine_similarity' in results
+    if not has_audio:
+        results['face_detection_rate'] = results.get('frames_with_faces', 0) / max(results.get('total_frames', 0), 1)
+    scores = score_arrays({
+        'total_frames': [results.get('total_frames', 0)],
+        'distorted_faces': [results.get('distorted_faces', 0)],
+        'total_frames_processed': [results.get('total_frames_processed', 0)],
+        'abnormal_frames_detected': [results.get('abnormal_frames_detected', 0)],
+        'face_detection_rate': [results.get('face_detection_rate', 0)],
+        'cosine_similarity': [results.get('cosine_similarity', 0)],
+        'mismatch_score': [results.get('mismatch_score', 1)],
+        'euclidean_distance': [results.get('euclidean_distance', 1)],
+        'has_audio': [has_audio],
+    }, config)
+    face_score = float(scores['face_score'][0])
+    frame_score = float(scores['frame_score'][0])
+    av_sync_score = float(scores['av_sync_score'][0])
+    risk_index = int(scores['risk_index'][0])
 
     # Store individual scores for detailed analysis
     results['detailed_scores'] = {
         'face_quality_score': round(face_score, 2),
         'frame_quality_score': round(frame_score, 2),
-        'audio_visual_sync_score': round(av_sync_score, 2)
+        'audio_visual_sync_score': round(av_sync_score, 2) if has_audio else None
     }
 
-    # Dynamic weights based on detection quality
-    face_weight = 0.5 if results.get('face_detection_rate', 0) > 0.5 else 0.3
-    frame_weight = 0.3
-    av_weight = 0.2 if results.get('face_detection_rate', 0) > 0.5 else 0.4
-
-    # Calculate final confidence score
-    confidence_score = (
-        face_weight * face_score +
-        frame_weight * frame_score +
-        av_weight * av_sync_score
-    )
-
     # Ensure confidence score is within [0, 100]
-    results['confidence_score'] = round(max(0, min(100, confidence_score)), 2)
-
-    # More detailed analysis result
-    if confidence_score > 80:
-        results['analysis_result'] = "Very likely authentic content (>80% confidence)"
-        results['risk_level'] = "Low"
-    elif confidence_score > 65:
-        results['analysis_result'] = "Probably authentic content (65-80% confidence)"
-        results['risk_level'] = "Low-Medium"
-    elif confidence_score > 45:
-        results['analysis_result'] = "Uncertain authenticity (45-65% confidence)"
-        results['risk_level'] = "Medium"
-    elif confidence_score > 30:
-        results['analysis_result'] = "Likely manipulated content (30-45% confidence)"
-        results['risk_level'] = "Medium-High"
-    else:
-        results['analysis_result'] = "Very likely manipulated content (<30% confidence)"
-        results['risk_level'] = "High"
+    results['confidence_score'] = round(float(scores['confidence_score'][0]), 2)
+    results['analysis_result'] = RISK_RESULTS[risk_index]
+    results['risk_level'] = RISK_LEVELS[risk_index]
 
     # Add explanation of scores
     results['score_explanation'] = {
         'face_analysis': f"Face quality score: {round(face_score, 2)}% - Based on face detection and distortion analysis",
         'frame_analysis': f"Frame quality score: {round(frame_score, 2)}% - Based on frame anomaly detection",
-        'audio_sync': f"Audio-visual sync score: {round(av_sync_score, 2)}% - Based on lip sync and audio analysis",
+        'audio_sync': (f"Audio-visual sync score: {round(av_sync_score, 2)}% - Based on lip sync and audio analysis"
+                       if has_audio else f"Audio-visual sync not analyzed - {results.get('audio_analysis_error', 'Pending')}"),
         'weights_used': {
-            'face_weight': face_weight,
-            'frame_weight': frame_weight,
-            'audio_visual_weight': av_weight
+            'face_weight': float(scores['face_weight'][0]),
+            'frame_weight': float(scores['frame_weight'][0]),
+            'audio_visual_weight': float(scores['av_weight'][0])
         }
     }
+    return results
+
+def skip_audio(results, reason):
+    """Record that the audio stage did not run; its metrics stay unset (see compute_scores)"""
+    results['audio_analysis_error'] = f"Skipped: {reason}"
+
+def frames_with_faces(signals):
+    """Sampled frames the face stage found at least one face in"""
+    return len(set(signals.get('face_frame_index', [])))
+
+def set_audio_defaults(results, error):
+    """Neutral-to-pessimistic audio values used when the audio stage fails or is cut off"""
+    results['audio_analysis_error'] = error
+    results['face_detection_rate'] = 0
+    results['cosine_similarity'] = 0
+    results['mismatch_score'] = 1
+    results['euclidean_distance'] = 1
+
+def stage_status(cancel_token):
+    return 'partial' if cancel_token is not None and cancel_token.cancelled() else 'completed'
+
+# Increase frame skipping for faster processing
+SKIP_FRAMES = 10  # Changed from 5 to 10
+STAGES = ('face', 'frame', 'audio')
+# Minimum gap between progress events
+PROGRESS_INTERVAL = 0.5
+# Share of the budget segment fingerprinting (a decode of every frame) may take
+# before it is abandoned and the video is analyzed without the segment cache
+FINGERPRINT_BUDGET_SHARE = 0.25
+# Near-duplicates of earlier verdicts at these risk levels are answered from
+# the index; other matches are only reused once the upload's faces agree
+MANIPULATED_RISK_LEVELS = RISK_LEVELS[:2]
+# ...that is, its share of distorted faces is at most this much above the match's
+FACE_RECHECK_TOLERANCE = 0.05
+# Share of the budget that face recheck may take
+FACE_RECHECK_BUDGET_SHARE = 0.5
+
+def stage_plan(plan, stage):
+    """One stage's part of a scheduler plan (empty without a plan)"""
+    return plan['stages'][stage] if plan is not None else {}
+
+def offset_progress(on_progress, start):
+    """on_progress for one segment: its frame numbers count from the segment start"""
+    if on_progress is None:
+        return None
+    return lambda frame_count: on_progress(start + frame_count)
+
+def segment_progress(on_progress):
+    """on_segment callback that reports a finished (or cached) segment as read"""
+    if on_progress is None:
+        return None
+    return lambda segment: on_progress(segment['end'])
+
+def undegraded(memory_budget, stage):
+    """cacheable() for run_segmented: parts sampled sparser under memory pressure aren't cached"""
+    if memory_budget is None:
+        return None
+    return lambda: not memory_budget.is_degraded(stage)
+
+def run_face_stage(video_path, cancel_token, signals, on_progress=None, plan=None, segmentation=None,
+                   memory_budget=None):
+    """Detect face distortion (total frames, distorted faces)"""
+    face_plan = stage_plan(plan, 'face')
+    skip_frames = face_plan.get('skip_frames', SKIP_FRAMES)
+    detection_size = face_plan.get('detection_size')
+    if segmentation is None:
+        total_frames, distorted_faces = detect_face_distortion(
+            video_path, skip_frames=skip_frames, cancel_token=cancel_token,
+            signals=signals, on_progress=on_progress, detection_size=detection_size, memory_budget=memory_budget)
+    elif segmentation['mode'] == 'parallel':
+        parts = run_time_segments('face', video_path, segmentation['segments'],
+                                  {'skip_frames': skip_frames, 'detection_size': detection_size}, cancel_token, on_progress,
+                                  memory_budget)
+        total_frames, distorted_faces = merge_face(segmentation['segments'], parts, signals)
+    else:
+        def analyze(segment):
+            part_signals = {}
+            _, distorted = detect_face_distortion(
+                video_path, skip_frames=skip_frames, cancel_token=cancel_token, signals=part_signals,
+                on_progress=offset_progress(on_progress, segment['start']), detection_size=detection_size,
+                start_frame=segment['start'], end_frame=segment['end'], memory_budget=memory_budget)
+            return face_part(part_signals, distorted)
+
+        tag = f"s{skip_frames}-d{detection_size or DETECTION_SIZE}"
+        parts, segmentation['reused']['face'] = run_segmented(
+            'face', tag, segmentation['segments'], analyze, cancel_token, segment_progress(on_progress),
+            undegraded(memory_budget, 'face'))
+        total_frames, distorted_faces = merge_face(segmentation['segments'], parts, signals)
+    return {
+        'total_frames': total_frames,
+        'distorted_faces': distorted_faces,
+        'frames_with_faces': frames_with_faces(signals),
+    }, stage_status(cancel_token)
+
+def run_frame_stage(video_path, cancel_token, signals, on_progress=None, plan=None, segmentation=None,
+                    memory_budget=None):
+    """Detect frame anomalies"""
+    skip_frames = stage_plan(plan, 'frame').get('skip_frames', SKIP_FRAMES)
+    if segmentation is None:
+        total_frames_processed, abnormal_frames_detected = detect_frame_anomalies(
+            video_path, skip_frames=skip_frames, cancel_token=cancel_token,
+            signals=signals, on_progress=on_progress, memory_budget=memory_budget)
+    elif segmentation['mode'] == 'parallel':
+        parts = run_time_segments('frame', video_path, segmentation['segments'], {'skip_frames': skip_frames},
+                                  cancel_token, on_progress, memory_budget)
+        total_frames_processed, abnormal_frames_detected = merge_frame(
+            segmentation['segments'], parts, ANOMALY_THRESHOLD, signals)
+    else:
+        def analyze(segment):
+            part_signals = {}
+            _, abnormal = detect_frame_anomalies(
+                video_path, skip_frames=skip_frames, cancel_token=cancel_token, signals=part_signals,
+                on_progress=offset_progress(on_progress, segment['start']),
+                start_frame=segment['start'], end_frame=segment['end'], memory_budget=memory_budget)
+            return frame_part(part_signals, abnormal, skip_frames)
+
+        parts, segmentation['reused']['frame'] = run_segmented(
+            'frame', f"s{skip_frames}", segmentation['segments'], analyze, cancel_token, segment_progress(on_progress),
+            undegraded(memory_budget, 'frame'))
+        total_frames_processed, abnormal_frames_detected = merge_frame(
+            segmentation['segments'], parts, ANOMALY_THRESHOLD, signals)
+    return {
+        'total_frames_processed': total_frames_processed,
+        'abnormal_frames_detected': abnormal_frames_detected,
+    }, stage_status(cancel_token)
+
+def run_audio_stage(video_path, cancel_token, plan=None, segmentation=None):
+    """Analyze video for audio-visual mismatch.
+
+    The Wav2Vec2 forward pass can't poll the token, so it runs in a
+    subprocess we can kill.
+    """
+    results = {}
+    audio_plan = stage_plan(plan, 'audio')
+    if not audio_plan.get('enabled', True):
+        skip_audio(results, audio_plan['reason'])
+        return results, 'skipped'
+    try:
+        if segmentation is not None and segmentation['mode'] == 'cache':
+            metrics, face_detection_rate, segmentation['reused']['audio'] = run_in_subprocess(
+                analyze_video_segments, (video_path, segmentation['segments']), cancel_token)
+        elif cancel_token is None:
+            metrics, face_detection_rate = analyze_video(video_path)
+        else:
+            metrics, face_detection_rate = run_in_subprocess(analyze_video, (video_path,), cancel_token)
+        results['face_detection_rate'] = face_detection_rate
+        results['cosine_similarity'] = metrics['cosine_similarity']
+        results['mismatch_score'] = metrics['mismatch_score']
+        results['euclidean_distance'] = metrics['euclidean_distance']
+        return results, 'completed'
+    except AnalysisCancelled as e:
+        print(f"Audio analysis cancelled: {str(e)}")
+        set_audio_defaults(results, 'Cancelled: deadline reached')
+        return results, 'cancelled'
+    except Exception as e:
+        print(f"Error in audio analysis: {str(e)}")
+        set_audio_defaults(results, str(e))
+        return results, 'failed'
+
+def to_json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+def iter_analysis_events(video_path, cancel_token=None, plan=None, segmentation=None):
+    """Run the face, frame and audio stages in parallel and yield (event, data) as they happen.
+
+    Events: 'progress' (percent of the video processed), 'stage' (one
+    stage's results as soon as it finishes), 'score' (provisional confidence
+    from the stages done so far) and finally 'result' (the full response).
+    Every stage checks cancel_token; once it trips, finished stages keep
+    their results and running ones return their partial counts. Closing the
+    generator early cancels the stages as well.
+
+    plan (see scheduler.plan_analysis) sets each stage's sampling and
+    resolution; its measured stage times feed back into the scheduler.
+    segmentation (see segment_video) either makes every stage reuse cached
+    segment results and analyze only the segments it hasn't seen, or has
+    the face and frame stages analyze time segments in parallel workers. The request runs
+    under a MemoryBudget: stages sample sparser as it nears the allowance,
+    and its peak RSS is reported in results['memory'].
+    """
+    if cancel_token is None:
+        cancel_token = CancellationToken()
+    start_time = time.time()
+    memory_budget = MemoryBudget()
+    results = {'content_hash': content_hash(video_path)}
+    stages = {}
+    signals = {}
+    timings = {}
+    events = queue.Queue()
+
+    cap = cv2.VideoCapture(video_path)
+    video_frames = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+    cap.release()
+    frames_read = {'face': 0, 'frame': 0}
+
+    def progress_callback(stage):
+        def on_progress(frame_count):
+            frames_read[stage] = frame_count
+        return on_progress
+
+    def run(stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            outcome = func(*args, **kwargs)
+        except Exception as e:
+            outcome = e
+        timings[stage] = (time.perf_counter() - started) * 1000
+        events.put((stage, outcome))
+
+    executor = ThreadPoolExecutor(max_workers=len(STAGES))
+    try:
+        executor.submit(run, 'face', run_face_stage, video_path, cancel_token, signals, progress_callback('face'),
+                        plan=plan, segmentation=segmentation, memory_budget=memory_budget)
+        executor.submit(run, 'frame', run_frame_stage, video_path, cancel_token, signals, progress_callback('frame'),
+                        plan=plan, segmentation=segmentation, memory_budget=memory_budget)
+        executor.submit(run, 'audio', run_audio_stage, video_path, cancel_token, plan=plan, segmentation=segmentation)
+
+        last_percent = None
+        while len(stages) < len(STAGES):
+            try:
+                stage, outcome = events.get(timeout=PROGRESS_INTERVAL)
+            except queue.Empty:
+                stage, outcome = None, None
+
+            if stage is not None:
+                if isinstance(outcome, Exception):
+                    print(f"Error in {stage} stage: {str(outcome)}")
+                    stage_results, status = ({} if stage != 'audio' else {'audio_analysis_error': str(outcome)}), 'failed'
+                else:
+                    stage_results, status = outcome
+                results.update(stage_results)
+                stages[stage] = status
+                if stage in frames_read:
+                    frames_read[stage] = video_frames
+                yield 'stage', {
+                    'stage': stage,
+                    'status': status,
+                    'results': {key: to_json_value(value) for key, value in stage_results.items()},
+                }
+
+                # Provisional score from what's done; until audio is in, it is
+                # weighted over the face and frame stages
+                provisional = dict(results)
+                compute_scores(provisional)
+                yield 'score', {
+                    'confidence_score': provisional['confidence_score'],
+                    'risk_level': provisional['risk_level'],
+                    'stages_completed': sorted(stages),
+                    'provisional': len(stages) < len(STAGES),
+                }
+
+            # Audio can't report progress, so it counts as 0% until it finishes
+            done = sum(min(frames_read[name], video_frames) for name in frames_read) / video_frames
+            percent = round(100 * (done + (1 if 'audio' in stages else 0)) / len(STAGES), 1)
+            if percent != last_percent:
+                last_percent = percent
+                yield 'progress', {'percent_processed': percent}
+    finally:
+        if len(stages) < len(STAGES):
+            # Generator closed early (e.g. client disconnected): stop the stages
+            cancel_token.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        results['memory'] = memory_budget.close()
+
+    # Score whatever the stages produced; a skipped audio stage is left out
+    if 'audio_analysis_error' in results and stages.get('audio') != 'skipped':
+        set_audio_defaults(results, results['audio_analysis_error'])
+    compute_scores(results)
+
+    results['stage_status'] = stages
+    if segmentation is not None and segmentation['mode'] == 'parallel':
+        results['parallel'] = {
+            'segments': len(segmentation['segments']),
+            'boundaries': [segment['start'] for segment in segmentation['segments'][1:]],
+        }
+    elif segmentation is not None:
+        results['segment_cache'] = {
+            'segments': len(segmentation['segments']),
+            'reused': dict(segmentation['reused']),
+        }
+    if plan is not None:
+        results['plan'] = dict(plan, stage_ms={stage: round(ms) for stage, ms in timings.items()})
+        # Only full-length runs over uncached segments, sampled as planned, are representative of the per-frame cost
+        completed = {stage: ms for stage, ms in timings.items()
+                     if stages.get(stage) == 'completed' and not (segmentation or {}).get('reused', {}).get(stage)
+                     and not memory_budget.is_degraded(stage)}
+        record_timings(plan, completed)
+    if cancel_token.cancelled():
+        results['status'] = 'partial'
+        results['warning'] = 'Deadline reached - results are based on the stages that finished'
+    else:
+        # Keep the raw per-frame signals so scoring can be retuned without re-running the models
+        signals['has_audio'] = float('cosine_similarity' in results)
+        for key in ('face_detection_rate', 'cosine_similarity', 'mismatch_score', 'euclidean_distance'):
+            signals[key] = results.get(key, 0)
+        try:
+            save_signals(results['content_hash'], signals)
+        except Exception as e:
+            print(f"Error saving signals: {str(e)}")
 
     processing_time = time.time() - start_time
     results['processing_time'] = round(processing_time, 2)
+    yield 'result', results
+
+def process_video_internal(video_path, plan=None, segmentation=None, cancel_token=None):
+    """Internal function to process video: the final result of iter_analysis_events"""
+    for event, data in iter_analysis_events(video_path, cancel_token, plan, segmentation):
+        if event == 'result':
+            return data
+
+def known_duplicate_result(match):
+    """Response for an upload that matched an earlier analysis in the frame index"""
+    results = {field: match[field] for field in VERDICT_FIELDS if match.get(field) is not None}
+    results['near_duplicate'] = {
+        'matched_content_hash': match.get('content_hash'),
+        'match_fraction': match['match_fraction'],
+    }
+    results['processing_time'] = 0
     return results
 
-def process_video(video_path):
-    """Main function to process video with timeout handling"""
+def validate_video(video_path):
+    """(error response or None, timeout in seconds) for an uploaded video"""
+    # Validate video file exists
+    if not os.path.exists(video_path):
+        return {
+            'error': 'Video file not found',
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed - file not found'
+        }, None
+
+    # Check file size
+    file_size = os.path.getsize(video_path) / (1024 * 1024)  # Size in MB
+    if file_size > 100:  # If file is larger than 100MB
+        return {
+            'error': 'Video file too large (max 100MB)',
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed - file too large'
+        }, None
+
+    # Increase timeout to 90 seconds for larger files. Stages stop at the
+    # deadline and return partial results instead of failing outright.
+    return None, 90 if file_size > 50 else 60
+
+def segment_video(video_path, cancel_token=None):
+    """{'mode', 'segments', 'reused'}: keyframe-aligned time segments analyzed in parallel
+    ('parallel') for long videos, content-defined segments for the segment cache ('cache')
+    otherwise, or None when neither applies (or fingerprinting outlasts cancel_token)."""
     try:
-        # Validate video file exists
-        if not os.path.exists(video_path):
-            return {
-                'error': 'Video file not found',
-                'status': 'failed',
-                'confidence_score': 0,
-                'analysis_result': 'Analysis failed - file not found'
-            }
-
-        # Check file size
-        file_size = os.path.getsize(video_path) / (1024 * 1024)  # Size in MB
-        if file_size > 100:  # If file is larger than 100MB
-            return {
-                'error': 'Video file too large (max 100MB)',
-                'status': 'failed',
-                'confidence_score': 0,
-                'analysis_result': 'Analysis failed - file too large'
-            }
-
-        # Increase timeout to 90 seconds for larger files
-        timeout = 90 if file_size > 50 else 60
-        
-        # Run analysis
-        results = run_with_timeout(process_video_internal, [video_path], timeout)
+        segments = time_segments(video_path)
+        if segments is not None:
+            return {'mode': 'parallel', 'segments': segments, 'reused': {}}
+    except Exception as e:
+        print(f"Error splitting time segments: {str(e)}")
+    if not SEGMENT_CACHE:
+        return None
+    try:
+        segments = fingerprint_segments(video_path, cancel_token)
+    except Exception as e:
+        print(f"Error fingerprinting segments: {str(e)}")
+        return None
+    if segments is None:
+        print("Segment fingerprinting ran out of time; analyzing without the segment cache")
+        return None
+    return {'mode': 'cache', 'segments': segments, 'reused': {}}
+
+def fingerprint_token(timeout, budget_ms=None):
+    """Deadline for segment_video: its share of the request's budget"""
+    budget = budget_ms / 1000 if budget_ms is not None else timeout
+    return CancellationToken(budget * FINGERPRINT_BUDGET_SHARE)
+
+def face_recheck_token(timeout, budget_ms=None):
+    """Deadline for a near-duplicate's face recheck: its share of the request's budget"""
+    budget = budget_ms / 1000 if budget_ms is not None else timeout
+    return CancellationToken(budget * FACE_RECHECK_BUDGET_SHARE)
+
+def schedule(video_path, timeout, budget_ms=None, started=None, segmentation=None):
+    """(plan or None, deadline in seconds) for the full pipeline.
+
+    Without a budget the size-based timeout is the budget. Time already spent
+    since `started` (shortcuts, probing) is taken off it. Parallel time
+    segments spread the face and frame work over that many workers.
+    """
+    if budget_ms is None:
+        budget_ms = timeout * 1000
+    try:
+        probe = probe_video(video_path)
+    except Exception as e:
+        print(f"Error probing video: {str(e)}")
+        return None, budget_ms / 1000
+    spent_ms = (time.time() - started) * 1000 if started is not None else 0
+    workers = 1
+    if segmentation is not None and segmentation['mode'] == 'parallel':
+        # Face and frame share the worker pool
+        workers = max(1, len(segmentation['segments']) // 2)
+    plan = plan_analysis(probe, max(budget_ms - spent_ms, 0), workers)
+    return plan, plan['budget_ms'] / 1000
+
+def face_recheck(video_path, match, cancel_token):
+    """Face stage counts for an upload that matched a non-manipulated earlier
+    verdict, or None unless they agree with it (an entry indexed without face
+    counts, or a recheck cut short, never agrees)"""
+    if not match.get('total_frames') or match.get('distorted_faces') is None:
+        return None
+    total_frames, distorted_faces = detect_face_distortion(video_path, SKIP_FRAMES, cancel_token=cancel_token)
+    if cancel_token.cancelled() or not total_frames:
+        return None
+    if distorted_faces / total_frames > match['distorted_faces'] / match['total_frames'] + FACE_RECHECK_TOLERANCE:
+        return None
+    return {'total_frames': total_frames, 'distorted_faces': distorted_faces}
+
+def run_shortcuts(video_path, cascade=None, recheck_token=None):
+    """Checks that can answer without the full pipeline.
+
+    recheck_token bounds the face recheck of a match against an earlier
+    authentic or uncertain verdict (see face_recheck_token).
+    Returns (early result or None, frame signatures for indexing, cascade info).
+    """
+    # Look the upload up in the near-duplicate index first; a strong match
+    # to a manipulated video returns the earlier verdict without running the
+    # pipeline. Any other match could be a face swap of that footage, so its
+    # verdict is only reused if the upload's own faces agree.
+    signatures = None
+    try:
+        signatures = sample_signatures(video_path)
+        match = get_index().query(signatures)
+        if match is not None and match.get('risk_level') in MANIPULATED_RISK_LEVELS:
+            return known_duplicate_result(match), signatures, None
+        if match is not None:
+            recheck = face_recheck(video_path, match, recheck_token or CancellationToken())
+            if recheck is not None:
+                results = known_duplicate_result(match)
+                results['near_duplicate']['face_recheck'] = recheck
+                return results, signatures, None
+    except Exception as e:
+        print(f"Error in near-duplicate lookup: {str(e)}")
+
+    # Cascade stage 1: the cheap scorer decides clear-cut videos on its own
+    cascade_info = None
+    if cascade is not None:
+        try:
+            decisive, cascade_info = run_cheap_stage(video_path, cascade)
+            if decisive is not None:
+                # Keyed like a full analysis, for history and the signal store
+                decisive['content_hash'] = content_hash(video_path)
+                return decisive, signatures, cascade_info
+        except Exception as e:
+            print(f"Error in cascade cheap stage: {str(e)}")
+    return None, signatures, cascade_info
+
+def index_result(signatures, results):
+    # Only complete analyses are indexed, so partial verdicts are never reused
+    if signatures is not None and 'error' not in results and results.get('status') != 'partial':
+        try:
+            get_index().add(signatures, results)
+        except Exception as e:
+            print(f"Error updating near-duplicate index: {str(e)}")
+
+def process_video_stream(video_path, cascade=None, budget_ms=None):
+    """Streaming counterpart of process_video: yields (event, data) pairs.
+
+    Each stage's results are emitted as soon as that stage finishes, followed
+    by a provisional score and progress updates; the last event is 'result'
+    (the same document process_video returns) or 'error'.
+    """
+    started = time.time()
+    try:
+        error, timeout = validate_video(video_path)
+        if error is not None:
+            yield 'error', error
+            return
+
+        early, signatures, cascade_info = run_shortcuts(video_path, cascade, face_recheck_token(timeout, budget_ms))
+        if cascade_info is not None:
+            yield 'cascade', cascade_info
+        if early is not None:
+            yield 'result', early
+            return
+
+        segmentation = segment_video(video_path, fingerprint_token(timeout, budget_ms))
+        plan, deadline = schedule(video_path, timeout, budget_ms, started, segmentation)
+        if plan is not None:
+            yield 'plan', plan
+        for event, data in iter_analysis_events(video_path, CancellationToken(deadline), plan, segmentation):
+            if event == 'result':
+                if cascade_info is not None:
+                    data['cascade'] = cascade_info
+                index_result(signatures, data)
+            yield event, data
+    except Exception as e:
+        print(f"Error in process_video_stream: {str(e)}")
+        yield 'error', {
+            'error': str(e),
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed due to technical error'
+        }
+
+def process_video(video_path, cascade=None, budget_ms=None):
+    """Main function to process video with timeout handling.
+
+    If cascade is a thresholds dict (see cascade.cascade_thresholds), the
+    cheap Meso4 stage runs first and only uncertain videos get the full pipeline.
+    budget_ms is the latency budget the scheduler plans sampling against
+    (the size-based timeout when not given); the chosen plan is in results['plan'].
+    """
+    timeout = None
+    started = time.time()
+    try:
+        error, timeout = validate_video(video_path)
+        if error is not None:
+            return error
+
+        # A known near-duplicate or a decisive cheap cascade stage skips the pipeline
+        early, signatures, cascade_info = run_shortcuts(video_path, cascade, face_recheck_token(timeout, budget_ms))
+        if early is not None:
+            return early
+
+        # Run analysis with the sampling the scheduler picked for the budget
+        # Cut into segments first: parallel time segments for long videos,
+        # cached content segments otherwise. The time this takes comes off
+        # the budget the plan gets.
+        segmentation = segment_video(video_path, fingerprint_token(timeout, budget_ms))
+        plan, timeout = schedule(video_path, timeout, budget_ms, started, segmentation)
+        results = run_with_timeout(process_video_internal, [video_path, plan, segmentation], timeout)
+        if cascade_info is not None:
+            results['cascade'] = cascade_info
+        index_result(signatures, results)
         
         # Cleanup
         try:
@@ -217,10 +673,9 @@ def process_video(video_path):
             'analysis_result': 'Analysis failed due to technical error'
         }
     finally:
-        # Additional cleanup
+        # Frame buffers are pooled (frame_pool) and bounded per request, so
+        # there is no full gc pass here; only hand cached GPU blocks back
         try:
-            import gc
-            gc.collect()
             torch.cuda.empty_cache()  # If using GPU
         except:
             pass
\ No newline at end of file
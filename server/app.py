@@ -1,40 +1,72 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from transformers import pipeline
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
-import mediapipe as mp
 import nbformat
 from nbconvert import PythonExporter
 from flask_cors import CORS
 import os
 from senti import analyze_video_sentiment  # Ensure this function works properly
 from audio import analyze_video
-from frame import detect_frame_anomalies
-from face import detect_face_distortion
-from analysis import process_video
+from frame import detect_frame_anomalies, load_model as load_frame_model
+from face import detect_face_distortion, load_models as load_face_models
+from analysis import process_video, process_video_stream
+from bundle import BundleError, analyze_bundle, load_bundle
+from multiplex import analyze_multiplexed, parse_analyzers
+from history import get_history
+from memory_budget import MONITOR
+from frame_pool import FRAME_POOL
+from cascade import cascade_thresholds
+from batching import MicroBatcher
+import model_store
+from av_sync import analyze_sync
 from werkzeug.utils import secure_filename
 import logging
 import io
+import json
+import math
+import uuid
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Debugging: Print when server starts
-print("🚀 Server is running at http://127.0.0.1:5000/")
-
-# Load deepfake detection model
-pipe = pipeline("image-classification", model="prithivMLmods/Deep-Fake-Detector-Model")
-
-# Initialize MediaPipe FaceMesh
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    static_image_mode=True,
-    max_num_faces=1,
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5,
-)
+# Models are built on first use (and warmed up in __main__ below): spawned
+# subprocess and pool workers re-import this module, and must not load the
+# ViT pipeline, FaceMesh or the batcher thread just to run one stage
+_pipe = None
+_vit_batcher = None
+_face_mesh = None
+
+def get_pipe():
+    """Deepfake detection model (pinned local copy from the model store if it has been fetched)"""
+    global _pipe
+    if _pipe is None:
+        _pipe = model_store.load_deepfake_pipeline()
+    if _pipe is None:
+        _pipe = pipeline("image-classification", model="prithivMLmods/Deep-Fake-Detector-Model")
+    return _pipe
+
+def get_vit_batcher():
+    """Concurrent /predict image requests are coalesced into batched forward passes"""
+    global _vit_batcher
+    if _vit_batcher is None:
+        pipe = get_pipe()
+        _vit_batcher = MicroBatcher(lambda images: pipe(images, batch_size=len(images)), name='vit')
+    return _vit_batcher
+
+def get_face_mesh():
+    """MediaPipe FaceMesh for /predict's landmark distortion score"""
+    global _face_mesh
+    if _face_mesh is None:
+        _face_mesh = model_store.load_face_mesh(
+            static_image_mode=True,
+            max_num_faces=1,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5,
+        )
+    return _face_mesh
 
 # Add these configurations at the top of app.py after the imports
 UPLOAD_FOLDER = '/tmp'
@@ -48,6 +80,34 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def cascade_from_request():
+    """Thresholds dict if the request asked for cascade mode (?cascade=1), else None.
+    Raises ValueError for invalid ?fake_threshold= / ?real_threshold= values."""
+    if request.args.get('cascade', '').lower() not in ('1', 'true', 'yes'):
+        return None
+    return cascade_thresholds(request.args.get('fake_threshold'), request.args.get('real_threshold'))
+
+def budget_from_request():
+    """Latency budget in ms from ?budget_ms=, or None for the default size-based one.
+    Raises ValueError unless it is a finite number above 0."""
+    budget_ms = request.args.get('budget_ms')
+    if not budget_ms:
+        return None
+    try:
+        budget_ms = float(budget_ms)
+    except ValueError:
+        raise ValueError("budget_ms must be a number")
+    if not math.isfinite(budget_ms) or budget_ms <= 0:
+        raise ValueError("budget_ms must be a finite number above 0")
+    return budget_ms
+
+def invalid_parameters(e):
+    return jsonify({
+        'error': str(e),
+        'message': 'Invalid request parameters',
+        'status': 'failed'
+    }), 400
+
 
 @app.route("/", methods=["GET"])
 def hello():
@@ -135,6 +195,35 @@ def analyze_audio_vid():
         return jsonify({"error": "Failed to analyze video"}), 500
 
 
+# ----------- WINDOWED AUDIO-VISUAL SYNC ROUTE -------------
+@app.route("/analyze_sync", methods=["POST"])
+def analyze_sync_vid():
+    print("DEBUG: Received request to /analyze_sync")
+
+    if "video" not in request.files:
+        print("DEBUG: No file received in request.files")
+        return jsonify({"error": "No video uploaded"}), 400
+
+    video_file = request.files["video"]
+    print(f"DEBUG: Received video file: {video_file.filename}")
+
+    # Save the file temporarily
+    video_path = os.path.join(UPLOAD_FOLDER, secure_filename(video_file.filename))
+    video_file.save(video_path)
+    print(f"DEBUG: Video saved to {video_path}")
+
+    try:
+        result = analyze_sync(video_path)
+        print("DEBUG: Sync analysis successful")
+        return jsonify(result)
+    except Exception as e:
+        print(f"ERROR: Sync analysis failed - {e}")
+        return jsonify({"error": "Failed to analyze video"}), 500
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+
 # ----------- FIXED VIDEO ANALYSIS ROUTE -------------
 @app.route("/analyze_sentiment", methods=["POST"])
 def analyze_sentiment():
@@ -168,7 +257,7 @@ def analyze_sentiment():
 def calculate_face_distortion(image):
     """Detects facial landmarks and calculates distortion score."""
     image_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    results = face_mesh.process(image_cv)
+    results = get_face_mesh().process(image_cv)
 
     if not results.multi_face_landmarks:
         return {"error": "No face detected"}
@@ -237,6 +326,11 @@ def detect_deepfake():
         allowed_extensions = {'mp4', 'avi', 'mov', 'mkv'}
         if not video_file.filename.lower().endswith(tuple(allowed_extensions)):
             return jsonify({"error": "Invalid video format"}), 400
+        try:
+            cascade = cascade_from_request()
+            budget_ms = budget_from_request()
+        except ValueError as e:
+            return invalid_parameters(e)
 
         # Save video to temporary file
         temp_path = os.path.join('/tmp', video_file.filename)
@@ -244,7 +338,8 @@ def detect_deepfake():
 
         try:
             # Process video
-            results = process_video(temp_path)
+            results = process_video(temp_path, cascade=cascade, budget_ms=budget_ms)
+            get_history().record(results, 'predict', video_file.filename)
             
             # Clean up temporary file
             try:
@@ -262,7 +357,7 @@ def detect_deepfake():
                 "analysis_result": "Analysis failed"
             }), 500
 
-    # Handle image file
+    # Handle image file (a single ViT pass: ?cascade=1 only applies to videos)
 
     image_file = request.files["image"]
     print(f"DEBUG: Received image file: {image_file.filename}")
@@ -278,7 +373,7 @@ def detect_deepfake():
     image.save(img_io, format=image.format or 'PNG')  # Use original format or PNG as fallback
     img_io.seek(0)
 
-    result = pipe(image)
+    result = get_vit_batcher().predict(image)
     best_prediction = max(result, key=lambda x: x["score"])
     distortion_data = calculate_face_distortion(image)
 
@@ -311,13 +406,20 @@ def process_video_endpoint():
                 'status': 'failed'
             }), 400
 
+        try:
+            cascade = cascade_from_request()
+            budget_ms = budget_from_request()
+        except ValueError as e:
+            return invalid_parameters(e)
+
         # Save the uploaded file temporarily
         temp_path = os.path.join('/tmp', secure_filename(video_file.filename))
         video_file.save(temp_path)
 
         try:
             # Process the video
-            results = process_video(temp_path)
+            results = process_video(temp_path, cascade=cascade, budget_ms=budget_ms)
+            get_history().record(results, 'process_video', video_file.filename)
             
             # Check if processing failed
             if 'error' in results:
@@ -338,6 +440,183 @@ def process_video_endpoint():
             'status': 'failed'
         }), 500
 
+@app.route("/process_bundle", methods=["POST"])
+def process_bundle_endpoint():
+    """Same analysis as /process_video on a client-sampled bundle instead of the whole video.
+
+    Multipart fields: 'frames' (JPEG keyframes or face crops, repeated),
+    'timestamps' (JSON list of seconds, one per frame), 'kind' ('keyframes'
+    or 'faces') and an optional 'audio' (mono WAV).
+    """
+    frame_files = request.files.getlist('frames')
+    if not frame_files:
+        return jsonify({
+            'error': 'No frames uploaded',
+            'message': 'Please upload the bundle frames',
+            'status': 'failed'
+        }), 400
+
+    audio_path = None
+    try:
+        timestamps = request.form.get('timestamps')
+        timestamps = json.loads(timestamps) if timestamps else None
+        audio_file = request.files.get('audio')
+        if audio_file:
+            audio_path = os.path.join('/tmp', f"{uuid.uuid4().hex}_bundle_audio.wav")
+            audio_file.save(audio_path)
+        bundle = load_bundle([file.read() for file in frame_files], timestamps,
+                             request.form.get('kind', 'keyframes'), audio_path)
+    except (BundleError, ValueError, TypeError) as e:
+        if audio_path is not None and os.path.exists(audio_path):
+            os.remove(audio_path)
+        return jsonify({
+            'error': str(e),
+            'message': 'Invalid bundle',
+            'status': 'failed'
+        }), 400
+
+    try:
+        results = analyze_bundle(bundle)
+        get_history().record(results, 'process_bundle')
+        if 'error' in results:
+            return jsonify(results), 500
+        return jsonify(results), 200
+    finally:
+        if audio_path is not None and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+@app.route("/analyze", methods=["POST"])
+def analyze_endpoint():
+    """Several analyzers over one upload and one decode of the video.
+
+    'analyzers' (form or query, repeated or comma-separated) picks from
+    verdict, distortions, frame, audio, sync and sentiment; without it the
+    five the dashboard shows run. Returns a section per analyzer.
+    """
+    if 'video' not in request.files or not request.files['video']:
+        return jsonify({
+            'error': 'No video file uploaded',
+            'message': 'Please upload a video file',
+            'status': 'failed'
+        }), 400
+    try:
+        analyzers = parse_analyzers(request.form.getlist('analyzers') + request.args.getlist('analyzers'))
+    except ValueError as e:
+        return jsonify({
+            'error': str(e),
+            'message': 'Invalid analyzers',
+            'status': 'failed'
+        }), 400
+
+    video_file = request.files['video']
+    temp_path = os.path.join('/tmp', f"{uuid.uuid4().hex}_{secure_filename(video_file.filename)}")
+    video_file.save(temp_path)
+    try:
+        results = analyze_multiplexed(temp_path, analyzers)
+        if 'verdict' in results:
+            get_history().record(results['verdict'], 'analyze', video_file.filename)
+        if 'error' in results:
+            return jsonify(results), 500
+        return jsonify(results), 200
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def sse_event(event, data):
+    """Format one Server-Sent Event (numpy scalars are sent as plain floats)"""
+    return f"event: {event}\ndata: {json.dumps(data, default=float)}\n\n"
+
+@app.route("/process_video/stream", methods=["POST"])
+def process_video_stream_endpoint():
+    """Same analysis as /process_video, streamed as Server-Sent Events.
+
+    Emits 'plan' with the sampling chosen for the latency budget, 'stage' as each of face / frame / audio-visual finishes, 'score'
+    with the running confidence, 'progress' with the percent of the video
+    processed, and finally 'result' (or 'error').
+    """
+    if 'video' not in request.files or not request.files['video']:
+        return jsonify({
+            'error': 'No video file uploaded',
+            'message': 'Please upload a video file',
+            'status': 'failed'
+        }), 400
+
+    try:
+        cascade = cascade_from_request()
+        budget_ms = budget_from_request()
+    except ValueError as e:
+        return invalid_parameters(e)
+
+    video_file = request.files['video']
+    # Unique name: the file outlives this function while the stream runs
+    temp_path = os.path.join('/tmp', f"{uuid.uuid4().hex}_{secure_filename(video_file.filename)}")
+    video_file.save(temp_path)
+    filename = video_file.filename
+
+    def generate():
+        events = process_video_stream(temp_path, cascade=cascade, budget_ms=budget_ms)
+        try:
+            for event, data in events:
+                if event in ('result', 'error'):
+                    get_history().record(data, 'process_video_stream', filename)
+                yield sse_event(event, data)
+        finally:
+            # Runs on normal completion and on client disconnect; closing the
+            # analysis generator cancels any stages still running
+            events.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route("/history", methods=["GET"])
+def history_list():
+    """Past analyses, newest first: ?limit=, ?cursor= (next_cursor of the previous page),
+    ?risk_level=, ?content_hash=, ?since= / ?until= (unix seconds)"""
+    try:
+        items, next_cursor = get_history().list(
+            limit=request.args.get('limit', 50),
+            cursor=request.args.get('cursor'),
+            risk_level=request.args.get('risk_level'),
+            content_hash=request.args.get('content_hash'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'failed'}), 400
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@app.route("/history/<int:analysis_id>", methods=["GET"])
+def history_get(analysis_id):
+    """Full stored result of one past analysis"""
+    item = get_history().get(analysis_id)
+    if item is None:
+        return jsonify({'error': 'Analysis not found', 'status': 'failed'}), 404
+    return jsonify(item)
+
+@app.route("/models", methods=["GET"])
+def models_report():
+    """Pinned model versions and per-model resident memory of their weight mappings"""
+    manifest = model_store.load_manifest()
+    return jsonify({
+        'versions': {name: entry['version'] for name, entry in manifest.items()},
+        'memory': model_store.memory_report(),
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Micro-batching queue metrics (batch sizes, queue wait, batch latency), history writer backlog,
+    per-request peak RSS and the frame pool"""
+    return jsonify({
+        'batchers': [_vit_batcher.stats()] if _vit_batcher is not None else [],
+        'history': get_history().stats(),
+        'memory': MONITOR.stats(),
+        'frame_pool': FRAME_POOL.stats(),
+    })
+
 # Add error handler for file too large
 @app.errorhandler(413)
 def too_large(e):
@@ -351,4 +630,13 @@ def too_large(e):
 # ----------- RUN FLASK APP -------------
 
 if __name__ == "__main__":
+    # Debugging: Print when server starts
+    print("🚀 Server is running at http://127.0.0.1:5000/")
+
+    # Load the models up front so the first requests do not pay for it
+    get_vit_batcher()
+    get_face_mesh()
+    load_face_models()
+    load_frame_model()
+
     app.run(debug=True)
\ No newline at end of file
@@ -5,46 +5,141 @@ import librosa
 from moviepy import VideoFileClip
 from transformers import Wav2Vec2Processor, Wav2Vec2Model
 import torch
-import mediapipe as mp
 import cv2
 import matplotlib.pyplot as plt
 import json
+import tempfile
+import model_store
+import segments
 
 def extract_audio(video_path, output_audio_path="temp_audio.wav"):
     video = VideoFileClip(video_path)
     video.audio.write_audiofile(output_audio_path, codec='pcm_s16le')
     return output_audio_path
 
-def process_audio(audio_path):
-    processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h")
-    model = Wav2Vec2Model.from_pretrained("facebook/wav2vec2-base-960h")
-    waveform, sample_rate = librosa.load(audio_path, sr=16000)
-    inputs = processor(waveform, sampling_rate=sample_rate, return_tensors="pt")
+# Long audio is embedded in overlapping fixed-length windows so attention
+# memory stays bounded; clips up to one window long take a single pass.
+AUDIO_WINDOW_SECONDS = float(os.environ.get('AUDIO_WINDOW_SECONDS', 20))
+AUDIO_WINDOW_OVERLAP_SECONDS = float(os.environ.get('AUDIO_WINDOW_OVERLAP_SECONDS', 1))
+AUDIO_BATCH_SIZE = int(os.environ.get('AUDIO_BATCH_SIZE', 4))
+AUDIO_SAMPLE_RATE = 16000
+# Wav2Vec2's conv feature encoder emits one frame per 320 samples (20ms)
+FRAME_STRIDE = 320
+
+_wav2vec2 = None
+
+def load_wav2vec2():
+    """Load the processor and model once per process"""
+    global _wav2vec2
+    if _wav2vec2 is None:
+        # Pinned, memory-mapped copy from the local model store when available
+        _wav2vec2 = model_store.load_wav2vec2()
+    if _wav2vec2 is None:
+        processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h")
+        model = Wav2Vec2Model.from_pretrained("facebook/wav2vec2-base-960h")
+        model.eval()
+        _wav2vec2 = (processor, model)
+    return _wav2vec2
+
+def window_starts(num_samples, window, step):
+    """Window start offsets (multiples of FRAME_STRIDE) covering the whole waveform.
+
+    The last window is pulled back to end at the waveform's end so every
+    window but that one has exactly `window` samples.
+    """
+    starts = list(range(0, num_samples - window, step))
+    last = (num_samples - window) // FRAME_STRIDE * FRAME_STRIDE
+    if not starts or last > starts[-1]:
+        starts.append(last)
+    return starts
+
+def embed_waveform(waveform, window_seconds=None, overlap_seconds=None, batch_size=None):
+    """Per-frame Wav2Vec2 hidden states (frames x 768) for a 16kHz waveform"""
+    window_seconds = window_seconds or AUDIO_WINDOW_SECONDS
+    overlap_seconds = AUDIO_WINDOW_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+    batch_size = batch_size or AUDIO_BATCH_SIZE
+    processor, model = load_wav2vec2()
+
+    # Normalize over the whole clip once, exactly as the processor would,
+    # so every window sees the same scaling as a single pass
+    inputs = processor(waveform, sampling_rate=AUDIO_SAMPLE_RATE, return_tensors="pt")
+    values = inputs.input_values[0]
+
+    window = int(window_seconds * AUDIO_SAMPLE_RATE) // FRAME_STRIDE * FRAME_STRIDE
+    overlap = int(overlap_seconds * AUDIO_SAMPLE_RATE) // FRAME_STRIDE * FRAME_STRIDE
+    if len(values) <= window:
+        with torch.no_grad():
+            return model(values.unsqueeze(0)).last_hidden_state[0]
+
+    starts = window_starts(len(values), window, max(window - overlap, FRAME_STRIDE))
+    hidden = [None] * len(starts)
+    # Full-length windows run in batches; the (longer) last window runs alone
+    full = [i for i, start in enumerate(starts) if len(values) - start >= window and i < len(starts) - 1]
     with torch.no_grad():
-        outputs = model(**inputs)
-    audio_embeddings = outputs.last_hidden_state.mean(dim=1).squeeze().numpy()
+        for b in range(0, len(full), batch_size):
+            batch_ids = full[b:b + batch_size]
+            batch = torch.stack([values[starts[i]:starts[i] + window] for i in batch_ids])
+            states = model(batch).last_hidden_state
+            for row, i in enumerate(batch_ids):
+                hidden[i] = states[row]
+        hidden[-1] = model(values[starts[-1]:].unsqueeze(0)).last_hidden_state[0]
+
+    # Stitch: consecutive windows hand over at the middle of their overlap
+    pieces = []
+    keep_from = 0
+    for i, start in enumerate(starts):
+        start_frame = start // FRAME_STRIDE
+        if i + 1 < len(starts):
+            end_frame = start_frame + hidden[i].shape[0]
+            cut = (starts[i + 1] // FRAME_STRIDE + end_frame) // 2
+        else:
+            cut = start_frame + hidden[i].shape[0]
+        pieces.append(hidden[i][keep_from - start_frame:cut - start_frame])
+        keep_from = cut
+    return torch.cat(pieces)
+
+def process_audio(audio_path):
+    waveform, sample_rate = librosa.load(audio_path, sr=AUDIO_SAMPLE_RATE)
+    hidden_states = embed_waveform(waveform)
+    audio_embeddings = hidden_states.mean(dim=0).numpy()
     return audio_embeddings
 
 def extract_visual_features(video_path):
-    mp_face_mesh = mp.solutions.face_mesh
-    face_mesh = mp_face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1)
+    # Frames are streamed through FaceMesh one at a time, never held as a list
     video = VideoFileClip(video_path)
-    frames = [frame for frame in video.iter_frames()]
-    lip_landmarks = []
+    try:
+        return lip_features(video.iter_frames())
+    finally:
+        video.close()
+
+def lip_landmark_sums(frames, static_image_mode=False):
+    """(sum of lip landmark vectors, frames with a face, frames) over RGB frames"""
+    face_mesh = model_store.load_face_mesh(static_image_mode=static_image_mode, max_num_faces=1)
+    lip_sum = np.zeros(60)
     face_detection_success = 0
+    frame_total = 0
     for frame in frames:
+        frame_total += 1
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         results = face_mesh.process(frame_rgb)
         if results.multi_face_landmarks:
             face_detection_success += 1
-            lip_points = [results.multi_face_landmarks[0].landmark[i] for i in range(0, 20)]
-            lip_coords = [(p.x, p.y, p.z) for p in lip_points]
-            lip_landmarks.append(np.array(lip_coords).flatten())
-    if lip_landmarks:
-        visual_embeddings = np.mean(lip_landmarks, axis=0)
+            lip_sum += lip_vector(results.multi_face_landmarks[0].landmark)
+    return lip_sum, face_detection_success, frame_total
+
+def lip_vector(landmarks):
+    """Flattened (x, y, z) of the first 20 FaceMesh landmarks (60 values)"""
+    lip_coords = [(p.x, p.y, p.z) for p in landmarks[:20]]
+    return np.array(lip_coords).flatten()
+
+def lip_features(frames, static_image_mode=False):
+    """Mean lip landmark vector and face detection rate over RGB frames"""
+    lip_sum, face_detection_success, frame_total = lip_landmark_sums(frames, static_image_mode)
+    if face_detection_success:
+        visual_embeddings = lip_sum / face_detection_success
     else:
         raise ValueError("No face detected in the video.")
-    face_detection_rate = face_detection_success / len(frames)
+    face_detection_rate = face_detection_success / frame_total
     return visual_embeddings, face_detection_rate
 
 def compute_mismatch_metrics(audio_embeddings, visual_embeddings):
@@ -65,16 +160,124 @@ def compute_mismatch_metrics(audio_embeddings, visual_embeddings):
     }
 
 def analyze_video(video_path):
-    # Step 1: Extract audio from video
-    audio_path = extract_audio(video_path)
-    # Step 2: Process audio to get embeddings
+    # Step 1: Extract audio from video (unique temp file so parallel workers don't collide)
+    fd, audio_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        audio_path = extract_audio(video_path, audio_path)
+        # Step 2: Process audio to get embeddings
+        audio_embeddings = process_audio(audio_path)
+        # Step 3: Extract visual features (lip movements)
+        visual_embeddings, face_detection_rate = extract_visual_features(video_path)
+        # Step 4: Compute mismatch metrics
+        metrics = compute_mismatch_metrics(audio_embeddings, visual_embeddings)
+    finally:
+        # Clean up temporary files, also when a step fails or the stage is cancelled
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+    return metrics, face_detection_rate
+
+def analyze_frames(frames, audio_path):
+    """analyze_video for an uploaded bundle: RGB keyframes plus an already-extracted audio track"""
     audio_embeddings = process_audio(audio_path)
-    # Step 3: Extract visual features (lip movements)
-    visual_embeddings, face_detection_rate = extract_visual_features(video_path)
-    # Step 4: Compute mismatch metrics
+    # Keyframes are far apart in time, so FaceMesh treats each one as a fresh image
+    visual_embeddings, face_detection_rate = lip_features(frames, static_image_mode=True)
     metrics = compute_mismatch_metrics(audio_embeddings, visual_embeddings)
-    # Clean up temporary files
-    if os.path.exists(audio_path):
-        os.remove(audio_path)
     return metrics, face_detection_rate
 
+def segment_samples(waveform, fps, segment):
+    """The part of the 16 kHz waveform that plays over the segment's frames"""
+    first = int(segment['start'] / fps * AUDIO_SAMPLE_RATE)
+    last = int(segment['end'] / fps * AUDIO_SAMPLE_RATE)
+    return waveform[first:last]
+
+def audio_segment_part(hidden_states, frames):
+    """Wav2Vec2 hidden-state sum and lip landmark sums for one segment.
+
+    hidden_states is the segment's slice of the whole track's embedding
+    (None when the track is too short to embed).
+    """
+    hidden_sum, hidden_count = np.zeros(768), 0
+    if hidden_states is not None and len(hidden_states):
+        hidden_sum, hidden_count = hidden_states.sum(axis=0), hidden_states.shape[0]
+    lip_sum, lip_count, frame_count = lip_landmark_sums(frames)
+    return {
+        'hidden_sum': np.asarray(hidden_sum, dtype=np.float64),
+        'hidden_count': np.int64(hidden_count),
+        'lip_sum': lip_sum,
+        'lip_count': np.int64(lip_count),
+        'frame_count': np.int64(frame_count),
+    }
+
+def segment_hidden_bounds(video_segments, fps, hidden_count):
+    """[start, end) rows of the whole track's hidden states for each segment.
+
+    Each Wav2Vec2 frame goes to the segment its first sample falls in, so
+    the slices partition the hidden states.
+    """
+    starts = [int(segment['start'] / fps * AUDIO_SAMPLE_RATE) // FRAME_STRIDE for segment in video_segments]
+    starts[0] = 0
+    ends = starts[1:] + [hidden_count]
+    return [(min(start, hidden_count), min(end, hidden_count)) for start, end in zip(starts, ends)]
+
+def segment_frames(cap, segment):
+    """The segment's frames as the same RGB frames moviepy hands extract_visual_features,
+    streamed through one reused buffer"""
+    frame = rgb = None
+    for _ in range(segment['end'] - segment['start']):
+        ret, frame = cap.read(frame)
+        if not ret:
+            break
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        yield rgb
+
+def analyze_video_segments(video_path, video_segments, tag='v1'):
+    """analyze_video from per-segment audio and lip sums, reusing cached segments.
+
+    The audio is always extracted: parts are cached under the segment's
+    frames and its audio (segments.audio_key), so the same footage with other
+    audio is analyzed afresh. When any segment misses the cache the whole
+    track is embedded in one embed_waveform pass and sliced per segment, so a
+    run without cache hits matches analyze_video. Returns (metrics, face
+    detection rate, segments reused).
+    """
+    fd, audio_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        extract_audio(video_path, audio_path)
+        waveform, _ = librosa.load(audio_path, sr=AUDIO_SAMPLE_RATE)
+    finally:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    parts = []
+    reused = 0
+    try:
+        keys = [segments.audio_key(segment, segment_samples(waveform, fps, segment)) for segment in video_segments]
+        cached = [segments.load_part(key, 'audio', tag) for key in keys]
+
+        hidden_states = None
+        # Shorter than Wav2Vec2's receptive field: no audio frames at all
+        if any(part is None for part in cached) and len(waveform) >= FRAME_STRIDE * 2:
+            hidden_states = embed_waveform(waveform).numpy()
+        bounds = segment_hidden_bounds(video_segments, fps, len(hidden_states) if hidden_states is not None else 0)
+
+        for segment, key, part, (start, end) in zip(video_segments, keys, cached, bounds):
+            if part is not None:
+                reused += 1
+                # Cached: decode past the segment without converting its frames
+                for _ in range(segment['end'] - segment['start']):
+                    cap.grab()
+            else:
+                segment_states = hidden_states[start:end] if hidden_states is not None else None
+                part = audio_segment_part(segment_states, segment_frames(cap, segment))
+                segments.save_part(key, 'audio', tag, part)
+            parts.append(part)
+    finally:
+        cap.release()
+
+    audio_embeddings, visual_embeddings, face_detection_rate = segments.merge_audio(parts)
+    metrics = compute_mismatch_metrics(audio_embeddings, visual_embeddings)
+    return metrics, face_detection_rate, reused
@@ -0,0 +1,184 @@
+"""
+Time-windowed audio-visual sync scoring.
+
+Instead of comparing one mean audio embedding against one mean lip vector,
+this builds two series on the video's frame timeline - how open the mouth
+is (FaceMesh inner-lip gap over face height) and the audio RMS energy - and
+correlates them over sliding windows at a range of lags. All windows (and
+lags) are scored with one batched einsum per chunk of windows, so the whole
+thing runs in bounded memory: frames are streamed and never kept, and only
+two float series per video frame are held.
+"""
+import os
+import tempfile
+
+import cv2
+import librosa
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import model_store
+from audio import extract_audio
+
+# FaceMesh landmark ids
+UPPER_LIP = 13
+LOWER_LIP = 14
+FOREHEAD = 10
+CHIN = 152
+
+WINDOW_SECONDS = 2.0
+HOP_SECONDS = 0.5
+MAX_LAG_SECONDS = 0.3
+# A window is "in sync" when its best correlation clears this at a lag under MAX_SYNC_LAG_SECONDS
+SYNC_THRESHOLD = 0.3
+MAX_SYNC_LAG_SECONDS = 0.15
+# Longest side frames are shrunk to before FaceMesh (landmarks are normalized anyway)
+DETECTION_SIZE = 480
+# Windows scored per einsum batch; bounds the (windows, lags, window) temporary
+WINDOW_CHUNK = 256
+
+
+def mouth_opening(landmarks):
+    """Inner-lip gap over face height for one frame's FaceMesh landmarks"""
+    face_height = abs(landmarks[CHIN].y - landmarks[FOREHEAD].y) or 1e-6
+    return abs(landmarks[LOWER_LIP].y - landmarks[UPPER_LIP].y) / face_height
+
+
+def mouth_opening_series(video_path, cancel_token=None):
+    """Per-frame mouth opening (NaN where no face was found) and the video fps"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video at path {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+
+    face_mesh = model_store.load_face_mesh(static_image_mode=False, max_num_faces=1)
+    openings = []
+    try:
+        while True:
+            if cancel_token is not None and cancel_token.cancelled():
+                break
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            h, w = frame.shape[:2]
+            scale = DETECTION_SIZE / max(h, w)
+            if scale < 1:
+                frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+            results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+            if results.multi_face_landmarks:
+                openings.append(mouth_opening(results.multi_face_landmarks[0].landmark))
+            else:
+                openings.append(np.nan)
+    finally:
+        cap.release()
+        face_mesh.close()
+    return np.array(openings, dtype=np.float32), fps
+
+
+def audio_energy_series(audio_path, fps, num_frames, sample_rate=16000):
+    """RMS energy of the audio resampled onto the video frame timeline"""
+    waveform, sample_rate = librosa.load(audio_path, sr=sample_rate, mono=True)
+    hop = sample_rate / fps
+    # One RMS value per video frame: frame i covers samples [i*hop, (i+1)*hop)
+    edges = np.round(np.arange(num_frames + 1) * hop).astype(np.int64)
+    edges = np.clip(edges, 0, len(waveform))
+    squared = np.concatenate([[0.0], np.cumsum(waveform.astype(np.float64) ** 2)])
+    counts = np.maximum(np.diff(edges), 1)
+    energy = np.sqrt((squared[edges[1:]] - squared[edges[:-1]]) / counts)
+    return energy.astype(np.float32)
+
+
+def _normalize_rows(windows):
+    windows = windows - windows.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(windows, axis=-1, keepdims=True)
+    return windows / np.maximum(norms, 1e-8)
+
+
+def windowed_lag_correlation(visual, audio, window, hop, max_lag):
+    """Pearson correlation of every window of `visual` with `audio` at lags -max_lag..max_lag.
+
+    Returns (starts, correlations) where correlations has shape
+    (num_windows, 2 * max_lag + 1); a positive lag means audio trails video.
+    """
+    n = len(visual)
+    if n < window:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2 * max_lag + 1), dtype=np.float32)
+
+    starts = np.arange(0, n - window + 1, hop)
+    lags = np.arange(-max_lag, max_lag + 1)
+    visual_windows = sliding_window_view(visual, window)
+    padded_audio = np.pad(audio, max_lag, mode='edge')
+    audio_windows = sliding_window_view(padded_audio, window)
+
+    correlations = np.empty((len(starts), len(lags)), dtype=np.float32)
+    for chunk_start in range(0, len(starts), WINDOW_CHUNK):
+        chunk = starts[chunk_start:chunk_start + WINDOW_CHUNK]
+        v = _normalize_rows(visual_windows[chunk])  # (W, window)
+        a = _normalize_rows(audio_windows[chunk[:, None] + lags[None, :] + max_lag])  # (W, lags, window)
+        correlations[chunk_start:chunk_start + len(chunk)] = np.einsum('wk,wlk->wl', v, a)
+    return starts, correlations
+
+
+def compute_sync_timeline(mouth, energy, fps):
+    window = max(int(round(WINDOW_SECONDS * fps)), 2)
+    hop = max(int(round(HOP_SECONDS * fps)), 1)
+    max_lag = int(round(MAX_LAG_SECONDS * fps))
+    max_sync_lag = MAX_SYNC_LAG_SECONDS * fps
+
+    n = min(len(mouth), len(energy))
+    mouth, energy = mouth[:n], energy[:n]
+    missing = np.isnan(mouth)
+    if missing.all():
+        raise ValueError("No face detected in the video.")
+    # Bridge short detection gaps so they don't break the correlation
+    frames = np.arange(n)
+    filled = np.interp(frames, frames[~missing], mouth[~missing]).astype(np.float32)
+
+    starts, correlations = windowed_lag_correlation(filled, energy, window, hop, max_lag)
+    if len(starts) == 0:
+        raise ValueError("Video is shorter than one sync window.")
+
+    missing_fraction = sliding_window_view(missing, window)[starts].mean(axis=1)
+    best = correlations.argmax(axis=1)
+    best_corr = correlations[np.arange(len(starts)), best]
+    best_lag = best - max_lag
+    valid = missing_fraction <= 0.5
+    in_sync = valid & (best_corr >= SYNC_THRESHOLD) & (np.abs(best_lag) <= max_sync_lag)
+
+    timeline = [
+        {
+            'start_time': round(float(start / fps), 3),
+            'end_time': round(float((start + window) / fps), 3),
+            'correlation': round(float(corr), 4),
+            'zero_lag_correlation': round(float(correlations[i, max_lag]), 4),
+            'lag_ms': round(float(lag / fps * 1000), 1),
+            'face_coverage': round(float(1 - miss), 3),
+            'in_sync': bool(sync) if ok else None,
+        }
+        for i, (start, corr, lag, miss, ok, sync) in enumerate(zip(starts, best_corr, best_lag, missing_fraction, valid, in_sync))
+    ]
+    valid_count = int(valid.sum())
+    return {
+        'global_sync_score': round(float(in_sync.sum() / valid_count), 4) if valid_count else 0.0,
+        'mean_correlation': round(float(best_corr[valid].mean()), 4) if valid_count else 0.0,
+        'windows_scored': valid_count,
+        'window_seconds': WINDOW_SECONDS,
+        'hop_seconds': HOP_SECONDS,
+        'timeline': timeline,
+    }
+
+
+def analyze_sync(video_path, cancel_token=None):
+    """Per-window sync timeline plus a global score (fraction of windows in sync)"""
+    fd, audio_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        mouth, fps = mouth_opening_series(video_path, cancel_token)
+        extract_audio(video_path, audio_path)
+        energy = audio_energy_series(audio_path, fps, len(mouth))
+        return compute_sync_timeline(mouth, energy, fps)
+    finally:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
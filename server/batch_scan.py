@@ -0,0 +1,135 @@
+"""
+Batch re-scoring of a directory of videos.
+
+Walks a directory, fans process_video out over a process pool (each worker
+loads the face/frame models once and reuses them for every file it gets;
+its audio subprocess worker likewise keeps Wav2Vec2 loaded) and appends
+one JSON line per file to the output. Files already present in the output
+are skipped, so an interrupted run can simply be started again.
+
+    python batch_scan.py uploads --output scan_results.jsonl --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'wmv', 'mkv', 'webm'}
+
+_process_video = None
+
+
+def init_worker(parallel_workers):
+    # A long video would start its own time-segment pool inside this worker;
+    # cap it to the worker's share of the cores (set before parallel is imported)
+    os.environ['PARALLEL_WORKERS'] = str(parallel_workers)
+    # Load MTCNN/MobileNet once per worker process
+    global _process_video
+    from analysis import process_video
+    from face import load_models
+    from frame import load_model
+    load_models()
+    load_model()
+    _process_video = process_video
+
+
+def scan_one(path, root):
+    start_time = time.time()
+    size_bytes = None
+    try:
+        # A file removed or unreadable since the walk fails on its own line
+        size_bytes = os.path.getsize(path)
+        result = _process_video(path)
+    except Exception as e:
+        result = {'error': str(e), 'status': 'failed'}
+    return {
+        'path': os.path.relpath(path, root),
+        'size_bytes': size_bytes,
+        'wall_time': round(time.time() - start_time, 2),
+        'result': result,
+    }
+
+
+def find_videos(root):
+    videos = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if '.' in filename and filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS:
+                videos.append(os.path.join(dirpath, filename))
+    return sorted(videos)
+
+
+def load_done(output_path, retry_failed=False):
+    """Relative paths that already have a line in the output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by a crash; the file gets re-run
+                continue
+            if retry_failed and record.get('result', {}).get('status') == 'failed':
+                continue
+            done.add(record['path'])
+    return done
+
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run process_video over every video in a directory")
+    parser.add_argument('directory', help="Directory to scan recursively (e.g. uploads)")
+    parser.add_argument('--output', default='scan_results.jsonl', help="JSONL file results are appended to")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of worker processes")
+    parser.add_argument('--retry-failed', action='store_true', help="Re-run files whose previous result failed")
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(args.directory)
+    done = load_done(args.output, args.retry_failed)
+    pending = [path for path in find_videos(root) if os.path.relpath(path, root) not in done]
+    print(f"{len(done)} files already done, {len(pending)} to process with {args.workers} workers")
+    if not pending:
+        return 0
+
+    start_time = time.time()
+    completed = 0
+    failed = 0
+    ctx = multiprocessing.get_context('spawn')
+    parallel_workers = max(1, (os.cpu_count() or 1) // args.workers)
+    with open(args.output, 'a') as out, \
+            ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx, initializer=init_worker,
+                                initargs=(parallel_workers,)) as executor:
+        futures = [executor.submit(scan_one, path, root) for path in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, default=float) + '\n')
+            out.flush()
+
+            completed += 1
+            if record['result'].get('status') == 'failed':
+                failed += 1
+            elapsed = time.time() - start_time
+            rate = completed / elapsed
+            eta = (len(pending) - completed) / rate if rate > 0 else 0
+            print(f"[{completed}/{len(pending)}] {record['path']} "
+                  f"({record['wall_time']}s) - {rate * 60:.1f} files/min, ETA {format_eta(eta)}")
+
+    elapsed = time.time() - start_time
+    print(f"Done: {completed} files ({failed} failed) in {format_eta(elapsed)}, "
+          f"{completed / elapsed * 60:.1f} files/min")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
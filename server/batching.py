@@ -0,0 +1,148 @@
+"""
+Dynamic micro-batching for model inference.
+
+Concurrent requests each call MicroBatcher.predict(item). A single worker
+thread collects items until it has max_batch_size of them or the first one
+has waited max_wait_ms, runs one batched call and hands each caller its own
+result. Under burst traffic this turns many batch-of-one forward passes into
+a few larger ones; with a single request the extra latency is at most
+max_wait_ms. If a batched call fails, its items are retried one at a time
+so only the caller whose item is bad gets the error.
+"""
+import collections
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+# How long predict() waits for its result before giving up
+BATCH_PREDICT_TIMEOUT = float(os.environ.get('BATCH_PREDICT_TIMEOUT', 30))
+# Recent batches kept for the metrics percentiles
+METRICS_WINDOW = 1000
+
+
+def settle(future, result=None, exception=None):
+    # A caller may have cancelled its future; that must not stop the worker
+    if future.set_running_or_notify_cancel():
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, name='model'):
+        """batch_fn takes a list of items and returns a list of results in the same order"""
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.requests = queue.Queue()
+
+        self.metrics_lock = threading.Lock()
+        self.total_items = 0
+        self.total_batches = 0
+        self.retried_batches = 0
+        self.batch_sizes = collections.deque(maxlen=METRICS_WINDOW)
+        self.queue_waits = collections.deque(maxlen=METRICS_WINDOW)
+        self.batch_latencies = collections.deque(maxlen=METRICS_WINDOW)
+
+        self.worker = threading.Thread(target=self.run, name=f"batcher-{name}", daemon=True)
+        self.worker.start()
+
+    def submit(self, item):
+        future = Future()
+        self.requests.put((item, future, time.perf_counter()))
+        return future
+
+    def predict(self, item, timeout=BATCH_PREDICT_TIMEOUT):
+        """Blocking single-item call; the item is batched with whatever else is queued.
+        Raises concurrent.futures.TimeoutError if no result came within timeout seconds."""
+        return self.submit(item).result(timeout=timeout)
+
+    def collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait runs out"""
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def call(self, items):
+        """batch_fn(items), checked to return one result per item"""
+        results = list(self.batch_fn(items))
+        if len(results) != len(items):
+            raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(items)} items")
+        return results
+
+    def resolve(self, batch):
+        """Run one batch and settle every future in it"""
+        try:
+            results = self.call([item for item, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                settle(batch[0][1], exception=e)
+                return
+            # One bad item fails the whole batched call: retry the items one
+            # at a time so the others still get their results
+            with self.metrics_lock:
+                self.retried_batches += 1
+            for request in batch:
+                self.resolve([request])
+            return
+        for (_, future, _), result in zip(batch, results):
+            settle(future, result=result)
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            started = time.perf_counter()
+            self.resolve(batch)
+            finished = time.perf_counter()
+
+            with self.metrics_lock:
+                self.total_items += len(batch)
+                self.total_batches += 1
+                self.batch_sizes.append(len(batch))
+                self.queue_waits.extend((started - enqueued) * 1000 for _, _, enqueued in batch)
+                self.batch_latencies.append((finished - started) * 1000)
+
+    def stats(self):
+        with self.metrics_lock:
+            sizes = np.array(self.batch_sizes) if self.batch_sizes else np.zeros(1)
+            waits = np.array(self.queue_waits) if self.queue_waits else np.zeros(1)
+            latencies = np.array(self.batch_latencies) if self.batch_latencies else np.zeros(1)
+            return {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self.requests.qsize(),
+                'total_items': self.total_items,
+                'total_batches': self.total_batches,
+                'retried_batches': self.retried_batches,
+                'batch_size': {
+                    'mean': round(float(sizes.mean()), 2),
+                    'p50': float(np.percentile(sizes, 50)),
+                    'max': int(sizes.max()),
+                },
+                'queue_wait_ms': {
+                    'mean': round(float(waits.mean()), 3),
+                    'p95': round(float(np.percentile(waits, 95)), 3),
+                    'p99': round(float(np.percentile(waits, 99)), 3),
+                },
+                'batch_latency_ms': {
+                    'mean': round(float(latencies.mean()), 3),
+                    'p95': round(float(np.percentile(latencies, 95)), 3),
+                },
+            }
@@ -0,0 +1,202 @@
+"""
+Keyframe / face-crop bundle analysis.
+
+Instead of the whole video, a client can upload only what the analyzers
+look at: JPEG keyframes (or face crops it already cut out) sampled on its
+side, each with a timestamp, plus an optional downsampled mono audio
+track. The server decodes a few dozen small JPEGs instead of a full video
+and runs the same face, frame and audio-visual stages on them, returning
+the same document as process_video.
+
+Keyframes should be sampled about as densely as process_video samples
+(every 10th frame, roughly 3 per second): the frame stage compares each
+keyframe with the previous one and its threshold is tuned for that spacing.
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import cv2
+import numpy as np
+
+from analysis import (STAGES, TimeoutException, compute_scores, frames_with_faces, run_with_timeout, set_audio_defaults,
+                      skip_audio, stage_status, to_json_value)
+from audio import compute_mismatch_metrics, lip_features, process_audio
+from cancellation import AnalysisCancelled, run_in_subprocess
+from face import detect_face_distortion_frames
+from frame import detect_frame_anomalies_frames
+from memory_budget import MemoryBudget
+
+BUNDLE_KINDS = ('keyframes', 'faces')
+MAX_BUNDLE_FRAMES = int(os.environ.get('MAX_BUNDLE_FRAMES', 600))
+BUNDLE_TIMEOUT = 30
+# How long a stage may run past the deadline before the result is built without it
+# (shorter than run_with_timeout's grace, so the partial result still gets out)
+STAGE_GRACE_SECONDS = 2
+
+
+class BundleError(ValueError):
+    """The uploaded bundle is malformed (reported to the client as a 400)"""
+
+
+def load_bundle(frame_blobs, timestamps=None, kind='keyframes', audio_path=None):
+    """Decode an uploaded bundle into {'kind', 'frames' (BGR), 'timestamps', 'audio_path', 'content_hash'}"""
+    if kind not in BUNDLE_KINDS:
+        raise BundleError(f"kind must be one of {', '.join(BUNDLE_KINDS)}")
+    if not frame_blobs:
+        raise BundleError('Bundle has no frames')
+    if len(frame_blobs) > MAX_BUNDLE_FRAMES:
+        raise BundleError(f"Bundle has {len(frame_blobs)} frames (max {MAX_BUNDLE_FRAMES})")
+    if timestamps is None:
+        timestamps = list(range(len(frame_blobs)))
+    if len(timestamps) != len(frame_blobs):
+        raise BundleError('timestamps must have one entry per frame')
+
+    sha = hashlib.sha256()
+    frames = []
+    for index, blob in enumerate(frame_blobs):
+        sha.update(blob)
+        frame = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise BundleError(f"Frame {index} is not a decodable image")
+        frames.append(frame)
+    if audio_path is not None:
+        with open(audio_path, 'rb') as file:
+            sha.update(file.read())
+
+    # Frames are analyzed in time order whatever order they were uploaded in
+    order = np.argsort(np.asarray(timestamps, dtype=np.float64), kind='stable')
+    return {
+        'kind': kind,
+        'frames': [frames[i] for i in order],
+        'timestamps': [float(timestamps[i]) for i in order],
+        'audio_path': audio_path,
+        'content_hash': sha.hexdigest(),
+    }
+
+
+def run_bundle_audio_stage(bundle, cancel_token):
+    """Audio-visual mismatch from the bundle's audio track and keyframes"""
+    results = {}
+    if bundle['audio_path'] is None:
+        skip_audio(results, 'No audio track in bundle')
+        return results, 'skipped'
+    try:
+        # The Wav2Vec2 pass can't poll the token, so it runs in a subprocess we can kill
+        audio_embeddings = run_in_subprocess(process_audio, (bundle['audio_path'],), cancel_token)
+        # analyze_video reads moviepy's RGB frames; hand the keyframes over in the same order.
+        # Keyframes are far apart in time, so FaceMesh treats each one as a fresh image
+        frames = (cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in bundle['frames'])
+        visual_embeddings, face_detection_rate = lip_features(frames, static_image_mode=True)
+        metrics = compute_mismatch_metrics(audio_embeddings, visual_embeddings)
+        results['face_detection_rate'] = face_detection_rate
+        results['cosine_similarity'] = metrics['cosine_similarity']
+        results['mismatch_score'] = metrics['mismatch_score']
+        results['euclidean_distance'] = metrics['euclidean_distance']
+        return results, 'completed'
+    except AnalysisCancelled as e:
+        print(f"Bundle audio analysis cancelled: {str(e)}")
+        set_audio_defaults(results, 'Cancelled: deadline reached')
+        return results, 'cancelled'
+    except Exception as e:
+        print(f"Error in bundle audio analysis: {str(e)}")
+        set_audio_defaults(results, str(e))
+        return results, 'failed'
+
+
+def stage_wait(cancel_token):
+    """Seconds to wait for a stage's result: until the deadline plus the grace period"""
+    remaining = cancel_token.remaining() if cancel_token is not None else None
+    return remaining + STAGE_GRACE_SECONDS if remaining is not None else None
+
+
+def analyze_bundle_internal(bundle, cancel_token=None):
+    start_time = time.time()
+    memory_budget = MemoryBudget()
+    results = {'content_hash': bundle['content_hash']}
+    stages = {}
+    signals = {}
+    frames = bundle['frames']
+
+    def face_stage():
+        total_frames, distorted_faces = detect_face_distortion_frames(
+            frames, cropped=bundle['kind'] == 'faces', cancel_token=cancel_token, signals=signals)
+        return {
+            'total_frames': total_frames,
+            'distorted_faces': distorted_faces,
+            'frames_with_faces': frames_with_faces(signals),
+        }, stage_status(cancel_token)
+
+    def frame_stage():
+        total_frames_processed, abnormal_frames_detected = detect_frame_anomalies_frames(
+            frames, cancel_token=cancel_token, signals=signals)
+        return {
+            'total_frames_processed': total_frames_processed,
+            'abnormal_frames_detected': abnormal_frames_detected,
+        }, stage_status(cancel_token)
+
+    # Not used as a context manager: exiting one would join every stage, so a
+    # stage stuck past the deadline would hold the request (as in iter_analysis_events)
+    executor = ThreadPoolExecutor(max_workers=3)
+    try:
+        futures = {
+            'face': executor.submit(face_stage),
+            'frame': executor.submit(frame_stage),
+            'audio': executor.submit(run_bundle_audio_stage, bundle, cancel_token),
+        }
+        for stage, future in futures.items():
+            try:
+                stage_results, stages[stage] = future.result(timeout=stage_wait(cancel_token))
+            except TimeoutError:
+                print(f"{stage} stage still running past the deadline; leaving it behind")
+                stage_results, stages[stage] = (
+                    {} if stage != 'audio' else {'audio_analysis_error': 'Cancelled: deadline reached'}), 'cancelled'
+            except Exception as e:
+                print(f"Error in {stage} stage: {str(e)}")
+                stage_results, stages[stage] = ({} if stage != 'audio' else {'audio_analysis_error': str(e)}), 'failed'
+            results.update({key: to_json_value(value) for key, value in stage_results.items()})
+    finally:
+        if len(stages) < len(STAGES) and cancel_token is not None:
+            # Raised out of the loop: stop whatever is still running
+            cancel_token.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        results['memory'] = memory_budget.close()
+
+    if 'audio_analysis_error' in results and stages.get('audio') != 'skipped':
+        set_audio_defaults(results, results['audio_analysis_error'])
+    compute_scores(results)
+
+    results['stage_status'] = stages
+    results['bundle'] = {
+        'kind': bundle['kind'],
+        'frames': len(frames),
+        'duration_seconds': round(bundle['timestamps'][-1] - bundle['timestamps'][0], 3),
+        'has_audio': bundle['audio_path'] is not None,
+    }
+    if cancel_token is not None and cancel_token.cancelled():
+        results['status'] = 'partial'
+        results['warning'] = 'Deadline reached - results are based on the stages that finished'
+    results['processing_time'] = round(time.time() - start_time, 2)
+    return results
+
+
+def analyze_bundle(bundle, timeout=BUNDLE_TIMEOUT):
+    """process_video for a bundle: same result schema, plus a 'bundle' summary"""
+    try:
+        return run_with_timeout(analyze_bundle_internal, [bundle], timeout)
+    except TimeoutException:
+        return {
+            'error': f'Analysis timed out after {timeout} seconds',
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed due to timeout'
+        }
+    except Exception as e:
+        print(f"Error in analyze_bundle: {str(e)}")
+        return {
+            'error': str(e),
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed due to technical error'
+        }
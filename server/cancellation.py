@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """Shared flag that analysis stages poll between frame batches.
+
+    The token trips either when cancel() is called, when the optional
+    deadline (seconds from creation) has passed, or when the optional parent
+    token trips. Cancelling a child leaves its parent running.
+    """
+
+    def __init__(self, timeout=None, parent=None):
+        self._event = threading.Event()
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.parent = parent
+
+    def cancel(self):
+        self._event.set()
+
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if (self.deadline is not None and time.monotonic() >= self.deadline) or (
+                self.parent is not None and self.parent.cancelled()):
+            self._event.set()
+            return True
+        return False
+
+    def remaining(self):
+        """Seconds left before the deadline (None if there is no deadline)"""
+        own = max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+        inherited = self.parent.remaining() if self.parent is not None else None
+        known = [seconds for seconds in (own, inherited) if seconds is not None]
+        return min(known) if known else None
+
+
+def _exit_on_terminate(signum, frame):
+    # terminate() sends SIGTERM; exiting through SystemExit runs the worker's
+    # finally blocks (temp file cleanup) instead of dying mid-stage
+    sys.exit(128 + signum)
+
+
+def _worker_loop(conn):
+    signal.signal(signal.SIGTERM, _exit_on_terminate)
+    while True:
+        try:
+            func, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = ('ok', func(*args))
+        except Exception as e:
+            result = ('error', f"{type(e).__name__}: {e}")
+        conn.send(result)
+
+
+# Idle workers are kept and reused, so whatever a worker loaded (e.g. the
+# Wav2Vec2 model audio.py caches per process) stays loaded across calls.
+# A worker is only replaced after it was killed on cancellation or died.
+SUBPROCESS_MAX_IDLE = int(os.environ.get('SUBPROCESS_MAX_IDLE', 2))
+
+
+class SubprocessWorker:
+    """A long-lived spawned process that runs one (func, args) call at a time"""
+
+    def __init__(self):
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+_idle_workers = []
+_idle_lock = threading.Lock()
+
+
+def _acquire_worker():
+    with _idle_lock:
+        while _idle_workers:
+            worker = _idle_workers.pop()
+            if worker.process.is_alive():
+                return worker
+            worker.stop()
+    return SubprocessWorker()
+
+
+def _release_worker(worker):
+    with _idle_lock:
+        if len(_idle_workers) < SUBPROCESS_MAX_IDLE:
+            _idle_workers.append(worker)
+            return
+    worker.stop()
+
+
+def run_in_subprocess(func, args, cancel_token=None, poll_interval=0.1):
+    """Run func(*args) in a separate process that is killed on cancellation.
+
+    Used for stages (e.g. a single Wav2Vec2 forward pass) that cannot check
+    the token themselves. func must be a picklable module-level function.
+    The call runs on an idle worker when there is one; the worker goes back
+    to the idle list once it has returned a result, and is killed otherwise.
+    """
+    worker = _acquire_worker()
+    reusable = False
+    try:
+        worker.conn.send((func, args))
+        while True:
+            if cancel_token is not None and cancel_token.cancelled():
+                raise AnalysisCancelled(f"{func.__name__} cancelled")
+            if worker.conn.poll(poll_interval):
+                try:
+                    status, payload = worker.conn.recv()
+                except EOFError:
+                    # Pipe closed without a result: the worker died
+                    worker.process.join(timeout=5)
+                    raise RuntimeError(f"{func.__name__} worker exited with code {worker.process.exitcode}")
+                reusable = True
+                if status == 'error':
+                    raise RuntimeError(payload)
+                return payload
+            if not worker.process.is_alive() and not worker.conn.poll(0):
+                raise RuntimeError(f"{func.__name__} worker exited with code {worker.process.exitcode}")
+    finally:
+        if reusable:
+            _release_worker(worker)
+        else:
+            worker.stop()
@@ -0,0 +1,133 @@
+"""
+Cheap-first detector cascade.
+
+Stage 1 scores a few sampled face crops with the small Meso4 network (Haar
+cascade face detection on a downscaled grey frame, one batched Meso4 pass).
+When the mean fake probability is decisive - above the fake threshold or
+below the real threshold - that is the verdict. Only the uncertain middle
+band escalates to the full MTCNN/MobileNet/Wav2Vec2/FaceMesh pipeline.
+
+The cascade applies to video uploads only: an image sent to /predict is
+already a single ViT pass, so ?cascade=1 has no effect there.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import model_store
+from scoring import risk_for
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESO4_MODEL_PATH = os.environ.get('MESO4_MODEL_PATH', os.path.join(REPO_ROOT, 'Deepfake-detection', 'models', 'Meso4_DF_model.h5'))
+
+# Mean fake probability at or above which stage 1 calls it fake, and at or below which it calls it real
+CASCADE_FAKE_THRESHOLD = float(os.environ.get('CASCADE_FAKE_THRESHOLD', 0.85))
+CASCADE_REAL_THRESHOLD = float(os.environ.get('CASCADE_REAL_THRESHOLD', 0.15))
+CASCADE_SAMPLED_FRAMES = 12
+# Stage 1 needs at least this many face crops to be trusted
+CASCADE_MIN_FACES = 4
+DETECTION_SIZE = 360
+
+_meso4 = None
+_meso4_lock = threading.Lock()
+face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+
+def load_meso4():
+    global _meso4
+    with _meso4_lock:
+        if _meso4 is None:
+            from keras.models import load_model
+            _meso4 = load_model(model_store.meso4_path() or MESO4_MODEL_PATH)
+    return _meso4
+
+
+def parse_probability(value, name):
+    try:
+        probability = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    # Rejects nan too
+    if not 0.0 <= probability <= 1.0:
+        raise ValueError(f"{name} must be between 0 and 1")
+    return probability
+
+
+def cascade_thresholds(fake_threshold=None, real_threshold=None):
+    """Thresholds dict for run_cheap_stage. Raises ValueError for unusable user-supplied values."""
+    thresholds = {
+        'fake_threshold': CASCADE_FAKE_THRESHOLD if fake_threshold is None else parse_probability(fake_threshold, 'fake_threshold'),
+        'real_threshold': CASCADE_REAL_THRESHOLD if real_threshold is None else parse_probability(real_threshold, 'real_threshold'),
+    }
+    if thresholds['real_threshold'] >= thresholds['fake_threshold']:
+        raise ValueError("real_threshold must be below fake_threshold")
+    return thresholds
+
+
+def sample_face_crops(video_path, num_frames=CASCADE_SAMPLED_FRAMES):
+    """112x112 RGB face crops from evenly spaced frames"""
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    crops = []
+    try:
+        for index in np.linspace(0, max(total - 1, 0), num_frames).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            crops.extend(face_crops(frame))
+    finally:
+        cap.release()
+    return crops
+
+
+def face_crops(frame):
+    """Detect on a downscaled grey frame, crop from the full-resolution one"""
+    h, w = frame.shape[:2]
+    scale = min(1.0, DETECTION_SIZE / max(h, w))
+    gray = cv2.cvtColor(cv2.resize(frame, (int(w * scale), int(h * scale))), cv2.COLOR_BGR2GRAY)
+    crops = []
+    for (x, y, fw, fh) in face_cascade.detectMultiScale(gray, 1.1, 4):
+        x1, y1 = int(x / scale), int(y / scale)
+        x2, y2 = int((x + fw) / scale), int((y + fh) / scale)
+        crop = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2RGB)
+        crops.append(cv2.resize(crop, (112, 112), interpolation=cv2.INTER_AREA))
+    return crops
+
+
+def cheap_score(video_path):
+    """Mean Meso4 fake probability over sampled face crops (None if too few faces)"""
+    crops = sample_face_crops(video_path)
+    if len(crops) < CASCADE_MIN_FACES:
+        return None, len(crops)
+    batch = np.stack(crops).astype(np.float32) / 255.0
+    # Meso4 was trained with flow_from_directory classes (DeepFake=0, Real=1): output is P(real)
+    fake_probs = 1.0 - load_meso4().predict(batch, verbose=0)[:, 0]
+    return float(np.mean(fake_probs)), len(crops)
+
+
+def run_cheap_stage(video_path, thresholds):
+    """Stage 1 of the cascade. Returns (decisive result or None, cascade info)"""
+    fake_probability, faces_scored = cheap_score(video_path)
+    info = {
+        'stage': 'full',
+        'cheap_fake_probability': round(fake_probability, 4) if fake_probability is not None else None,
+        'faces_scored': faces_scored,
+        'thresholds': thresholds,
+    }
+    if fake_probability is None:
+        return None, info
+    if thresholds['real_threshold'] < fake_probability < thresholds['fake_threshold']:
+        return None, info
+
+    info['stage'] = 'cheap'
+    confidence_score = round(100 * (1 - fake_probability), 2)
+    risk_level, analysis_result = risk_for(confidence_score)
+    return {
+        'confidence_score': confidence_score,
+        'risk_level': risk_level,
+        'analysis_result': analysis_result,
+        'cascade': info,
+    }, info
@@ -0,0 +1,177 @@
+"""
+Accuracy vs throughput evaluation of the image-level detectors.
+
+Runs each detector in batches over the labelled Deepfake-detection/data/Real
+and data/DeepFake images and reports accuracy and ROC-AUC next to
+images/sec and per-batch latency percentiles. Every run appends one line
+per detector to the output file, so different configurations (sample rate,
+input resolution, batch size, device) become comparable speed/quality
+points:
+
+    python evaluate_detectors.py --detectors vit meso4 --sample-rate 4 --resolution 224
+    python evaluate_detectors.py --detectors mobilenet --device cuda --batch-size 64
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+from sklearn.metrics import roc_auc_score
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_ROOT, 'Deepfake-detection', 'data')
+MESO4_MODEL_PATH = os.path.join(REPO_ROOT, 'Deepfake-detection', 'models', 'Meso4_DF_model.h5')
+
+# Label 1 means fake throughout; every detector returns P(fake)
+CLASS_LABELS = {'Real': 0, 'DeepFake': 1}
+
+
+def list_images(data_dir=DATA_DIR, sample_rate=1, limit=None):
+    """Every sample_rate-th image per class (optionally capped at limit per class)"""
+    items = []
+    for class_name, label in CLASS_LABELS.items():
+        class_dir = os.path.join(data_dir, class_name)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        files = files[::sample_rate][:limit]
+        items.extend((os.path.join(class_dir, f), label) for f in files)
+    return items
+
+
+def load_image(path, resolution=None):
+    image = Image.open(path).convert('RGB')
+    if resolution:
+        image = image.resize((resolution, resolution), Image.BILINEAR)
+    return image
+
+
+# ----------- DETECTORS -------------
+
+class VitDetector:
+    """The /predict ViT pipeline from app.py"""
+    name = 'vit'
+
+    def __init__(self, device='cpu'):
+        from transformers import pipeline
+        self.pipe = pipeline("image-classification", model="prithivMLmods/Deep-Fake-Detector-Model",
+                             device=0 if device == 'cuda' else -1)
+
+    def predict(self, images):
+        outputs = self.pipe(images, batch_size=len(images), top_k=None)
+        return np.array([
+            sum(p['score'] for p in result if 'fake' in p['label'].lower())
+            for result in outputs
+        ])
+
+
+class Meso4Detector:
+    """Deepfake-detection/models/Meso4_DF_model.h5"""
+    name = 'meso4'
+
+    def __init__(self, device='cpu'):
+        from keras.models import load_model
+        self.model = load_model(MESO4_MODEL_PATH)
+
+    def predict(self, images):
+        batch = np.stack([np.asarray(image.resize((112, 112)), dtype=np.float32) / 255.0 for image in images])
+        # Trained with flow_from_directory classes (DeepFake=0, Real=1), so the output is P(real)
+        return 1.0 - self.model.predict(batch, verbose=0)[:, 0]
+
+
+class MobileNetDetector:
+    """The MobileNetV2 real/fake head from face.py, applied to the face crops"""
+    name = 'mobilenet'
+
+    def __init__(self, device='cpu'):
+        import torch
+        import face
+        self.torch = torch
+        self.device = torch.device(device)
+        self.model = face.load_models()[1].to(self.device)
+        self.transform = face.transform
+
+    def predict(self, images):
+        batch = self.torch.stack([self.transform(image) for image in images]).to(self.device)
+        with self.torch.no_grad():
+            output = self.model(batch)
+        return self.torch.softmax(output, 1)[:, 1].cpu().numpy()
+
+
+DETECTORS = {cls.name: cls for cls in (VitDetector, Meso4Detector, MobileNetDetector)}
+
+
+def evaluate(detector, items, batch_size=32, resolution=None):
+    labels = np.array([label for _, label in items])
+    scores = []
+    batch_latencies = []
+    decode_time = 0.0
+
+    for start in range(0, len(items), batch_size):
+        batch_items = items[start:start + batch_size]
+        t0 = time.perf_counter()
+        images = [load_image(path, resolution) for path, _ in batch_items]
+        t1 = time.perf_counter()
+        scores.append(detector.predict(images))
+        t2 = time.perf_counter()
+        decode_time += t1 - t0
+        batch_latencies.append(t2 - t1)
+
+    scores = np.concatenate(scores)
+    latencies_ms = np.array(batch_latencies) * 1000
+    inference_time = float(np.sum(batch_latencies))
+    predictions = (scores > 0.5).astype(int)
+    return {
+        'images': len(items),
+        'accuracy': round(float(np.mean(predictions == labels)), 4),
+        'roc_auc': round(float(roc_auc_score(labels, scores)), 4) if len(set(labels)) == 2 else None,
+        'images_per_sec': round(len(items) / inference_time, 2),
+        'end_to_end_images_per_sec': round(len(items) / (inference_time + decode_time), 2),
+        'batch_latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 2),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 2),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 2),
+        },
+        'per_image_latency_ms': round(inference_time * 1000 / len(items), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate image detectors for accuracy and throughput")
+    parser.add_argument('--detectors', nargs='+', default=list(DETECTORS), choices=list(DETECTORS))
+    parser.add_argument('--data', default=DATA_DIR)
+    parser.add_argument('--sample-rate', type=int, default=1, help="Use every Nth image of each class")
+    parser.add_argument('--limit', type=int, help="Max images per class")
+    parser.add_argument('--resolution', type=int, help="Resize inputs to this square size before the detector")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--device', default='cpu', choices=['cpu', 'cuda'])
+    parser.add_argument('--output', default='detector_eval.jsonl', help="JSONL file results are appended to")
+    args = parser.parse_args(argv)
+
+    items = list_images(args.data, args.sample_rate, args.limit)
+    config = {
+        'sample_rate': args.sample_rate,
+        'limit': args.limit,
+        'resolution': args.resolution,
+        'batch_size': args.batch_size,
+        'device': args.device,
+    }
+    print(f"Evaluating on {len(items)} images with {config}")
+
+    with open(args.output, 'a') as out:
+        for name in args.detectors:
+            detector = DETECTORS[name](args.device)
+            # Warm up so one-off graph building/allocation doesn't skew latency
+            detector.predict([load_image(items[0][0], args.resolution)])
+            metrics = evaluate(detector, items, args.batch_size, args.resolution)
+            out.write(json.dumps({'detector': name, 'config': config, 'metrics': metrics}) + '\n')
+            print(f"{name:10s} acc={metrics['accuracy']:.4f} auc={metrics['roc_auc']} "
+                  f"{metrics['images_per_sec']:.1f} img/s p50={metrics['batch_latency_ms']['p50']}ms "
+                  f"p95={metrics['batch_latency_ms']['p95']}ms p99={metrics['batch_latency_ms']['p99']}ms")
+    print(f"Results appended to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,100 +3,203 @@ import torch
 import torchvision.models as models
 import cv2
 import numpy as np
-from facenet_pytorch import MTCNN
 from PIL import Image
 import os
 import json
 from torchvision import transforms
+from frame_prep import DETECTION_SIZE, FramePreparer, TensorBuffer
+from frame_pool import FRAME_POOL
+import model_store
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-print(f"Using device: {device}")
 
-mtcnn = MTCNN(keep_all=True, device=device)
-
-mobilenet_model = torch.hub.load('pytorch/vision:v0.10.0', 'mobilenet_v2', pretrained=True).to(device)
-mobilenet_model.eval()
-
-# Modify the final layer for binary classification (Real/Fake)
-num_ftrs = mobilenet_model.classifier[1].in_features
-mobilenet_model.classifier[1] = torch.nn.Linear(num_ftrs, 2).to(device)
-
-# Define preprocessing transformations for MobileNetV2
+# MTCNN and the MobileNetV2 face classifier are built on first use, so
+# processes that import this module without analyzing faces (spawned
+# subprocess and pool workers re-importing the app) do not load them
+_models = None
+
+def load_models():
+    """MTCNN and the MobileNetV2 real/fake classifier, loaded once per process"""
+    global _models
+    if _models is not None:
+        return _models
+    print(f"Using device: {device}")
+
+    mtcnn = model_store.load_mtcnn(device)
+
+    # Prefer the pinned, memory-mapped weights from the local model store
+    mobilenet_model = model_store.load_mobilenet_v2()
+    if mobilenet_model is None:
+        mobilenet_model = torch.hub.load('pytorch/vision:v0.10.0', 'mobilenet_v2', pretrained=True)
+    mobilenet_model = mobilenet_model.to(device)
+    mobilenet_model.eval()
+
+    # Modify the final layer for binary classification (Real/Fake)
+    num_ftrs = mobilenet_model.classifier[1].in_features
+    mobilenet_model.classifier[1] = torch.nn.Linear(num_ftrs, 2)
+    face_head = model_store.load_face_head()
+    if face_head is not None:
+        mobilenet_model.classifier[1].load_state_dict(face_head, assign=True)
+    mobilenet_model.classifier[1] = mobilenet_model.classifier[1].to(device)
+
+    _models = (mtcnn, mobilenet_model)
+    return _models
+
+# Define preprocessing transformations for MobileNetV2 (detect_face_distortion
+# does the same resize/normalize through frame_prep's reused buffers)
 transform = transforms.Compose([
     transforms.Resize((224, 224)),  # Resize to match the input size of MobileNetV2
     transforms.ToTensor(),
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])  # Normalize the image
 ])
 
+def classify_inputs(inputs, count):
+    """Real/Fake labels and fake probabilities for the first `count` faces in the input buffer"""
+    _, mobilenet_model = load_models()
+    with torch.no_grad():
+        output = mobilenet_model(inputs.tensor(count).to(device))
+        return torch.argmax(output, 1).tolist(), torch.softmax(output, 1)[:, 1].tolist()
+
+def classify_faces(frame, preparer, inputs, working=None):
+    """Detect faces in a BGR frame and classify them all in one batch: (boxes, labels, fake probabilities).
+
+    working is the (rgb_small, scale) preparer.working_frame(frame) already returned, if any.
+    """
+    # Detect faces using MTCNN on the small working frame
+    rgb_small, scale = working if working is not None else preparer.working_frame(frame)
+    mtcnn, _ = load_models()
+    boxes, _ = mtcnn.detect(rgb_small)
+    if boxes is None:
+        return [], [], []
+
+    # Crop each face from the full-resolution frame into the reused input batch
+    face_boxes = []
+    for box in boxes:
+        x1, y1, x2, y2 = preparer.map_box(box, scale, frame.shape)
+        if x2 <= x1 or y2 <= y1:
+            continue
+        inputs.fill(len(face_boxes), frame[y1:y2, x1:x2], cv2.COLOR_BGR2RGB)
+        face_boxes.append((x1, y1, x2, y2))
+    if not face_boxes:
+        return [], [], []
+
+    # Perform inference with MobileNetV2 on all faces of the frame at once
+    predicted, fake_probs = classify_inputs(inputs, len(face_boxes))
+    return face_boxes, predicted, fake_probs
+
 # Function to detect deepfakes in real-time
-def detect_face_distortion(video_path, skip_frames=5):
+def detect_face_distortion(video_path, skip_frames=5, cancel_token=None, signals=None, on_progress=None, detection_size=None,
+                           start_frame=0, end_frame=None, memory_budget=None, sample_offset=0):
+    # If a signals dict is passed, the per-face fake probabilities are recorded
+    # into it (frame index + probability) so scoring can be retuned later.
+    # on_progress(frame_count) is called for every sampled frame.
+    # detection_size overrides the longest side MTCNN runs at (frame_prep.DETECTION_SIZE).
+    # start_frame/end_frame limit it to one segment; sampling and the frame
+    # numbers reported then count from start_frame. sample_offset shifts the
+    # sampling phase (pass start_frame to sample the frames a whole-video pass would).
+    # memory_budget (memory_budget.MemoryBudget) thins out sampling and
+    # shrinks detection when the request nears its memory allowance.
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"Error: Could not open video at path {video_path}")
         return 0, 0
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
     frame_count = 0
     total_frames = 0
     distorted_faces = 0
-    example_abnormal_frame = None  # To store one example of an abnormal frame
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
 
-        # Skip frames to reduce processing load
-        frame_count += 1
-        if frame_count % skip_frames != 0:
-            continue
-
-        # Increment total frame count
-        total_frames += 1
+    # Detection runs on a downscaled copy; crops come from the full frame.
+    # Both buffers are reused for every frame of this video, and frames are
+    # decoded into a pooled buffer.
+    detection_size = detection_size or DETECTION_SIZE
+    preparer = FramePreparer(detection_size)
+    inputs = TensorBuffer(224)
+    slot, = FRAME_POOL.acquire(1)
+
+    try:
+        while cap.isOpened():
+            # Stop early (keeping the partial counts) once the deadline hits
+            if cancel_token is not None and cancel_token.cancelled():
+                break
+
+            if end_frame is not None and start_frame + frame_count >= end_frame:
+                break
+
+            # Skipped frames are only grabbed (decoded, never converted to BGR)
+            if not cap.grab():
+                break
+
+            # Skip frames to reduce processing load
+            frame_count += 1
+            stride = skip_frames if memory_budget is None else memory_budget.stride(skip_frames, 'face')
+            if (frame_count + sample_offset) % stride != 0:
+                continue
+
+            if not slot.retrieve(cap):
+                break
+            frame = slot.frame
+            if memory_budget is not None:
+                preparer.working_size = memory_budget.detection_size(detection_size, 'face')
+
+            # Increment total frame count
+            total_frames += 1
+            if on_progress is not None:
+                on_progress(frame_count)
+
+            _, predicted, fake_probs = classify_faces(frame, preparer, inputs)
+            for label, fake_prob in zip(predicted, fake_probs):
+                if signals is not None:
+                    signals.setdefault('face_frame_index', []).append(frame_count)
+                    signals.setdefault('face_fake_prob', []).append(fake_prob)
+
+                # If distortion (deepfake) is detected
+                if label == 1:
+                    distorted_faces += 1
+    finally:
+        # Give the slot back even if the analysis raised
+        cap.release()
+        FRAME_POOL.release([slot])
+    if signals is not None:
+        signals['face_sampled_frames'] = total_frames
+    return total_frames, distorted_faces
 
-        # Convert frame to RGB for MTCNN
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+def detect_face_distortion_frames(frames, cropped=False, cancel_token=None, signals=None, batch_size=16):
+    """detect_face_distortion over already-sampled BGR frames (e.g. an uploaded keyframe bundle).
 
-        # Detect faces using MTCNN
-        boxes, _ = mtcnn.detect(rgb_frame)
-        if boxes is None:
-            continue
+    With cropped=True every frame is a face crop: detection is skipped and
+    the crops are classified in batches. Returns (frames analyzed, distorted faces).
+    """
+    inputs = TensorBuffer(224, max_batch=batch_size)
+    total_frames = 0
+    distorted_faces = 0
 
-        # Process each detected face
-        for box in boxes:
-            x1, y1, x2, y2 = map(int, box)
-            face = rgb_frame[y1:y2, x1:x2]
-
-            # Preprocess the face for MobileNetV2
-            face_pil = Image.fromarray(face)
-            input_tensor = transform(face_pil).unsqueeze(0).to(device)
-
-            # Perform inference with MobileNetV2
-            with torch.no_grad():
-                output = mobilenet_model(input_tensor)
-                _, predicted = torch.max(output, 1)
-                prediction = "Real" if predicted.item() == 0 else "Fake"
-
-            # If distortion (deepfake) is detected
-            if prediction == "Fake":
-                distorted_faces += 1
-
-                # Save one example of an abnormal frame
-                if example_abnormal_frame is None:
-                    example_abnormal_frame = frame.copy()
-
-                # Draw bounding box and label on the frame
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                cv2.putText(frame, "Distorted Face", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-
-    cap.release()
-
-    # Display one example of an abnormal frame
-    # if example_abnormal_frame is not None:
-    #     print("Displaying one example of an abnormal frame:")
-    #     cv2.imshow("Example Abnormal Frame", example_abnormal_frame)
-    #     cv2.waitKey(0)  # Wait until a key is pressed to close the window
-    #     cv2.destroyAllWindows()
-    # else:
-    #     print("No abnormal frames detected.")
+    if cropped:
+        for start in range(0, len(frames), batch_size):
+            if cancel_token is not None and cancel_token.cancelled():
+                break
+            batch = frames[start:start + batch_size]
+            for slot, crop in enumerate(batch):
+                inputs.fill(slot, crop, cv2.COLOR_BGR2RGB)
+            predicted, fake_probs = classify_inputs(inputs, len(batch))
+            total_frames += len(batch)
+            distorted_faces += sum(1 for label in predicted if label == 1)
+            if signals is not None:
+                signals.setdefault('face_frame_index', []).extend(range(start, start + len(batch)))
+                signals.setdefault('face_fake_prob', []).extend(fake_probs)
+    else:
+        preparer = FramePreparer()
+        for index, frame in enumerate(frames):
+            if cancel_token is not None and cancel_token.cancelled():
+                break
+            total_frames += 1
+            _, predicted, fake_probs = classify_faces(frame, preparer, inputs)
+            distorted_faces += sum(1 for label in predicted if label == 1)
+            if signals is not None:
+                signals.setdefault('face_frame_index', []).extend([index] * len(fake_probs))
+                signals.setdefault('face_fake_prob', []).extend(fake_probs)
+
+    if signals is not None:
+        signals['face_sampled_frames'] = total_frames
     return total_frames, distorted_faces
-
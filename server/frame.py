@@ -4,6 +4,9 @@ import cv2
 import numpy as np
 from scipy.spatial.distance import cosine
 from torchvision import transforms
+from frame_prep import TensorBuffer
+from frame_pool import FRAME_POOL
+import model_store
 from facenet_pytorch import MTCNN
 from PIL import Image
 import os
@@ -17,7 +20,6 @@ import json
 
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-print(f"Using device: {device}")
 
 # Define preprocessing transformations with smaller resolution
 transform = transforms.Compose([
@@ -32,10 +34,23 @@ def preprocess_frame(frame):
     frame = transform(frame).unsqueeze(0)  # Add batch dimension
     return frame
 
-# Load a smaller pre-trained model (e.g., MobileNet)
-model = models.mobilenet_v2(pretrained=True)
-model = torch.nn.Sequential(*list(model.children())[:-1])  # Remove the final classification layer
-model.eval()
+# The feature extractor is built on first use, so processes that import
+# this module without analyzing frames (spawned workers re-importing the
+# app) do not load it
+_model = None
+
+def load_model():
+    """A smaller pre-trained model (MobileNetV2 without its classifier), loaded once per process"""
+    global _model
+    if _model is None:
+        print(f"Using device: {device}")
+        model = model_store.load_mobilenet_v2()  # pinned, memory-mapped weights when the store is populated
+        if model is None:
+            model = models.mobilenet_v2(pretrained=True)
+        model = torch.nn.Sequential(*list(model.children())[:-1])  # Remove the final classification layer
+        model.eval()
+        _model = model
+    return _model
 
 # Function to extract features from a frame using the pre-trained model
 def extract_features(frame, model):
@@ -51,54 +66,129 @@ def cosine_similarity(vec1, vec2):
     return 1 - cosine(vec1, vec2)
 
 # Function to detect frame anomalies and display only abnormal frames
-def detect_frame_anomalies(video_path, skip_frames=5):
+def detect_frame_anomalies(video_path, skip_frames=5, cancel_token=None, signals=None, on_progress=None,
+                           start_frame=0, end_frame=None, memory_budget=None, sample_offset=0):
+    # If a signals dict is passed, the similarity of each sampled frame to the
+    # previous one is recorded into it so the threshold can be retuned later,
+    # along with the features (and frame number) of the first and last sampled frames.
+    # on_progress(frame_count) is called for every sampled frame.
+    # start_frame/end_frame limit it to one segment; sampling and the frame
+    # numbers reported then count from start_frame. sample_offset shifts the
+    # sampling phase (pass start_frame to sample the frames a whole-video pass would).
+    # memory_budget (memory_budget.MemoryBudget) thins out sampling when the
+    # request nears its memory allowance.
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"Error: Could not open video at path {video_path}")
         return 0, 0
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
+    inputs = TensorBuffer(112, max_batch=1)
+    # Frames are decoded into a pooled buffer reused for the whole video
+    slot, = FRAME_POOL.acquire(1)
     prev_features = None
     frame_count = 0
     total_frames = 0
     abnormal_frames = 0
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Skip frames to reduce processing load
-        frame_count += 1
-        if frame_count % skip_frames != 0:
-            continue
+    try:
+        while cap.isOpened():
+            # Stop early (keeping the partial counts) once the deadline hits
+            if cancel_token is not None and cancel_token.cancelled():
+                break
+
+            if end_frame is not None and start_frame + frame_count >= end_frame:
+                break
+
+            # Skipped frames are only grabbed (decoded, never converted to BGR)
+            if not cap.grab():
+                break
+
+            # Skip frames to reduce processing load
+            frame_count += 1
+            stride = skip_frames if memory_budget is None else memory_budget.stride(skip_frames, 'frame')
+            if (frame_count + sample_offset) % stride != 0:
+                continue
+
+            if not slot.retrieve(cap):
+                break
+            frame = slot.frame
+
+            # Increment total frame count
+            total_frames += 1
+            if on_progress is not None:
+                on_progress(frame_count)
+
+            # Preprocess the frame straight into the reused 112x112 input buffer
+            # (channels passed through as-is, like preprocess_frame)
+            inputs.fill(0, frame)
+            input_tensor = inputs.tensor(1)
+
+            # Extract features using the pre-trained model
+            current_features = extract_features(input_tensor, load_model())
+
+            if signals is not None and prev_features is None:
+                signals['frame_first_features'] = current_features
+                signals['frame_first_index'] = frame_count
+
+            # Compare with previous frame's features
+            if prev_features is not None:
+                similarity = cosine_similarity(prev_features, current_features)
+                if signals is not None:
+                    signals.setdefault('frame_index', []).append(frame_count)
+                    signals.setdefault('frame_similarity', []).append(float(similarity))
+
+                # Detect anomaly based on similarity threshold
+                if similarity < ANOMALY_THRESHOLD:
+                    abnormal_frames += 1
+                    # Display the abnormal frame
+                    anomaly_status = "Anomaly Detected"
+                    color = (0, 0, 255)  # Red color for anomalies
+                    cv2.putText(frame, f"Status: {anomaly_status}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+                    cv2.imshow("Frame", frame)
+                    cv2.waitKey(1)  # Wait for a short time to display the frame
+
+            # Update previous features
+            prev_features = current_features
+    finally:
+        # Give the slot back even if the analysis raised
+        cap.release()
+        FRAME_POOL.release([slot])
+    cv2.destroyAllWindows()
+    if signals is not None:
+        signals['frame_sampled_frames'] = total_frames
+        if prev_features is not None:
+            signals['frame_last_features'] = prev_features
+    return total_frames, abnormal_frames
 
-        # Increment total frame count
-        total_frames += 1
+def detect_frame_anomalies_frames(frames, cancel_token=None, signals=None):
+    """detect_frame_anomalies over already-sampled BGR frames (e.g. an uploaded keyframe bundle).
 
-        # Preprocess the frame
-        input_tensor = preprocess_frame(frame)
+    Each frame is compared with the one before it in the list, so the
+    spacing of the uploaded frames plays the role of skip_frames.
+    """
+    inputs = TensorBuffer(112, max_batch=1)
+    prev_features = None
+    total_frames = 0
+    abnormal_frames = 0
 
-        # Extract features using the pre-trained model
-        current_features = extract_features(input_tensor, model)
+    for index, frame in enumerate(frames):
+        if cancel_token is not None and cancel_token.cancelled():
+            break
+        total_frames += 1
+        inputs.fill(0, frame)
+        current_features = extract_features(inputs.tensor(1), load_model())
 
-        # Compare with previous frame's features
         if prev_features is not None:
             similarity = cosine_similarity(prev_features, current_features)
-
-            # Detect anomaly based on similarity threshold
+            if signals is not None:
+                signals.setdefault('frame_index', []).append(index)
+                signals.setdefault('frame_similarity', []).append(float(similarity))
             if similarity < ANOMALY_THRESHOLD:
                 abnormal_frames += 1
-                # Display the abnormal frame
-                anomaly_status = "Anomaly Detected"
-                color = (0, 0, 255)  # Red color for anomalies
-                cv2.putText(frame, f"Status: {anomaly_status}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
-                cv2.imshow("Frame", frame)
-                cv2.waitKey(1)  # Wait for a short time to display the frame
-
-        # Update previous features
         prev_features = current_features
 
-    cap.release()
-    cv2.destroyAllWindows()
+    if signals is not None:
+        signals['frame_sampled_frames'] = total_frames
     return total_frames, abnormal_frames
-
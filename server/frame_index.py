@@ -0,0 +1,243 @@
+"""
+Persistent near-duplicate frame index for known-fake lookup.
+
+Every fully analyzed upload adds a handful of evenly spaced frames to the
+index: a pooled MobileNetV2 embedding (the frame.py model) and a 64-bit
+difference hash. A new upload's sampled frames are looked up first - by
+hash bands (exact/near re-encodes) and by random-hyperplane LSH buckets over
+the embeddings (crops, trims, colour changes) - and if most of them match
+one earlier video its verdict is reused: straight away for a manipulated
+verdict, and for any other only once the upload's own face stage agrees
+(see analysis.run_shortcuts), since a face swap of indexed authentic
+footage matches that footage.
+
+The index lives in an SQLite database (WAL mode) shared by every server and
+batch_scan process. add() is one insert transaction - the video row and its
+frames together - and each process keeps an in-memory copy of the vectors
+and buckets that query() tops up with the rows added since its last look,
+including other processes' additions.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+import torch
+
+from frame import load_model, preprocess_frame
+from frame_prep import difference_hash
+
+FRAME_INDEX_DIR = os.environ.get('FRAME_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frame_index'))
+
+SAMPLED_FRAMES = 16
+# A sampled frame matches an indexed one above this cosine similarity / below this Hamming distance
+EMBEDDING_MATCH = 0.92
+HASH_MATCH_BITS = 6
+# Fraction of sampled frames that must match the same earlier video
+VIDEO_MATCH_FRACTION = 0.6
+
+LSH_TABLES = 8
+LSH_BITS = 12
+HASH_BANDS = 4
+
+# Result fields kept per indexed video and returned on a match
+VERDICT_FIELDS = ['confidence_score', 'risk_level', 'analysis_result', 'detailed_scores', 'content_hash',
+                  'total_frames', 'distorted_faces']
+
+# Blank, black or flat frames (grey-level standard deviation below this) look alike
+# in every video - their dHash is 0 - so they are neither indexed nor looked up
+MIN_FRAME_STD = 4.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    verdict TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    video_id INTEGER NOT NULL REFERENCES videos (id),
+    hash INTEGER NOT NULL,
+    embedding BLOB NOT NULL
+);
+"""
+
+
+def frame_embedding(frame):
+    """L2-normalized, spatially pooled MobileNetV2 feature vector (1280-d)"""
+    with torch.no_grad():
+        features = load_model()(preprocess_frame(frame))
+    vector = features.mean(dim=(2, 3)).squeeze(0).numpy()
+    return vector / max(np.linalg.norm(vector), 1e-8)
+
+
+def is_low_variance(frame):
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+    return float(small.std()) < MIN_FRAME_STD
+
+
+def sample_signatures(video_path, num_frames=SAMPLED_FRAMES):
+    """Embeddings and hashes for num_frames evenly spaced frames of the video (low-variance frames left out)"""
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    embeddings, hashes = [], []
+    try:
+        for index in np.linspace(0, max(total - 1, 0), num_frames).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if not ret or is_low_variance(frame):
+                continue
+            embeddings.append(frame_embedding(frame))
+            hashes.append(difference_hash(frame))
+    finally:
+        cap.release()
+    return {
+        'embeddings': np.array(embeddings, dtype=np.float32).reshape(-1, 1280),
+        'hashes': np.array(hashes, dtype=np.uint64),
+    }
+
+
+def connect(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    # One connection per index, used under the index lock from any request thread
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def hamming(a, b):
+    """Bit distance between one hash and an array of hashes"""
+    return np.unpackbits((np.asarray(b, dtype=np.uint64) ^ np.uint64(a)).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class FrameIndex:
+    def __init__(self, index_dir=FRAME_INDEX_DIR):
+        self.index_dir = index_dir
+        self.lock = threading.Lock()
+        # Fixed seed so bucket codes stay stable across restarts
+        rng = np.random.default_rng(0)
+        self.planes = rng.standard_normal((LSH_TABLES * LSH_BITS, 1280)).astype(np.float32)
+        self.bit_weights = 1 << np.arange(LSH_BITS)
+        self.embeddings = np.zeros((0, 1280), dtype=np.float16)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.video_ids = np.zeros(0, dtype=np.int64)
+        self.videos = {}
+        self.last_frame_id = 0
+        self.lsh_buckets = [{} for _ in range(LSH_TABLES)]
+        self.band_buckets = [{} for _ in range(HASH_BANDS)]
+        self.conn = connect(os.path.join(index_dir, 'index.db'))
+        self.refresh()
+
+    # ----------- PERSISTENCE -------------
+
+    def refresh(self):
+        """Load the rows other writers (and this one) have added since the last refresh.
+
+        Call with self.lock held.
+        """
+        frames = self.conn.execute(
+            'SELECT id, video_id, hash, embedding FROM frames WHERE id > ? ORDER BY id', (self.last_frame_id,)).fetchall()
+        if not frames:
+            return
+        # Read after the frames: a video's row is committed with its frames, so every id seen is here
+        known = max(self.videos, default=0)
+        for video_id, verdict in self.conn.execute('SELECT id, verdict FROM videos WHERE id > ?', (known,)):
+            self.videos[video_id] = json.loads(verdict)
+
+        embeddings = np.frombuffer(b''.join(row[3] for row in frames), dtype=np.float16).reshape(-1, 1280)
+        hashes = np.array([row[2] for row in frames], dtype=np.int64).view(np.uint64)
+        start = len(self.embeddings)
+        self.embeddings = np.concatenate([self.embeddings, embeddings])
+        self.hashes = np.concatenate([self.hashes, hashes])
+        self.video_ids = np.concatenate([self.video_ids, np.array([row[1] for row in frames], dtype=np.int64)])
+        self.add_to_buckets(range(start, start + len(frames)), self.lsh_codes(embeddings), self.hash_bands(hashes))
+        self.last_frame_id = frames[-1][0]
+
+    # ----------- BUCKETS -------------
+
+    def lsh_codes(self, embeddings):
+        bits = (np.asarray(embeddings, dtype=np.float32) @ self.planes.T) > 0
+        return bits.reshape(len(bits), LSH_TABLES, LSH_BITS) @ self.bit_weights
+
+    def hash_bands(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        width = 64 // HASH_BANDS
+        return np.stack([(hashes >> np.uint64(band * width)) & np.uint64((1 << width) - 1)
+                         for band in range(HASH_BANDS)], axis=1)
+
+    def add_to_buckets(self, rows, codes, bands):
+        for row, row_codes, row_bands in zip(rows, codes, bands):
+            for table, code in enumerate(row_codes):
+                self.lsh_buckets[table].setdefault(int(code), []).append(int(row))
+            for band, value in enumerate(row_bands):
+                self.band_buckets[band].setdefault(int(value), []).append(int(row))
+
+    # ----------- QUERY / ADD -------------
+
+    def query(self, signatures):
+        """Best earlier video for these sampled frames, or None if it isn't a strong match"""
+        embeddings, hashes = signatures['embeddings'], signatures['hashes']
+        if len(embeddings) == 0:
+            return None
+
+        with self.lock:
+            self.refresh()
+            if not self.videos:
+                return None
+            codes = self.lsh_codes(embeddings)
+            bands = self.hash_bands(hashes)
+            votes = {}
+            for embedding, frame_hash, frame_codes, frame_bands in zip(embeddings, hashes, codes, bands):
+                candidates = set()
+                for table, code in enumerate(frame_codes):
+                    candidates.update(self.lsh_buckets[table].get(int(code), ()))
+                # Hashes that differ in fewer than HASH_BANDS bits always share a band;
+                # looser hash matches rely on the embedding buckets to surface them
+                for band, value in enumerate(frame_bands):
+                    candidates.update(self.band_buckets[band].get(int(value), ()))
+                if not candidates:
+                    continue
+
+                rows = np.fromiter(candidates, dtype=np.int64)
+                similar = self.embeddings[rows].astype(np.float32) @ embedding >= EMBEDDING_MATCH
+                close = hamming(frame_hash, self.hashes[rows]) <= HASH_MATCH_BITS
+                for video_id in set(self.video_ids[rows[similar | close]].tolist()):
+                    votes[video_id] = votes.get(video_id, 0) + 1
+
+            if not votes:
+                return None
+            video_id, matched = max(votes.items(), key=lambda item: item[1])
+            match_fraction = matched / len(embeddings)
+            if match_fraction < VIDEO_MATCH_FRACTION:
+                return None
+            return dict(self.videos[video_id], match_fraction=round(match_fraction, 3))
+
+    def add(self, signatures, results):
+        """Insert one video's frames; a single transaction, whatever the index size"""
+        embeddings, hashes = signatures['embeddings'], signatures['hashes']
+        if len(embeddings) == 0:
+            return
+        verdict = json.dumps({field: results.get(field) for field in VERDICT_FIELDS}, default=float)
+        # SQLite integers are signed 64-bit
+        signed_hashes = np.asarray(hashes, dtype=np.uint64).view(np.int64).tolist()
+        with self.lock, self.conn:
+            video_id = self.conn.execute('INSERT INTO videos (verdict) VALUES (?)', (verdict,)).lastrowid
+            self.conn.executemany(
+                'INSERT INTO frames (video_id, hash, embedding) VALUES (?, ?, ?)',
+                [(video_id, frame_hash, embedding.astype(np.float16).tobytes())
+                 for frame_hash, embedding in zip(signed_hashes, embeddings)])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FrameIndex()
+    return _index
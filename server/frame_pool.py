@@ -0,0 +1,162 @@
+"""
+Pooled frame buffers and the fixed-capacity ring decoded frames pass through.
+
+Every retrieve() used to hand back a freshly allocated frame, and whatever
+kept a reference (copies for display, lists of frames) kept it alive until
+the garbage collector got to it. Decoders now retrieve into FrameSlots
+borrowed from a process-wide pool: OpenCV writes each frame into the slot's
+existing buffer, so a video costs a fixed number of frame buffers however
+long it is, and the buffers are handed to the next request when it's done.
+
+A FrameRing is a few slots one decoder fills and several readers consume,
+each seeing every frame in order. The decoder waits while the slowest
+reader is a full ring behind, so memory stays at `capacity` frames and the
+readers (one thread per analyzer) run in parallel over the same decode.
+"""
+import os
+import threading
+
+from frame_prep import FramePreparer
+from memory_budget import MB, REQUEST_MEMORY_BUDGET_MB, RING_SHARE
+
+# Slots kept for reuse once requests give them back; beyond this they are freed.
+# The idle buffers sit outside every request's budget, so together they may
+# hold no more than one request's ring share (about 25 slots at 1080p)
+POOL_MAX_FREE = int(os.environ.get('FRAME_POOL_MAX_FREE', 64))
+POOL_MAX_FREE_BYTES = REQUEST_MEMORY_BUDGET_MB * MB * RING_SHARE
+RING_CAPACITY = int(os.environ.get('FRAME_RING_CAPACITY', 8))
+
+
+class FrameSlot:
+    """A reusable decoded-frame buffer plus the working frame derived from it"""
+
+    def __init__(self):
+        self.frame = None
+        self.frame_count = 0
+        self.preparer = FramePreparer()
+        self.lock = threading.Lock()
+        self._working = None
+
+    def retrieve(self, cap):
+        """Retrieve the frame cap just grabbed into this slot's buffer"""
+        if self.frame is not None:
+            ret, frame = cap.retrieve(self.frame)
+        else:
+            ret, frame = cap.retrieve()
+        if ret:
+            # Same array unless the frame size changed
+            self.frame = frame
+            self._working = None
+        return ret
+
+    def working(self):
+        """(rgb_small, scale) of the current frame, computed once whichever reader asks first"""
+        with self.lock:
+            if self._working is None:
+                self._working = self.preparer.working_frame(self.frame)
+            return self._working
+
+    def nbytes(self):
+        return self.frame.nbytes if self.frame is not None else 0
+
+
+class FramePool:
+    """Process-wide free list of FrameSlots; requests borrow slots and give them back"""
+
+    def __init__(self, max_free=POOL_MAX_FREE, max_free_bytes=POOL_MAX_FREE_BYTES):
+        self.max_free = max_free
+        self.max_free_bytes = max_free_bytes
+        self.free = []
+        self.free_bytes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, count):
+        with self.lock:
+            slots = [self.free.pop() for _ in range(min(count, len(self.free)))]
+            self.free_bytes -= sum(slot.nbytes() for slot in slots)
+        return slots + [FrameSlot() for _ in range(count - len(slots))]
+
+    def release(self, slots):
+        with self.lock:
+            for slot in slots:
+                if len(self.free) >= self.max_free or self.free_bytes + slot.nbytes() > self.max_free_bytes:
+                    break
+                self.free.append(slot)
+                self.free_bytes += slot.nbytes()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'free_slots': len(self.free),
+                'free_mb': round(self.free_bytes / MB, 1),
+                'max_free_mb': round(self.max_free_bytes / MB, 1),
+            }
+
+
+FRAME_POOL = FramePool()
+
+
+class FrameRing:
+    """Fixed-capacity ring of pooled slots: one writer, `readers` readers that each see every frame in order"""
+
+    def __init__(self, capacity, readers, pool=FRAME_POOL):
+        self.pool = pool
+        self.slots = pool.acquire(max(1, capacity))
+        self.capacity = len(self.slots)
+        self.written = 0
+        self.positions = [0] * readers
+        self.finished = [False] * readers
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def has_room(self):
+        active = [position for position, finished in zip(self.positions, self.finished) if not finished]
+        return not active or self.written - min(active) < self.capacity
+
+    def write(self, cap, frame_count):
+        """Retrieve the frame cap just grabbed into the next slot. False if it couldn't be
+        read or no reader is left."""
+        with self.cond:
+            while not self.has_room():
+                self.cond.wait()
+            if all(self.finished):
+                return False
+            slot = self.slots[self.written % self.capacity]
+        # No reader is on this slot until `written` moves past it
+        if not slot.retrieve(cap):
+            return False
+        slot.frame_count = frame_count
+        with self.cond:
+            self.written += 1
+            self.cond.notify_all()
+        return True
+
+    def close(self):
+        """No more frames: readers finish once they have seen everything written"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def read(self, reader):
+        """The slots in order for one reader; a slot stays valid until the next one is requested"""
+        try:
+            while True:
+                with self.cond:
+                    while self.positions[reader] >= self.written and not self.closed:
+                        self.cond.wait()
+                    if self.positions[reader] >= self.written:
+                        return
+                    slot = self.slots[self.positions[reader] % self.capacity]
+                yield slot
+                with self.cond:
+                    self.positions[reader] += 1
+                    self.cond.notify_all()
+        finally:
+            # A reader that stops early must not hold the writer back
+            with self.cond:
+                self.finished[reader] = True
+                self.cond.notify_all()
+
+    def release(self):
+        self.pool.release(self.slots)
+        self.slots = []
@@ -0,0 +1,98 @@
+"""
+Frame preparation shared by the analyzers.
+
+Detection runs on a small working copy of each frame; boxes found there are
+mapped back to the full-resolution frame so only the face crops the
+classifier needs are taken at full quality. Both the working frame and the
+normalized model input batch live in buffers that are allocated once per
+video and reused for every frame, instead of going through PIL and fresh
+arrays per frame.
+
+Buffers are not thread-safe: create one FramePreparer/TensorBuffer per
+video being processed.
+"""
+import os
+
+import cv2
+import numpy as np
+import torch
+
+# Longest side of the working frame detection runs on
+DETECTION_SIZE = int(os.environ.get('DETECTION_SIZE', 480))
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+
+class FramePreparer:
+    def __init__(self, working_size=DETECTION_SIZE):
+        self.working_size = working_size
+        self.small = None
+        self.small_rgb = None
+
+    def working_frame(self, frame, rgb=True):
+        """Downscaled (RGB) copy of a BGR frame in a reused buffer, and the scale used"""
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.working_size / max(h, w))
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        if self.small is None or self.small.shape[:2] != (size[1], size[0]):
+            self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.small_rgb = np.empty_like(self.small)
+
+        source = frame
+        if scale < 1:
+            cv2.resize(frame, size, dst=self.small, interpolation=cv2.INTER_AREA)
+            source = self.small
+        if not rgb:
+            return source, scale
+        cv2.cvtColor(source, cv2.COLOR_BGR2RGB, dst=self.small_rgb)
+        return self.small_rgb, scale
+
+    @staticmethod
+    def map_box(box, scale, frame_shape):
+        """Map an (x1, y1, x2, y2) box from the working frame back to the original, clamped"""
+        h, w = frame_shape[:2]
+        x1, y1, x2, y2 = (float(v) / scale for v in box)
+        x1, x2 = int(max(0, min(w, x1))), int(max(0, min(w, x2)))
+        y1, y2 = int(max(0, min(h, y1))), int(max(0, min(h, y2)))
+        return x1, y1, x2, y2
+
+
+class TensorBuffer:
+    """Reused (N, 3, size, size) ImageNet-normalized float32 input batch"""
+
+    def __init__(self, size, max_batch=4):
+        self.size = size
+        self.resized = np.empty((size, size, 3), dtype=np.uint8)
+        self.converted = np.empty_like(self.resized)
+        self.batch = np.empty((max_batch, 3, size, size), dtype=np.float32)
+
+    def fill(self, index, image, color_conversion=None):
+        """Resize image into slot `index` of the batch and normalize it in place"""
+        if index >= len(self.batch):
+            grown = np.empty((max(index + 1, 2 * len(self.batch)), 3, self.size, self.size), dtype=np.float32)
+            grown[:len(self.batch)] = self.batch
+            self.batch = grown
+
+        cv2.resize(image, (self.size, self.size), dst=self.resized, interpolation=cv2.INTER_AREA)
+        source = self.resized
+        if color_conversion is not None:
+            cv2.cvtColor(self.resized, color_conversion, dst=self.converted)
+            source = self.converted
+
+        slot = self.batch[index]
+        np.multiply(source.transpose(2, 0, 1), 1.0 / 255.0, out=slot, casting='unsafe')
+        slot -= IMAGENET_MEAN
+        slot /= IMAGENET_STD
+
+    def tensor(self, count):
+        """First `count` slots as a tensor sharing the buffer's memory"""
+        return torch.from_numpy(self.batch[:count])
+
+
+def difference_hash(frame):
+    """64-bit dHash of a BGR frame"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64)
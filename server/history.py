@@ -0,0 +1,191 @@
+"""
+Local history of completed analyses, in an embedded SQLite database.
+
+Request handlers call record(), which only puts the result on a queue; a
+single writer thread drains the queue and inserts in batched transactions,
+so the request path never waits on disk. The database runs in WAL mode so
+the dashboard's list/get queries read concurrently with the writer.
+
+Listing is keyset-paginated on (created_at, id) with indexes for the three
+query shapes the dashboard uses - newest first, by risk level, by content
+hash - so a page costs the same at row 10 as at row 500,000.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+HISTORY_DB_PATH = os.environ.get('HISTORY_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.db'))
+# Results waiting to be written; beyond this record() drops instead of blocking the request
+HISTORY_QUEUE_SIZE = 10000
+HISTORY_BATCH_SIZE = 200
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    filename TEXT,
+    content_hash TEXT,
+    status TEXT,
+    confidence_score REAL,
+    risk_level TEXT,
+    analysis_result TEXT,
+    processing_time REAL,
+    stage_ms TEXT,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_created ON analyses (created_at, id);
+CREATE INDEX IF NOT EXISTS analyses_risk ON analyses (risk_level, created_at, id);
+CREATE INDEX IF NOT EXISTS analyses_hash ON analyses (content_hash, created_at, id);
+"""
+
+# Columns returned by list queries (the full result document only comes with get)
+SUMMARY_COLUMNS = ('id', 'created_at', 'source', 'filename', 'content_hash', 'status',
+                   'confidence_score', 'risk_level', 'analysis_result', 'processing_time')
+
+
+def connect(db_path=HISTORY_DB_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def history_row(result, source, filename=None, created_at=None):
+    """Column values for one analysis result"""
+    plan = result.get('plan') or {}
+    return (
+        time.time() if created_at is None else created_at,
+        source,
+        filename,
+        result.get('content_hash'),
+        result.get('status', 'failed' if 'error' in result else 'completed'),
+        result.get('confidence_score'),
+        result.get('risk_level'),
+        result.get('analysis_result'),
+        result.get('processing_time'),
+        json.dumps(plan['stage_ms']) if 'stage_ms' in plan else None,
+        json.dumps(result, default=float),
+    )
+
+
+class HistoryStore:
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.db_path = db_path
+        self.pending = queue.Queue(maxsize=HISTORY_QUEUE_SIZE)
+        self.dropped = 0
+        self.local = threading.local()
+        connect(db_path).close()
+
+        self.writer = threading.Thread(target=self.write_loop, name='history-writer', daemon=True)
+        self.writer.start()
+
+    def record(self, result, source, filename=None):
+        """Queue a result for writing; never blocks the caller"""
+        try:
+            self.pending.put_nowait(history_row(result, source, filename))
+        except queue.Full:
+            self.dropped += 1
+
+    def write_loop(self):
+        conn = connect(self.db_path)
+        while True:
+            rows = [self.pending.get()]
+            while len(rows) < HISTORY_BATCH_SIZE:
+                try:
+                    rows.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO analyses (created_at, source, filename, content_hash, status, confidence_score, '
+                        'risk_level, analysis_result, processing_time, stage_ms, result) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            except sqlite3.Error as e:
+                print(f"Error writing analysis history: {str(e)}")
+            for _ in rows:
+                self.pending.task_done()
+
+    def flush(self):
+        """Wait until everything queued so far is written"""
+        self.pending.join()
+
+    def reader(self):
+        """Per-thread read connection"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.db_path)
+        return conn
+
+    def list(self, limit=DEFAULT_PAGE_SIZE, cursor=None, risk_level=None, content_hash=None, since=None, until=None):
+        """One page of summaries, newest first, and the cursor for the next page (None at the end).
+
+        cursor is the 'next_cursor' of the previous page ("<created_at>:<id>").
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, params = [], []
+        if risk_level is not None:
+            clauses.append('risk_level = ?')
+            params.append(risk_level)
+        if content_hash is not None:
+            clauses.append('content_hash = ?')
+            params.append(content_hash)
+        if since is not None:
+            clauses.append('created_at >= ?')
+            params.append(float(since))
+        if until is not None:
+            clauses.append('created_at < ?')
+            params.append(float(until))
+        if cursor:
+            created_at, row_id = cursor.split(':')
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend([float(created_at), int(row_id)])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.reader().execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM analyses {where} "
+            f"ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit + 1]).fetchall()
+
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = f"{last['created_at']!r}:{last['id']}"
+        return items, next_cursor
+
+    def get(self, analysis_id):
+        """Full record of one analysis (None if there is no such id)"""
+        row = self.reader().execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)}, stage_ms, result FROM analyses WHERE id = ?",
+            (int(analysis_id),)).fetchone()
+        if row is None:
+            return None
+        item = dict(row)
+        item['stage_ms'] = json.loads(item['stage_ms']) if item['stage_ms'] else None
+        item['result'] = json.loads(item['result'])
+        return item
+
+    def stats(self):
+        return {'queued': self.pending.qsize(), 'dropped': self.dropped}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history():
+    """Process-wide history store, created (with its writer thread) on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+    return _store
@@ -0,0 +1,374 @@
+"""
+Concurrency load test for the Flask endpoints.
+
+Replays the sample media (videos in uploads/, face images in
+Deepfake-detection/data/) against /predict, /process_video and the
+/analyze_* routes and reports throughput, p50/p95/p99 latency, error and
+413/429 rates per endpoint, plus the server's RSS (including its worker
+processes) sampled over the run.
+
+Arrivals are either closed-loop (--rate 0: each of --concurrency clients
+sends its next request as soon as the last one returns) or open-loop
+Poisson at --rate requests/second, where latency is measured from the
+scheduled arrival so queueing behind a slow server is counted.
+
+To measure server overhead on its own - upload handling, temp files,
+decoding, frame preparation, orchestration, JSON - run the real app with
+MODEL_STUB_MS set, so model_store loads model_stubs.py's stand-ins: every
+model call sleeps for a fixed time and returns well-formed output:
+
+    python load_test.py serve --stub-latency-ms 5 --port 5001
+    python load_test.py run --url http://127.0.0.1:5001 --concurrency 16 --duration 60
+
+or let the run start the stub server itself with --stub-server 5.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MEDIA = [os.path.join(SERVER_DIR, 'uploads'), os.path.join(SERVER_DIR, '..', 'Deepfake-detection', 'data')]
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+# Images are sampled from the (large) dataset rather than all held in memory
+MAX_IMAGES = 200
+
+# name -> (route, form field, media kind)
+ENDPOINTS = {
+    'predict': ('/predict', 'image', 'image'),
+    'predict_video': ('/predict', 'video', 'video'),
+    'process_video': ('/process_video', 'video', 'video'),
+    'analyze_distortions': ('/analyze_distortions', 'video', 'video'),
+    'analyze_frame': ('/analyze_frame', 'video', 'video'),
+    'analyze_audio': ('/analyze_audio', 'video', 'video'),
+    'analyze_sync': ('/analyze_sync', 'video', 'video'),
+    'analyze_sentiment': ('/analyze_sentiment', 'video', 'video'),
+    'analyze': ('/analyze', 'video', 'video'),
+}
+DEFAULT_ENDPOINTS = ['predict', 'process_video', 'analyze_distortions', 'analyze_frame', 'analyze_audio']
+
+
+# ----------- STUB SERVER -------------
+
+def serve(port, stub_latency_ms):
+    # model_store hands out model_stubs' stand-ins for every model; spawned
+    # stage and pool workers inherit the flag. The on-disk stores go to a
+    # scratch directory so stub verdicts never reach the real index or history.
+    os.environ['MODEL_STUB_MS'] = str(stub_latency_ms)
+    scratch = tempfile.mkdtemp(prefix='load_test_')
+    os.environ['FRAME_INDEX_DIR'] = os.path.join(scratch, 'frame_index')
+    os.environ['SIGNAL_STORE_DIR'] = os.path.join(scratch, 'signal_store')
+    os.environ['SEGMENT_CACHE_DIR'] = os.path.join(scratch, 'segment_cache')
+    os.environ['HISTORY_DB_PATH'] = os.path.join(scratch, 'history.db')
+    sys.path.insert(0, SERVER_DIR)
+    from app import app
+    app.run(host='127.0.0.1', port=port, threaded=True, debug=False)
+
+
+# ----------- LOAD GENERATOR -------------
+
+def load_media(directories):
+    """{'video': [(filename, bytes)], 'image': [...]} from the sample media directories"""
+    found = {'video': [], 'image': []}
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+                kind = 'video' if extension in VIDEO_EXTENSIONS else 'image' if extension in IMAGE_EXTENSIONS else None
+                if kind is not None:
+                    found[kind].append(os.path.join(dirpath, filename))
+
+    random.shuffle(found['image'])
+    media = {}
+    for kind, paths in found.items():
+        media[kind] = []
+        for path in sorted(paths[:MAX_IMAGES] if kind == 'image' else paths):
+            with open(path, 'rb') as file:
+                media[kind].append((os.path.basename(path), file.read()))
+    return media
+
+
+class LoadRun:
+    def __init__(self, url, endpoints, media, timeout=300):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.endpoints = endpoints
+        self.media = media
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.records = []
+        self.counter = 0
+
+    def session(self):
+        if getattr(self.local, 'session', None) is None:
+            self.local.session = self.requests.Session()
+        return self.local.session
+
+    def next_request(self):
+        """Round-robin over endpoints, and over the media of the kind each one takes"""
+        with self.lock:
+            self.counter += 1
+            count = self.counter
+        name = self.endpoints[count % len(self.endpoints)]
+        route, field, kind = ENDPOINTS[name]
+        filename, data = self.media[kind][count % len(self.media[kind])]
+        return name, route, field, filename, data
+
+    def send(self, scheduled_at, started_at):
+        name, route, field, filename, data = self.next_request()
+        status = None
+        try:
+            response = self.session().post(self.url + route, files={field: (filename, data)}, timeout=self.timeout)
+            status = response.status_code
+        except self.requests.RequestException as e:
+            print(f"{name}: {type(e).__name__}: {e}")
+        finished = time.perf_counter()
+        with self.lock:
+            self.records.append({
+                'endpoint': name,
+                'status': status,
+                'bytes': len(data),
+                'offset_s': scheduled_at - started_at,
+                'latency_ms': (finished - scheduled_at) * 1000,
+            })
+
+    def run_closed(self, concurrency, duration):
+        started = time.perf_counter()
+        deadline = started + duration
+
+        def client():
+            while time.perf_counter() < deadline:
+                self.send(time.perf_counter(), started)
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def run_open(self, concurrency, duration, rate):
+        started = time.perf_counter()
+        next_arrival = started
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while next_arrival < started + duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, next_arrival, started)
+                next_arrival += random.expovariate(rate)
+        return time.perf_counter() - started
+
+
+class RssSampler:
+    """Resident memory of a process and all its children, sampled in the background"""
+
+    def __init__(self, pid, interval=1.0):
+        import psutil
+        self.process = psutil.Process(pid)
+        self.psutil = psutil
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def rss(self):
+        total = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                total += process.memory_info().rss
+            except self.psutil.Error:
+                pass
+        return total
+
+    def run(self):
+        started = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                self.samples.append((round(time.perf_counter() - started, 2), self.rss()))
+            except self.psutil.Error:
+                break
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def summarize(records, elapsed):
+    """Throughput, latency percentiles and status rates for a list of request records"""
+    if not records:
+        return {'requests': 0}
+    statuses = [record['status'] for record in records]
+    ok_latencies = np.array([record['latency_ms'] for record in records if record['status'] is not None and record['status'] < 400])
+    latencies = ok_latencies if ok_latencies.size else np.array([record['latency_ms'] for record in records])
+    total = len(records)
+    return {
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 3),
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies, 50)), 1),
+            'p95': round(float(np.percentile(latencies, 95)), 1),
+            'p99': round(float(np.percentile(latencies, 99)), 1),
+            'max': round(float(latencies.max()), 1),
+        },
+        'error_rate': round(sum(1 for s in statuses if s is None or (s >= 400 and s not in (413, 429))) / total, 4),
+        'rate_413': round(statuses.count(413) / total, 4),
+        'rate_429': round(statuses.count(429) / total, 4),
+        'upload_mb': round(sum(record['bytes'] for record in records) / 1e6, 2),
+    }
+
+
+def build_report(records, elapsed, rss_samples, args):
+    by_endpoint = collections.defaultdict(list)
+    for record in records:
+        by_endpoint[record['endpoint']].append(record)
+    report = {
+        'config': {
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'duration_s': args.duration,
+            'endpoints': args.endpoint,
+            'stub_latency_ms': args.stub_server,
+        },
+        'elapsed_s': round(elapsed, 2),
+        'overall': summarize(records, elapsed),
+        'endpoints': {name: summarize(items, elapsed) for name, items in sorted(by_endpoint.items())},
+    }
+    if rss_samples:
+        rss = np.array([value for _, value in rss_samples], dtype=np.float64) / 2 ** 20
+        report['server_rss_mb'] = {
+            'start': round(float(rss[0]), 1),
+            'peak': round(float(rss.max()), 1),
+            'end': round(float(rss[-1]), 1),
+            'samples': [(offset, round(value / 2 ** 20, 1)) for offset, value in rss_samples],
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<22}{'reqs':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>8}{'413':>8}{'429':>8}")
+    rows = list(report['endpoints'].items()) + [('overall', report['overall'])]
+    for name, stats in rows:
+        if not stats['requests']:
+            continue
+        latency = stats['latency_ms']
+        print(f"{name:<22}{stats['requests']:>7}{stats['throughput_rps']:>9.2f}{latency['p50']:>9.0f}"
+              f"{latency['p95']:>9.0f}{latency['p99']:>9.0f}{stats['error_rate']:>8.1%}"
+              f"{stats['rate_413']:>8.1%}{stats['rate_429']:>8.1%}")
+    if 'server_rss_mb' in report:
+        rss = report['server_rss_mb']
+        print(f"\nServer RSS: {rss['start']} MB at start, {rss['peak']} MB peak, {rss['end']} MB at end")
+
+
+def wait_for_server(url, timeout=120):
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return True
+        except requests.RequestException:
+            time.sleep(0.5)
+    return False
+
+
+def run(args):
+    media = load_media(args.media)
+    endpoints = args.endpoint or DEFAULT_ENDPOINTS
+    args.endpoint = endpoints
+    for name in endpoints:
+        if not media[ENDPOINTS[name][2]]:
+            print(f"No {ENDPOINTS[name][2]} files found for {name} in {', '.join(args.media)}")
+            return 1
+    print(f"Loaded {len(media['video'])} videos and {len(media['image'])} images")
+
+    server = None
+    pid = args.server_pid
+    if args.stub_server is not None:
+        port = args.url.rstrip('/').rsplit(':', 1)[-1]
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve',
+                                   '--port', port, '--stub-latency-ms', str(args.stub_server)])
+        pid = server.pid
+        if not wait_for_server(args.url):
+            server.terminate()
+            print("Stub server did not come up")
+            return 1
+
+    sampler = None
+    if pid is not None:
+        sampler = RssSampler(pid, args.rss_interval)
+        sampler.start()
+    try:
+        load = LoadRun(args.url, endpoints, media, timeout=args.timeout)
+        mode = f"open loop at {args.rate} req/s" if args.rate > 0 else "closed loop"
+        print(f"Running {mode} with {args.concurrency} concurrent clients for {args.duration}s against {args.url}")
+        if args.rate > 0:
+            elapsed = load.run_open(args.concurrency, args.duration, args.rate)
+        else:
+            elapsed = load.run_closed(args.concurrency, args.duration)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = build_report(load.records, elapsed, sampler.samples if sampler else [], args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the deepfake analysis endpoints")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Replay sample media against a running server")
+    run_parser.add_argument('--url', default='http://127.0.0.1:5000')
+    run_parser.add_argument('--endpoint', action='append', choices=sorted(ENDPOINTS),
+                            help=f"Endpoint to hit (repeatable; default {', '.join(DEFAULT_ENDPOINTS)})")
+    run_parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients (open loop: max in flight)")
+    run_parser.add_argument('--rate', type=float, default=0, help="Poisson arrivals per second (0 = closed loop)")
+    run_parser.add_argument('--duration', type=float, default=60, help="Seconds to generate load for")
+    run_parser.add_argument('--timeout', type=float, default=300, help="Per-request timeout in seconds")
+    run_parser.add_argument('--media', action='append', help="Directory of sample media (repeatable)")
+    run_parser.add_argument('--server-pid', type=int, help="PID of the server, to sample its RSS")
+    run_parser.add_argument('--rss-interval', type=float, default=1.0, help="Seconds between RSS samples")
+    run_parser.add_argument('--stub-server', type=float, metavar='LATENCY_MS',
+                            help="Start a stub-model server on --url's port with this fixed latency per model call")
+    run_parser.add_argument('--output', help="Write the full JSON report here")
+
+    serve_parser = commands.add_parser('serve', help="Run the app with fixed-latency stub models")
+    serve_parser.add_argument('--port', type=int, default=5001)
+    serve_parser.add_argument('--stub-latency-ms', type=float, default=5, help="Sleep per model call")
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.port, args.stub_latency_ms)
+        return 0
+    args.media = args.media or DEFAULT_MEDIA
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Per-request memory budgets and peak-RSS tracking.
+
+Each analysis gets a MemoryBudget: an allowance for how far the resident
+memory of the process running its analyzers may grow while the request
+runs. One background thread samples RSS for every request in flight. As a
+request nears its allowance the analyzers back off
+instead of running the worker out of memory: past DEGRADE_AT of the budget
+they sample every second frame they would have sampled and detect faces at
+the next smaller working size, past CRITICAL_AT every fourth frame at the
+smallest size.
+
+Spawned model workers (the audio stage's subprocess, the parallel segment
+pool) are left out of the budget. Each one loads its own models - around a
+gigabyte for Wav2Vec2 - whatever the request samples, so counting them
+would degrade every request that starts one. Their RSS is reported next to
+the budget instead.
+
+Concurrent requests share one process, so each one's growth includes the
+others'. That only makes them degrade earlier. The peak RSS seen during the
+request goes into its response and, with the recent peaks, into /metrics.
+"""
+import collections
+import os
+import threading
+import time
+
+import psutil
+
+from scheduler import DETECTION_SIZES
+
+REQUEST_MEMORY_BUDGET_MB = float(os.environ.get('REQUEST_MEMORY_BUDGET_MB', 1536))
+DEGRADE_AT = 0.75
+CRITICAL_AT = 0.9
+# Share of the budget the frame ring may take
+RING_SHARE = 0.1
+RSS_SAMPLE_INTERVAL = 0.05
+# Finished requests kept for /metrics
+RECENT_REQUESTS = 200
+
+MB = 2 ** 20
+
+
+def process_rss():
+    """Resident bytes of this process"""
+    return psutil.Process().memory_info().rss
+
+
+def workers_rss():
+    """Resident bytes of this process's children (the spawned model workers)"""
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+class MemoryBudget:
+    def __init__(self, limit_mb=REQUEST_MEMORY_BUDGET_MB, monitor=None):
+        self.limit = limit_mb * MB
+        self.baseline = process_rss()
+        self.current = self.baseline
+        self.peak = self.baseline
+        self.workers_peak = 0
+        self.degraded = set()
+        self.monitor = monitor or MONITOR
+        self.monitor.track(self)
+
+    def observe(self, rss, workers=0):
+        self.current = rss
+        self.peak = max(self.peak, rss)
+        self.workers_peak = max(self.workers_peak, workers)
+
+    def pressure(self):
+        """Growth since the request started, as a share of the budget"""
+        return max(0, self.current - self.baseline) / self.limit
+
+    def level(self):
+        pressure = self.pressure()
+        return 2 if pressure >= CRITICAL_AT else 1 if pressure >= DEGRADE_AT else 0
+
+    def stride(self, skip_frames, stage):
+        """skip_frames thinned out under memory pressure"""
+        level = self.level()
+        if level:
+            self.degraded.add(stage)
+        return skip_frames * (1, 2, 4)[level]
+
+    def detection_size(self, size, stage):
+        """Face detection working size, smaller under memory pressure"""
+        level = self.level()
+        if level == 0:
+            return size
+        self.degraded.add(stage)
+        smaller = [s for s in DETECTION_SIZES if s < size]
+        if not smaller:
+            return size
+        return smaller[-1] if level == 2 else smaller[0]
+
+    def mark_degraded(self, stage):
+        """Record a stage thinned out elsewhere (e.g. by a worker process's own budget)"""
+        self.degraded.add(stage)
+
+    def is_degraded(self, stage):
+        return stage in self.degraded
+
+    def ring_capacity(self, frame_bytes, wanted):
+        """Frames a ring may hold within its share of the budget (at least 2)"""
+        fits = int(self.limit * RING_SHARE // max(frame_bytes, 1))
+        return max(2, min(wanted, fits))
+
+    def report(self):
+        return {
+            'budget_mb': round(self.limit / MB, 1),
+            'peak_rss_mb': round(self.peak / MB, 1),
+            'peak_growth_mb': round(max(0, self.peak - self.baseline) / MB, 1),
+            'peak_workers_rss_mb': round(self.workers_peak / MB, 1),
+            'degraded_stages': sorted(self.degraded),
+        }
+
+    def close(self):
+        """Stop tracking and return the report for the response"""
+        self.observe(process_rss(), workers_rss())
+        report = self.report()
+        self.monitor.untrack(self, report)
+        return report
+
+
+class RssMonitor:
+    """Samples RSS for every tracked budget while at least one request is running"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.active = set()
+        self.recent = collections.deque(maxlen=RECENT_REQUESTS)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def track(self, budget):
+        with self.lock:
+            self.active.add(budget)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='rss-monitor', daemon=True)
+                self.thread.start()
+
+    def untrack(self, budget, report):
+        with self.lock:
+            self.active.discard(budget)
+            self.recent.append(report)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                budgets = list(self.active)
+            try:
+                rss, workers = process_rss(), workers_rss()
+            except psutil.Error as e:
+                print(f"Error sampling RSS: {str(e)}")
+                rss = None
+            if rss is not None:
+                for budget in budgets:
+                    budget.observe(rss, workers)
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self.lock:
+            recent = list(self.recent)
+            in_flight = len(self.active)
+        growth = sorted(report['peak_growth_mb'] for report in recent)
+        return {
+            'rss_mb': round(process_rss() / MB, 1),
+            'workers_rss_mb': round(workers_rss() / MB, 1),
+            'requests_in_flight': in_flight,
+            'recent_requests': len(recent),
+            'peak_rss_mb': max((report['peak_rss_mb'] for report in recent), default=0.0),
+            'p50_peak_growth_mb': growth[len(growth) // 2] if growth else 0.0,
+            'max_peak_growth_mb': growth[-1] if growth else 0.0,
+            'degraded_requests': sum(1 for report in recent if report['degraded_stages']),
+            'budget_mb': REQUEST_MEMORY_BUDGET_MB,
+        }
+
+
+MONITOR = RssMonitor()
@@ -0,0 +1,329 @@
+"""
+Local, version-pinned model artifact store.
+
+`python model_store.py fetch` (run once, with network access) downloads every
+model the server uses, pins it (torchvision weight enum / Hugging Face
+commit, plus a sha256 per file in manifest.json) and re-saves the weights
+as plain state dicts. At runtime the loaders below build each model from
+the store only, so the server starts with no network access, and the
+weights are loaded with torch.load(mmap=True) + load_state_dict(assign=True):
+parameters stay backed by the read-only file mapping, so every worker
+process shares the same physical pages instead of holding a private copy.
+
+    python model_store.py fetch     # populate MODEL_STORE_DIR
+    python model_store.py verify    # re-hash every pinned file
+    python model_store.py memory    # per-model resident memory in this process
+
+With MODEL_STUB_MS set (load_test.py serve) the loaders return the
+fixed-latency stand-ins from model_stubs.py instead of the real models.
+"""
+import hashlib
+import json
+import os
+import sys
+
+import torch
+
+MODEL_STORE_DIR = os.environ.get('MODEL_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_store'))
+MANIFEST_FILENAME = 'manifest.json'
+WEIGHTS_FILENAME = 'weights.pt'
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_STUB_MS = os.environ.get('MODEL_STUB_MS')
+
+# Everything the server loads, with the version each one is pinned to
+MODELS = {
+    'mobilenet_v2': {'source': 'torchvision', 'weights': 'IMAGENET1K_V1'},
+    # face.py's Real/Fake head on top of MobileNetV2; pinned so every worker uses the same one
+    'mobilenet_v2_face_head': {'source': 'generated', 'seed': 0},
+    'wav2vec2-base-960h': {'source': 'huggingface', 'repo_id': 'facebook/wav2vec2-base-960h', 'revision': 'main'},
+    'deepfake-vit': {'source': 'huggingface', 'repo_id': 'prithivMLmods/Deep-Fake-Detector-Model', 'revision': 'main'},
+    'meso4': {'source': 'repository', 'path': os.path.join('Deepfake-detection', 'models', 'Meso4_DF_model.h5')},
+    # DeepFace's emotion model (senti.py and the multiplexed sentiment analyzer), laid out
+    # the way DeepFace expects it under DEEPFACE_HOME
+    'deepface-emotion': {'source': 'url',
+                         'url': 'https://github.com/serengil/deepface_models/releases/download/v1.0/'
+                                'facial_expression_model_weights.h5',
+                         'path': os.path.join('.deepface', 'weights', 'facial_expression_model_weights.h5')},
+}
+
+# Paths of weight files loaded in this process (name -> path), for the memory report
+_loaded = {}
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_manifest(store_dir=MODEL_STORE_DIR):
+    path = os.path.join(store_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def artifact_dir(name, store_dir=MODEL_STORE_DIR):
+    """Directory of a pinned artifact, or None if it hasn't been fetched"""
+    if name not in load_manifest(store_dir):
+        return None
+    return os.path.join(store_dir, name)
+
+
+def load_weights(name, store_dir=MODEL_STORE_DIR):
+    """Memory-mapped state dict of a pinned artifact"""
+    path = os.path.join(store_dir, name, WEIGHTS_FILENAME)
+    _loaded[name] = path
+    return torch.load(path, mmap=True, weights_only=True, map_location='cpu')
+
+
+# ----------- LOADERS -------------
+
+def stub_model(name):
+    """model_stubs' stand-in for a model (loaders return it when MODEL_STUB_MS is set)"""
+    import model_stubs
+    return model_stubs.STUBS[name]()
+
+
+def load_mobilenet_v2(store_dir=MODEL_STORE_DIR):
+    """ImageNet MobileNetV2 from the store (None if it hasn't been fetched)"""
+    if MODEL_STUB_MS:
+        return stub_model('mobilenet_v2')
+    import torchvision.models as models
+    if artifact_dir('mobilenet_v2', store_dir) is None:
+        return None
+    model = models.mobilenet_v2(weights=None)
+    model.load_state_dict(load_weights('mobilenet_v2', store_dir), assign=True)
+    return model.eval()
+
+
+def load_face_head(store_dir=MODEL_STORE_DIR):
+    """Pinned state dict for face.py's 2-class head (None if it hasn't been fetched)"""
+    if MODEL_STUB_MS:
+        return None
+    if artifact_dir('mobilenet_v2_face_head', store_dir) is None:
+        return None
+    return load_weights('mobilenet_v2_face_head', store_dir)
+
+
+def load_hf_model(name, model_cls, store_dir=MODEL_STORE_DIR):
+    """Hugging Face model built from its stored config with mmap-backed weights"""
+    from transformers import AutoConfig
+    directory = artifact_dir(name, store_dir)
+    if directory is None:
+        return None
+    model = model_cls(AutoConfig.from_pretrained(directory))
+    model.load_state_dict(load_weights(name, store_dir), assign=True)
+    return model.eval()
+
+
+def load_wav2vec2(store_dir=MODEL_STORE_DIR):
+    """(processor, model) for facebook/wav2vec2-base-960h, or None if not fetched"""
+    if MODEL_STUB_MS:
+        return stub_model('wav2vec2-base-960h')
+    from transformers import Wav2Vec2Model, Wav2Vec2Processor
+    model = load_hf_model('wav2vec2-base-960h', Wav2Vec2Model, store_dir)
+    if model is None:
+        return None
+    return Wav2Vec2Processor.from_pretrained(artifact_dir('wav2vec2-base-960h', store_dir)), model
+
+
+def load_deepfake_pipeline(store_dir=MODEL_STORE_DIR):
+    """The /predict image-classification pipeline, or None if not fetched"""
+    if MODEL_STUB_MS:
+        return stub_model('deepfake-vit')
+    from transformers import AutoImageProcessor, AutoModelForImageClassification, pipeline
+    model = load_hf_model('deepfake-vit', AutoModelForImageClassification.from_config, store_dir)
+    if model is None:
+        return None
+    image_processor = AutoImageProcessor.from_pretrained(artifact_dir('deepfake-vit', store_dir))
+    return pipeline("image-classification", model=model, image_processor=image_processor)
+
+
+def load_mtcnn(device):
+    """facenet_pytorch's MTCNN face detector (its weights ship with the pinned package)"""
+    if MODEL_STUB_MS:
+        return stub_model('mtcnn')
+    from facenet_pytorch import MTCNN
+    return MTCNN(keep_all=True, device=device)
+
+
+def load_face_mesh(**options):
+    """A new MediaPipe FaceMesh (its model ships with the pinned package)"""
+    if MODEL_STUB_MS:
+        return stub_model('face_mesh')
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(**options)
+
+
+def load_emotion_analyzer(store_dir=MODEL_STORE_DIR):
+    """DeepFace.analyze, reading the emotion weights from the store when they have been fetched"""
+    if MODEL_STUB_MS:
+        return stub_model('deepface-emotion')
+    # DeepFace reads its weights from $DEEPFACE_HOME/.deepface/weights
+    # (downloading them on first use); point it at the pinned copy
+    home = deepface_home(store_dir)
+    if home is not None:
+        os.environ['DEEPFACE_HOME'] = home
+    from deepface import DeepFace
+    return DeepFace.analyze
+
+
+def meso4_path(store_dir=MODEL_STORE_DIR):
+    entry = load_manifest(store_dir).get('meso4')
+    return os.path.join(REPO_ROOT, entry['path']) if entry else None
+
+
+def deepface_home(store_dir=MODEL_STORE_DIR):
+    """DEEPFACE_HOME holding the pinned emotion weights (None if they haven't been fetched)"""
+    return artifact_dir('deepface-emotion', store_dir)
+
+
+# ----------- FETCH / VERIFY -------------
+
+def fetch_torchvision(name, spec, target):
+    import torchvision.models as models
+    weights = getattr(models.MobileNet_V2_Weights, spec['weights'])
+    model = models.mobilenet_v2(weights=weights)
+    torch.save(model.state_dict(), os.path.join(target, WEIGHTS_FILENAME))
+    return {'version': f"torchvision-{spec['weights']}"}
+
+
+def fetch_generated(name, spec, target):
+    torch.manual_seed(spec['seed'])
+    head = torch.nn.Linear(1280, 2)
+    torch.save(head.state_dict(), os.path.join(target, WEIGHTS_FILENAME))
+    return {'version': f"seed-{spec['seed']}"}
+
+
+def fetch_huggingface(name, spec, target):
+    from huggingface_hub import HfApi, snapshot_download
+    from transformers import AutoConfig, AutoModel, AutoModelForImageClassification
+    # Resolve the branch to a commit so the pin survives upstream pushes
+    revision = HfApi().model_info(spec['repo_id'], revision=spec['revision']).sha
+    snapshot_download(spec['repo_id'], revision=revision, local_dir=target,
+                      ignore_patterns=['*.bin', '*.safetensors', '*.h5', '*.msgpack', '*.onnx', '*.ot'])
+    config = AutoConfig.from_pretrained(spec['repo_id'], revision=revision)
+    model_cls = AutoModelForImageClassification if config.architectures and 'ForImageClassification' in config.architectures[0] else AutoModel
+    model = model_cls.from_pretrained(spec['repo_id'], revision=revision)
+    torch.save(model.state_dict(), os.path.join(target, WEIGHTS_FILENAME))
+    return {'version': revision}
+
+
+def fetch_url(name, spec, target):
+    import urllib.request
+    path = os.path.join(target, spec['path'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    urllib.request.urlretrieve(spec['url'], path)
+    return {'version': sha256_file(path)[:12]}
+
+
+def fetch_repository(name, spec, target):
+    return {'version': sha256_file(os.path.join(REPO_ROOT, spec['path']))[:12], 'path': spec['path']}
+
+
+FETCHERS = {
+    'torchvision': fetch_torchvision,
+    'generated': fetch_generated,
+    'huggingface': fetch_huggingface,
+    'url': fetch_url,
+    'repository': fetch_repository,
+}
+
+
+def file_hashes(directory):
+    hashes = {}
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            hashes[os.path.relpath(path, directory)] = sha256_file(path)
+    return hashes
+
+
+def fetch(store_dir=MODEL_STORE_DIR):
+    manifest = load_manifest(store_dir)
+    for name, spec in MODELS.items():
+        target = os.path.join(store_dir, name)
+        os.makedirs(target, exist_ok=True)
+        print(f"Fetching {name} ...")
+        entry = FETCHERS[spec['source']](name, spec, target)
+        entry['source'] = spec['source']
+        if spec['source'] != 'repository':
+            entry['files'] = file_hashes(target)
+        manifest[name] = entry
+        # Save after each model so an interrupted fetch keeps what it got
+        with open(os.path.join(store_dir, MANIFEST_FILENAME), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        print(f"  pinned {name} @ {entry['version']}")
+
+
+def verify(store_dir=MODEL_STORE_DIR):
+    ok = True
+    for name, entry in load_manifest(store_dir).items():
+        expected = entry.get('files', {})
+        actual = file_hashes(os.path.join(store_dir, name)) if expected else {}
+        mismatched = [path for path, digest in expected.items() if actual.get(path) != digest]
+        if mismatched:
+            ok = False
+            print(f"{name}: MISMATCH in {', '.join(mismatched)}")
+        else:
+            print(f"{name}: ok ({entry['version']})")
+    return ok
+
+
+# ----------- MEMORY REPORT -------------
+
+def mapping_memory(path):
+    """Rss / Pss / shared bytes of a file's mappings in this process (from /proc/self/smaps)"""
+    totals = {'rss_bytes': 0, 'pss_bytes': 0, 'shared_bytes': 0}
+    fields = {'Rss:': 'rss_bytes', 'Pss:': 'pss_bytes', 'Shared_Clean:': 'shared_bytes', 'Shared_Dirty:': 'shared_bytes'}
+    real_path = os.path.realpath(path)
+    try:
+        with open('/proc/self/smaps', 'r') as smaps:
+            in_mapping = False
+            for line in smaps:
+                parts = line.split()
+                if '-' in parts[0] and len(parts) >= 5 and not parts[0].endswith(':'):
+                    in_mapping = len(parts) >= 6 and parts[5] == real_path
+                elif in_mapping and parts[0] in fields:
+                    totals[fields[parts[0]]] += int(parts[1]) * 1024
+    except OSError:
+        return None
+    return totals
+
+
+def memory_report():
+    """Per-model weight file size and resident/shared memory of its mapping"""
+    report = []
+    for name, path in sorted(_loaded.items()):
+        entry = {'model': name, 'file_bytes': os.path.getsize(path)}
+        memory = mapping_memory(path)
+        if memory is not None:
+            entry.update(memory)
+        report.append(entry)
+    return report
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else 'verify'
+    if command == 'fetch':
+        fetch()
+    elif command == 'verify':
+        return 0 if verify() else 1
+    elif command == 'memory':
+        load_mobilenet_v2()
+        load_wav2vec2()
+        load_deepfake_pipeline()
+        print(json.dumps(memory_report(), indent=2))
+    else:
+        print(f"Unknown command {command!r}; use fetch, verify or memory")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Fixed-latency stand-ins for every model the server loads.
+
+When MODEL_STUB_MS is set, model_store's loaders return these instead of
+the real models (load_test.py serve sets it). Every call sleeps for
+MODEL_STUB_MS and returns output shaped like the real model's, so the code
+around the models - upload handling, decoding, frame preparation,
+orchestration, scoring - runs unchanged and a load test measures the
+server's own overhead. Outputs are cheap functions of the input (a fixed
+random projection of the pooled frame, a fixed face box, fixed landmarks),
+not predictions.
+"""
+import os
+import time
+import types
+
+import numpy as np
+import torch
+
+MODEL_STUB_MS = float(os.environ.get('MODEL_STUB_MS') or 0)
+# Feature/hidden sizes of the real MobileNetV2 and Wav2Vec2
+MOBILENET_FEATURES = 1280
+WAV2VEC2_HIDDEN = 768
+# Wav2Vec2's conv feature encoder, (kernel, stride) per layer
+WAV2VEC2_CONV = [(10, 5)] + [(3, 2)] * 4 + [(2, 2)] * 2
+
+
+def stub_sleep():
+    time.sleep(MODEL_STUB_MS / 1000)
+
+
+class StubFeatures(torch.nn.Module):
+    """MobileNetV2.features stand-in: a fixed projection of the 8x8-pooled image to 1280 channels.
+    Similar frames get similar features, so frame anomalies and the near-duplicate index still behave."""
+
+    def __init__(self):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.register_buffer('projection', torch.randn(3 * 8 * 8, MOBILENET_FEATURES, generator=generator))
+
+    def forward(self, x):
+        stub_sleep()
+        pooled = torch.nn.functional.adaptive_avg_pool2d(x, 8).flatten(1)
+        return (pooled @ self.projection)[:, :, None, None]
+
+
+class StubMobileNetV2(torch.nn.Module):
+    """Laid out like torchvision's MobileNetV2 (features + [Dropout, Linear] classifier), so face.py
+    can swap in its 2-class head and frame.py can drop the classifier"""
+
+    def __init__(self):
+        super().__init__()
+        self.features = StubFeatures()
+        self.classifier = torch.nn.Sequential(torch.nn.Dropout(0.2), torch.nn.Linear(MOBILENET_FEATURES, 1000))
+
+    def forward(self, x):
+        return self.classifier(self.features(x).flatten(1))
+
+
+class StubMTCNN:
+    """One face box over the middle of every image"""
+
+    def detect(self, image):
+        stub_sleep()
+        height, width = np.asarray(image).shape[:2]
+        boxes = np.array([[width * 0.25, height * 0.2, width * 0.75, height * 0.8]], dtype=np.float32)
+        return boxes, np.array([0.99], dtype=np.float32)
+
+
+# 468 FaceMesh landmarks on a fixed grid
+STUB_LANDMARKS = [types.SimpleNamespace(x=(i // 23) / 23, y=(i % 23) / 23, z=0.0) for i in range(468)]
+LOWER_LIP = 14
+
+
+class StubFaceMesh:
+    """Fixed face landmarks, with the lower lip moving with the image's brightness"""
+
+    def process(self, image):
+        stub_sleep()
+        landmarks = list(STUB_LANDMARKS)
+        lip = landmarks[LOWER_LIP]
+        landmarks[LOWER_LIP] = types.SimpleNamespace(x=lip.x, y=lip.y + float(np.mean(image)) / 255 * 0.05, z=lip.z)
+        return types.SimpleNamespace(multi_face_landmarks=[types.SimpleNamespace(landmark=landmarks)])
+
+    def close(self):
+        pass
+
+
+class StubWav2Vec2Processor:
+    def __call__(self, waveform, sampling_rate=None, return_tensors=None):
+        return types.SimpleNamespace(input_values=torch.as_tensor(np.asarray(waveform), dtype=torch.float32)[None])
+
+
+class StubWav2Vec2:
+    """Hidden states with Wav2Vec2's frame count: a fixed vector scaled by each frame's loudness"""
+
+    def __init__(self):
+        generator = torch.Generator().manual_seed(0)
+        self.direction = torch.randn(WAV2VEC2_HIDDEN, generator=generator)
+
+    def __call__(self, values):
+        stub_sleep()
+        frames = values.shape[1]
+        for kernel, stride in WAV2VEC2_CONV:
+            frames = (frames - kernel) // stride + 1
+        frames = max(frames, 1)
+        chunks = values[:, :frames * 320].reshape(values.shape[0], frames, -1) if values.shape[1] >= frames * 320 \
+            else values[:, None, :].expand(-1, frames, -1)
+        loudness = chunks.pow(2).mean(dim=2, keepdim=True).sqrt() + 1e-3
+        return types.SimpleNamespace(last_hidden_state=loudness * self.direction)
+
+
+class StubPipeline:
+    """Image-classification pipeline stand-in: one sleep per batch"""
+
+    def __call__(self, images, batch_size=None):
+        stub_sleep()
+        prediction = [{'label': 'Realism', 'score': 0.9}, {'label': 'Deepfake', 'score': 0.1}]
+        return [list(prediction) for _ in images] if isinstance(images, list) else prediction
+
+
+def stub_emotion_analyzer(frame, actions=None, enforce_detection=True):
+    """DeepFace.analyze stand-in"""
+    stub_sleep()
+    return [{'dominant_emotion': 'neutral'}]
+
+
+STUBS = {
+    'mobilenet_v2': StubMobileNetV2,
+    'mtcnn': StubMTCNN,
+    'face_mesh': StubFaceMesh,
+    'wav2vec2-base-960h': lambda: (StubWav2Vec2Processor(), StubWav2Vec2()),
+    'deepfake-vit': StubPipeline,
+    'deepface-emotion': lambda: stub_emotion_analyzer,
+}
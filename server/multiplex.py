@@ -0,0 +1,435 @@
+"""
+Several analyzers over one upload and one decode.
+
+The dashboard used to call /process_video, /analyze_sentiment,
+/analyze_audio, /analyze_frame and /analyze_distortions for the same video,
+each uploading it again and decoding it from scratch. /analyze takes the
+upload once with the list of analyzers wanted and returns a section per
+analyzer. The video is read by a single decoder into a frame ring
+(frame_pool.FrameRing) that every analyzer reads on its own thread, and
+what they have in common is computed once:
+
+- the downscaled RGB working frame, used by MTCNN and by FaceMesh,
+- one FaceMesh pass per frame, which gives both the sync mouth-opening
+  series and the audio stage's lip vectors,
+- face classifications and frame features on frames that several
+  analyzers sample at different strides (the verdict at the strides the
+  scheduler plans for /process_video, the distortions and frame sections
+  every 5th frame),
+- one audio extraction, embedded by Wav2Vec2 in the background while the
+  frames decode and reused for the sync energy series.
+
+The verdict goes through the same near-duplicate lookup, scheduler plan
+and scoring as /process_video and is added to the near-duplicate index
+the same way. It does not use the segment cache, which needs a decode of
+its own per segment, nor the plan's smaller face detection sizes: the
+working frame is shared with FaceMesh, so detection always runs at the
+default size.
+
+Sections hold the same values as the standalone endpoints (as named
+fields instead of bare tuples), with two differences. The audio section's
+lip vectors come from FaceMesh on the working frame the sync analyzer
+uses rather than from a separate full-resolution pass. The sentiment
+section counts emotions on the frames the verdict samples, not on every
+frame: DeepFace is the slowest reader and every other analyzer waits for
+the slowest one.
+"""
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from analysis import (SKIP_FRAMES, TimeoutException, compute_scores, face_recheck_token, index_result, run_shortcuts,
+                      run_with_timeout, schedule, set_audio_defaults, skip_audio, stage_plan, stage_status, to_json_value,
+                      validate_video)
+from audio import compute_mismatch_metrics, extract_audio, lip_vector, process_audio
+from av_sync import audio_energy_series, compute_sync_timeline, mouth_opening
+from cancellation import CancellationToken, run_in_subprocess
+from face import classify_faces
+from frame import ANOMALY_THRESHOLD, cosine_similarity, extract_features, load_model
+from frame_pool import RING_CAPACITY, FrameRing
+from frame_prep import TensorBuffer
+from memory_budget import MemoryBudget
+import model_store
+from senti import count_emotions, frame_emotion
+from signal_store import content_hash
+
+ANALYZERS = ('verdict', 'distortions', 'frame', 'audio', 'sync', 'sentiment')
+# The five the dashboard used to request one endpoint at a time
+DEFAULT_ANALYZERS = ('verdict', 'distortions', 'frame', 'audio', 'sentiment')
+# Default sampling of /analyze_distortions and /analyze_frame
+DISTORTION_SKIP_FRAMES = 5
+FRAME_SKIP_FRAMES = 5
+
+
+def thinned(memory_budget, stride, stage):
+    return stride if memory_budget is None else memory_budget.stride(stride, stage)
+
+
+def parse_analyzers(values):
+    """Requested analyzers from form/query values (repeated or comma-separated), in ANALYZERS order"""
+    names = {name.strip() for value in values for name in value.split(',') if name.strip()}
+    if not names:
+        return list(DEFAULT_ANALYZERS)
+    unknown = names - set(ANALYZERS)
+    if unknown:
+        raise ValueError(f"Unknown analyzers: {', '.join(sorted(unknown))} (choose from {', '.join(ANALYZERS)})")
+    return [name for name in ANALYZERS if name in names]
+
+
+class FaceScanner:
+    """Face distortion counts at several strides from one detection + classification per frame"""
+
+    def __init__(self, strides, memory_budget=None):
+        self.strides = sorted(set(strides))
+        self.memory_budget = memory_budget
+        self.inputs = TensorBuffer(224)
+        self.counts = {stride: [0, 0, 0] for stride in self.strides}  # [sampled frames, distorted faces, with faces]
+
+    def sampled(self, frame_count, stride):
+        return frame_count % thinned(self.memory_budget, stride, 'face') == 0
+
+    def wants(self, frame_count):
+        return any(self.sampled(frame_count, stride) for stride in self.strides)
+
+    def feed(self, frame_count, slot):
+        _, predicted, _ = classify_faces(slot.frame, slot.preparer, self.inputs, working=slot.working())
+        distorted = sum(1 for label in predicted if label == 1)
+        for stride in self.strides:
+            if self.sampled(frame_count, stride):
+                self.counts[stride][0] += 1
+                self.counts[stride][1] += distorted
+                self.counts[stride][2] += 1 if predicted else 0
+
+    def result(self, stride):
+        total_frames, distorted_faces, with_faces = self.counts[stride]
+        return {'total_frames': total_frames, 'distorted_faces': distorted_faces, 'frames_with_faces': with_faces}
+
+
+class FrameScanner:
+    """Frame anomaly counts at several strides; each stride compares its own consecutive samples"""
+
+    def __init__(self, strides, memory_budget=None):
+        self.memory_budget = memory_budget
+        self.inputs = TensorBuffer(112, max_batch=1)
+        self.chains = {stride: {'previous': None, 'sampled': 0, 'abnormal': 0} for stride in sorted(set(strides))}
+
+    def sampled(self, frame_count, stride):
+        return frame_count % thinned(self.memory_budget, stride, 'frame') == 0
+
+    def wants(self, frame_count):
+        return any(self.sampled(frame_count, stride) for stride in self.chains)
+
+    def feed(self, frame_count, slot):
+        # Channels passed through as-is, like detect_frame_anomalies
+        self.inputs.fill(0, slot.frame)
+        features = extract_features(self.inputs.tensor(1), load_model())
+        for stride, chain in self.chains.items():
+            if not self.sampled(frame_count, stride):
+                continue
+            chain['sampled'] += 1
+            if chain['previous'] is not None and cosine_similarity(chain['previous'], features) < ANOMALY_THRESHOLD:
+                chain['abnormal'] += 1
+            chain['previous'] = features
+
+    def result(self, stride):
+        chain = self.chains[stride]
+        return {'total_frames_processed': chain['sampled'], 'abnormal_frames_detected': chain['abnormal']}
+
+
+class FaceMeshTracker:
+    """Mouth opening per frame (sync) and lip vector sums (audio) from one FaceMesh pass.
+
+    The sync series needs every frame, so this one never thins out.
+    """
+
+    def __init__(self):
+        self.face_mesh = model_store.load_face_mesh(static_image_mode=False, max_num_faces=1)
+        self.openings = []
+        self.lip_sum = np.zeros(60)
+        self.faces = 0
+
+    def wants(self, frame_count):
+        return True
+
+    def feed(self, frame_count, slot):
+        results = self.face_mesh.process(slot.working()[0])
+        if not results.multi_face_landmarks:
+            self.openings.append(np.nan)
+            return
+        landmarks = results.multi_face_landmarks[0].landmark
+        self.faces += 1
+        self.openings.append(mouth_opening(landmarks))
+        self.lip_sum += lip_vector(landmarks)
+
+    def close(self):
+        self.face_mesh.close()
+
+
+class SentimentScanner:
+    """Dominant emotion of every stride-th frame, as analyze_video_sentiment does for every frame"""
+
+    def __init__(self, stride, memory_budget=None):
+        self.stride = stride
+        self.memory_budget = memory_budget
+        self.emotions = []
+
+    def wants(self, frame_count):
+        return frame_count % thinned(self.memory_budget, self.stride, 'sentiment') == 0
+
+    def feed(self, frame_count, slot):
+        # analyze_video_sentiment swaps moviepy's RGB frames to BGR, i.e. DeepFace sees the decoded frame as-is
+        try:
+            self.emotions.append(frame_emotion(slot.frame))
+        except Exception as e:
+            print(f"Frame {frame_count}: No face detected or error - {e}")
+
+    def result(self):
+        return count_emotions(self.emotions)
+
+
+class AudioTrack:
+    """The video's audio, extracted once to a temp WAV and (optionally) embedded
+    with Wav2Vec2 on a background thread while the frames decode."""
+
+    def __init__(self, video_path, embed, cancel_token=None):
+        fd, self.path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        self.extract_error = None
+        self.embed_error = None
+        self.embeddings = None
+        # Trips with the request's token, or on close() so an abandoned embedding stops
+        self.cancel_token = CancellationToken(parent=cancel_token)
+        self.thread = threading.Thread(target=self.run, args=(video_path, embed, self.cancel_token),
+                                       name='multiplex-audio', daemon=True)
+        self.thread.start()
+
+    def run(self, video_path, embed, cancel_token):
+        try:
+            extract_audio(video_path, self.path)
+        except Exception as e:
+            self.extract_error = e
+            return
+        if not embed:
+            return
+        try:
+            # The forward pass can't poll the token, so it runs in a process that can be killed
+            self.embeddings = run_in_subprocess(process_audio, (self.path,), cancel_token)
+        except Exception as e:
+            self.embed_error = e
+
+    def wait(self):
+        self.thread.join()
+
+    def audio_path(self):
+        if self.extract_error is not None:
+            raise self.extract_error
+        return self.path
+
+    def audio_embeddings(self):
+        self.audio_path()
+        if self.embed_error is not None:
+            raise self.embed_error
+        return self.embeddings
+
+    def close(self):
+        """Stop the embedding if it is still running and remove the WAV once nothing reads it"""
+        self.cancel_token.cancel()
+        self.thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def decode_pass(video_path, consumers, cancel_token=None, memory_budget=None):
+    """Decode the video once into a frame ring every consumer reads on its own thread: (fps, frames decoded)"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video at path {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frame_bytes = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) * int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) * 3
+    capacity = RING_CAPACITY if memory_budget is None else memory_budget.ring_capacity(frame_bytes, RING_CAPACITY)
+    ring = FrameRing(capacity, len(consumers))
+    errors = []
+
+    def consume(reader, consumer):
+        try:
+            for slot in ring.read(reader):
+                if cancel_token is not None and cancel_token.cancelled():
+                    break
+                if consumer.wants(slot.frame_count):
+                    consumer.feed(slot.frame_count, slot)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=consume, args=(reader, consumer), name=f"multiplex-{type(consumer).__name__}",
+                                daemon=True) for reader, consumer in enumerate(consumers)]
+    for thread in readers:
+        thread.start()
+    frame_count = 0
+    try:
+        while True:
+            if cancel_token is not None and cancel_token.cancelled():
+                break
+            # Frames no consumer samples are only grabbed (decoded, never converted to BGR)
+            if not cap.grab():
+                break
+            frame_count += 1
+            if not any(consumer.wants(frame_count) for consumer in consumers):
+                continue
+            if not ring.write(cap, frame_count):
+                break
+    finally:
+        ring.close()
+        for thread in readers:
+            thread.join()
+        cap.release()
+        ring.release()
+    if errors:
+        raise errors[0]
+    return fps, frame_count
+
+
+def audio_section(track, mesh):
+    """Same values as analyze_video: mismatch metrics plus the face detection rate"""
+    audio_embeddings = track.audio_embeddings()
+    if mesh.faces == 0:
+        raise ValueError("No face detected in the video.")
+    metrics = compute_mismatch_metrics(audio_embeddings, mesh.lip_sum / mesh.faces)
+    section = {key: to_json_value(value) for key, value in metrics.items()}
+    section['face_detection_rate'] = mesh.faces / len(mesh.openings)
+    return section
+
+
+def sync_section(track, mesh, fps):
+    mouth = np.array(mesh.openings, dtype=np.float32)
+    energy = audio_energy_series(track.audio_path(), fps, len(mouth))
+    return compute_sync_timeline(mouth, energy, fps)
+
+
+def section(build, *args):
+    """One analyzer's section; a failing analyzer reports its error without failing the others"""
+    try:
+        return build(*args)
+    except Exception as e:
+        print(f"Error in {build.__name__}: {str(e)}")
+        return {'error': str(e), 'status': 'failed'}
+
+
+def analyze_multiplexed_internal(video_path, analyzers, plan=None, known=None, cancel_token=None):
+    """known is the verdict already found by the near-duplicate lookup, if any; plan is
+    schedule()'s plan for the verdict"""
+    start_time = time.time()
+    wanted = set(analyzers)
+    # A known duplicate's verdict is reused; nothing has to be sampled for it
+    scored = 'verdict' in wanted and known is None
+    verdict_face = stage_plan(plan, 'face').get('skip_frames', SKIP_FRAMES)
+    verdict_frame = stage_plan(plan, 'frame').get('skip_frames', SKIP_FRAMES)
+    verdict_audio = stage_plan(plan, 'audio')
+    face_strides = [stride for used, stride in ((scored, verdict_face), ('distortions' in wanted, DISTORTION_SKIP_FRAMES))
+                    if used]
+    frame_strides = [stride for used, stride in ((scored, verdict_frame), ('frame' in wanted, FRAME_SKIP_FRAMES))
+                     if used]
+    memory_budget = MemoryBudget()
+    face = FaceScanner(face_strides, memory_budget) if face_strides else None
+    frame = FrameScanner(frame_strides, memory_budget) if frame_strides else None
+    mesh = FaceMeshTracker() if (scored and verdict_audio.get('enabled', True)) or wanted & {'audio', 'sync'} else None
+    sentiment = SentimentScanner(verdict_face, memory_budget) if 'sentiment' in wanted else None
+
+    results = {'content_hash': content_hash(video_path)}
+    track = None
+    embed = 'audio' in wanted or (scored and verdict_audio.get('enabled', True))
+    if embed or 'sync' in wanted:
+        track = AudioTrack(video_path, embed, cancel_token)
+    try:
+        consumers = [consumer for consumer in (face, frame, mesh, sentiment) if consumer is not None]
+        fps, frames_decoded = decode_pass(video_path, consumers, cancel_token, memory_budget)
+        if track is not None:
+            track.wait()
+
+        audio = section(audio_section, track, mesh) if embed else None
+        if known is not None:
+            results['verdict'] = known
+        elif scored:
+            verdict = {'content_hash': results['content_hash']}
+            verdict.update(face.result(verdict_face))
+            verdict.update(frame.result(verdict_frame))
+            if not verdict_audio.get('enabled', True):
+                skip_audio(verdict, verdict_audio['reason'])
+                audio_status = 'skipped'
+            elif 'error' in audio:
+                set_audio_defaults(verdict, audio['error'])
+                audio_status = 'failed'
+            else:
+                verdict.update(audio)
+                audio_status = 'completed'
+            compute_scores(verdict)
+            verdict['stage_status'] = {
+                'face': stage_status(cancel_token),
+                'frame': stage_status(cancel_token),
+                'audio': audio_status,
+            }
+            if plan is not None:
+                verdict['plan'] = plan
+            results['verdict'] = verdict
+        if 'distortions' in wanted:
+            results['distortions'] = face.result(DISTORTION_SKIP_FRAMES)
+        if 'frame' in wanted:
+            results['frame'] = frame.result(FRAME_SKIP_FRAMES)
+        if 'audio' in wanted:
+            results['audio'] = audio
+        if 'sync' in wanted:
+            results['sync'] = section(sync_section, track, mesh, fps)
+        if 'sentiment' in wanted:
+            results['sentiment'] = sentiment.result()
+    finally:
+        if track is not None:
+            track.close()
+        if mesh is not None:
+            mesh.close()
+        results['memory'] = memory_budget.close()
+
+    results['analyzers'] = list(analyzers)
+    results['frames_decoded'] = frames_decoded
+    if cancel_token is not None and cancel_token.cancelled():
+        results['status'] = 'partial'
+        results['warning'] = 'Deadline reached - results are based on the frames decoded before it'
+    results['processing_time'] = round(time.time() - start_time, 2)
+    return results
+
+
+def analyze_multiplexed(video_path, analyzers=DEFAULT_ANALYZERS):
+    """{analyzer: section} for every requested analyzer, from one decode of the video"""
+    timeout = None
+    started = time.time()
+    try:
+        error, timeout = validate_video(video_path)
+        if error is not None:
+            return error
+        known = signatures = plan = None
+        if 'verdict' in analyzers:
+            # Same shortcuts and plan as /process_video (no cascade: the other analyzers decode anyway)
+            known, signatures, _ = run_shortcuts(video_path, recheck_token=face_recheck_token(timeout))
+            if known is None:
+                plan, timeout = schedule(video_path, timeout, started=started)
+        results = run_with_timeout(analyze_multiplexed_internal, [video_path, list(analyzers), plan, known], timeout)
+        if known is None and 'verdict' in results and results.get('status') != 'partial':
+            index_result(signatures, results['verdict'])
+        return results
+    except TimeoutException:
+        return {
+            'error': f'Analysis timed out after {timeout} seconds',
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed due to timeout'
+        }
+    except Exception as e:
+        print(f"Error in analyze_multiplexed: {str(e)}")
+        return {
+            'error': str(e),
+            'status': 'failed',
+            'confidence_score': 0,
+            'analysis_result': 'Analysis failed due to technical error'
+        }
@@ -0,0 +1,282 @@
+"""
+Time-segment parallel analysis for long videos.
+
+A long upload is cut into as many time segments as there are workers, each
+starting on a keyframe so a worker's decoder seeks straight to it instead
+of decoding from the previous keyframe. The face and frame stages analyze
+every segment in a separate worker process with its own decoder (and its
+own copy of the models, loaded once per worker), and the per-segment parts
+are merged with the segment cache's merge_face/merge_frame into the usual
+totals and signals.
+
+Workers sample the same frames a single pass would (sample_offset is the
+segment start), and merge_frame compares the first sampled frame of each
+segment with the last one of the segment before it, so the frame stage's
+consecutive-frame comparison has no gap at the cuts.
+
+Workers stop at the request's deadline and when its token is cancelled
+(client disconnect, run_with_timeout giving up): the token is mirrored
+into a Manager Event the workers poll between frames, and workers still
+running a grace period later are terminated. Each segment runs under a
+MemoryBudget of its own in the worker.
+
+Every worker builds its own face classifier, so parallel mode needs the
+pinned face head from the model store: without it each worker would
+initialise a different random head and the segments' face verdicts would
+not agree.
+"""
+import multiprocessing
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import psutil
+
+import model_store
+from cancellation import AnalysisCancelled, CancellationToken
+from memory_budget import MemoryBudget
+from segments import face_part, frame_part
+
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', max(1, (os.cpu_count() or 1) - 1)))
+# Videos shorter than this run front to back in one process
+PARALLEL_MIN_SECONDS = float(os.environ.get('PARALLEL_MIN_SECONDS', 60))
+# Shortest segment worth a worker
+MIN_SEGMENT_SECONDS = 15
+KEYFRAME_PROBE_TIMEOUT = 30
+# How often the parent checks the request's token, and workers the cancel event
+CANCEL_POLL_INTERVAL = 0.1
+# Time cancelled workers get to return their partial parts before they are terminated
+CANCEL_GRACE_SECONDS = 5
+
+
+def keyframe_indexes(video_path, fps):
+    """Frame numbers of the video's keyframes. ffmpeg is told to skip every
+    non-key frame, so only the keyframes are decoded to list them."""
+    import imageio_ffmpeg
+
+    completed = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', video_path,
+         '-an', '-vf', 'showinfo', '-f', 'null', '-'],
+        capture_output=True, text=True, timeout=KEYFRAME_PROBE_TIMEOUT)
+    times = [float(t) for t in re.findall(r'pts_time:\s*(-?[0-9.]+)', completed.stderr)]
+    if not times:
+        return []
+    # Relative to the first frame, which is always a keyframe
+    first = min(times)
+    return sorted({int(round((t - first) * fps)) for t in times})
+
+
+def time_segments(video_path, workers=PARALLEL_WORKERS):
+    """[{'start', 'end'}] keyframe-aligned time segments, or None when the video is too
+    short (or there are too few workers) to be worth splitting"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+    if workers < 2 or fps <= 0 or frame_count / fps < PARALLEL_MIN_SECONDS:
+        return None
+    if model_store.artifact_dir('mobilenet_v2_face_head') is None:
+        print("Not splitting into time segments: the model store has no pinned face head")
+        return None
+    count = min(workers, int(frame_count / fps // MIN_SEGMENT_SECONDS))
+    if count < 2:
+        return None
+
+    try:
+        keyframes = keyframe_indexes(video_path, fps)
+    except Exception as e:
+        # Cut at the even split points; OpenCV then seeks from the keyframe before each
+        print(f"Error listing keyframes: {str(e)}")
+        keyframes = []
+
+    cuts = [0]
+    for i in range(1, count):
+        target = i * frame_count // count
+        cut = min(keyframes, key=lambda k: abs(k - target)) if keyframes else target
+        if cuts[-1] < cut < frame_count:
+            cuts.append(cut)
+    cuts.append(frame_count)
+    if len(cuts) < 3:
+        return None
+    return [{'start': start, 'end': end} for start, end in zip(cuts[:-1], cuts[1:])]
+
+
+# ----------- WORKERS -------------
+
+def init_worker(threads, pids):
+    # Each worker gets its share of the cores instead of every one using all of them
+    import torch
+    torch.set_num_threads(threads)
+    # Reported so reset_pool can terminate workers that ignore a cancellation
+    pids.append(os.getpid())
+
+
+class CancelEvent:
+    """Worker-side view of the request's token: a Manager Event, asked at most every CANCEL_POLL_INTERVAL
+    (each ask is a round trip to the manager process)"""
+
+    def __init__(self, event):
+        self.event = event
+        self.checked = 0.0
+        self.set = False
+
+    def cancelled(self):
+        now = time.monotonic()
+        if not self.set and now - self.checked >= CANCEL_POLL_INTERVAL:
+            self.checked = now
+            self.set = self.event.is_set()
+        return self.set
+
+    def remaining(self):
+        return None
+
+
+def analyze_time_segment(stage, video_path, start, end, options, deadline, cancel_event):
+    """One stage over frames [start, end) in a worker process: the segment's part, with
+    'degraded' set if the worker's memory budget thinned it out. deadline is a time.time()
+    by which to stop (tasks may wait for a free worker); cancel_event stops it early."""
+    timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+    cancel_token = CancellationToken(timeout, parent=CancelEvent(cancel_event))
+    memory_budget = MemoryBudget()
+    signals = {}
+    try:
+        if stage == 'face':
+            from face import detect_face_distortion
+            _, distorted = detect_face_distortion(
+                video_path, cancel_token=cancel_token, signals=signals, start_frame=start, end_frame=end,
+                sample_offset=start, memory_budget=memory_budget, **options)
+            part = face_part(signals, distorted)
+        elif stage == 'frame':
+            from frame import detect_frame_anomalies
+            _, abnormal = detect_frame_anomalies(
+                video_path, cancel_token=cancel_token, signals=signals, start_frame=start, end_frame=end,
+                sample_offset=start, memory_budget=memory_budget, **options)
+            part = frame_part(signals, abnormal, options['skip_frames'])
+        else:
+            raise ValueError(f"Unknown stage {stage}")
+    finally:
+        memory_budget.close()
+    part['degraded'] = memory_budget.is_degraded(stage)
+    return part
+
+
+_pool = None
+_pool_pids = None
+_manager = None
+_pool_lock = threading.Lock()
+
+
+def get_manager():
+    """Process-wide Manager for the objects shared with pool workers (call with _pool_lock held)"""
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context('spawn').Manager()
+    return _manager
+
+
+def get_pool():
+    """Process-wide worker pool; spawned on first use so workers load only the models they run"""
+    global _pool, _pool_pids
+    with _pool_lock:
+        if _pool is None:
+            threads = max(1, (os.cpu_count() or 1) // PARALLEL_WORKERS)
+            _pool_pids = get_manager().list()
+            _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_worker, initargs=(threads, _pool_pids))
+        return _pool
+
+
+def cancel_event():
+    """A fresh Event the pool workers can see, from the process-wide manager"""
+    with _pool_lock:
+        return get_manager().Event()
+
+
+def terminate_workers(pids):
+    """SIGTERM the pool workers that are still alive (a PID reused by an unrelated process is left alone)"""
+    for pid in pids:
+        try:
+            process = psutil.Process(pid)
+            if process.ppid() == os.getpid():
+                process.terminate()
+        except psutil.Error:
+            pass
+
+
+def reset_pool(terminate=False):
+    """Drop a pool whose worker died (e.g. killed for memory), or whose workers ignored a
+    cancellation (terminate=True), so the next request starts a fresh one"""
+    global _pool, _pool_pids
+    with _pool_lock:
+        if _pool is not None:
+            # shutdown() leaves running workers alone; they are stopped by the PIDs they reported
+            pids = list(_pool_pids) if terminate else []
+            _pool.shutdown(wait=False, cancel_futures=True)
+            terminate_workers(pids)
+            _pool = None
+            _pool_pids = None
+
+
+def run_time_segments(stage, video_path, segments, options, cancel_token=None, on_progress=None, memory_budget=None):
+    """Parts for one stage, one worker task per segment, in segment order.
+
+    Workers get the token's deadline as their own and stop there with
+    partial parts; cancelling the token stops them as well. Workers that
+    haven't returned CANCEL_GRACE_SECONDS after a cancellation are
+    terminated and the stage raises AnalysisCancelled. on_progress(frames)
+    reports the frames of the segments finished so far; a stage a worker's
+    memory budget thinned out is marked degraded on memory_budget.
+    """
+    remaining = cancel_token.remaining() if cancel_token is not None else None
+    deadline = time.time() + remaining if remaining is not None else None
+    stop = cancel_event()
+    pool = get_pool()
+    futures = [
+        pool.submit(analyze_time_segment, stage, video_path, segment['start'],
+                    # The last segment runs to the end of the stream whatever the container's frame count says
+                    segment['end'] if index < len(segments) - 1 else None, options, deadline, stop)
+        for index, segment in enumerate(segments)
+    ]
+    lengths = {future: segment['end'] - segment['start'] for future, segment in zip(futures, segments)}
+    try:
+        pending = set(futures)
+        done_frames = 0
+        while pending:
+            done, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if done:
+                done_frames += sum(lengths[future] for future in done)
+                if on_progress is not None:
+                    on_progress(done_frames)
+            if pending and cancel_token is not None and cancel_token.cancelled():
+                # Running workers return their partial parts; queued tasks never start
+                stop.set()
+                for future in pending:
+                    future.cancel()
+                _, pending = wait(pending, timeout=CANCEL_GRACE_SECONDS)
+                if pending:
+                    reset_pool(terminate=True)
+                    raise AnalysisCancelled(f"{stage} segment workers did not stop in time")
+                break
+        parts = []
+        for future, segment in zip(futures, segments):
+            if future.cancelled():
+                # Never started: an empty part keeps the parts in step with the segments
+                parts.append(face_part({}, 0) if stage == 'face' else frame_part({}, 0, options['skip_frames']))
+            else:
+                parts.append(future.result())
+        if memory_budget is not None and any(part.get('degraded') for part in parts):
+            memory_budget.mark_degraded(stage)
+        return parts
+    except BrokenProcessPool:
+        reset_pool()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
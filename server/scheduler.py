@@ -0,0 +1,210 @@
+"""
+Latency-budget scheduler for process_video.
+
+Before the pipeline runs, the container is probed (duration, fps,
+resolution, audio track) and a few frames are decoded to time the decoder
+on this particular file. Each stage's cost is then estimated from per-frame
+throughput - decode time for every frame the stage reads, plus model time
+per sampled frame - and the scheduler picks, per stage, the sampling stride
+and input resolution that fit the requested budget. The stages run in
+parallel, so each one has to fit the budget on its own.
+
+The analyzers only grab() the frames they skip, so every frame costs a
+decode but only sampled frames pay for the BGR conversion (retrieve) and
+the model. When long videos are split into time segments analyzed by
+parallel workers, the face and frame work is spread over the workers.
+
+Model throughput starts from the priors below and is updated from the
+measured wall time of every completed analysis, so the estimates track the
+hardware the server actually runs on.
+"""
+import math
+import os
+import threading
+import time
+
+import cv2
+
+# Share of the budget handed to the stages; the rest covers hashing, index
+# lookups, scoring and response encoding
+BUDGET_HEADROOM = 0.85
+# Never sample denser than this (3/s is the old skip of 10 at 30 fps) nor more than this many frames per stage
+MAX_SAMPLE_FPS = float(os.environ.get('SCHEDULE_MAX_SAMPLE_FPS', 3))
+MAX_SAMPLES = int(os.environ.get('SCHEDULE_MAX_SAMPLES', 240))
+# Below this many samples a lower face detection resolution is preferred over fewer samples
+MIN_SAMPLES = 20
+# Face detection working sizes to choose from, best first (see frame_prep.DETECTION_SIZE)
+DETECTION_SIZES = (480, 360, 240)
+FRAME_INPUT_SIZE = 112
+PROBE_FRAMES = 5
+# Weight of the newest measurement in the running cost estimates
+EWMA_ALPHA = 0.3
+
+# Priors in ms: face is per sampled frame at the largest detection size,
+# frame per sampled frame, audio per second of audio plus a fixed startup cost
+_costs = {
+    'face_ms_per_sample': float(os.environ.get('SCHEDULE_FACE_MS', 60)),
+    'frame_ms_per_sample': float(os.environ.get('SCHEDULE_FRAME_MS', 15)),
+    'audio_ms_per_second': float(os.environ.get('SCHEDULE_AUDIO_MS', 120)),
+    'audio_startup_ms': float(os.environ.get('SCHEDULE_AUDIO_STARTUP_MS', 3000)),
+}
+_costs_lock = threading.Lock()
+
+
+def probe_video(video_path, probe_frames=PROBE_FRAMES):
+    """Container metadata plus the measured decode time per frame of this file"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        grabbed = 0
+        started = time.perf_counter()
+        while grabbed < probe_frames and cap.grab():
+            grabbed += 1
+        grab_ms = (time.perf_counter() - started) * 1000 / grabbed if grabbed else 0.0
+
+        read = 0
+        started = time.perf_counter()
+        while read < probe_frames and cap.read()[0]:
+            read += 1
+        read_ms = (time.perf_counter() - started) * 1000 / read if read else grab_ms
+    finally:
+        cap.release()
+
+    duration = frame_count / fps if fps > 0 else 0.0
+    has_audio = True
+    try:
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+        infos = ffmpeg_parse_infos(video_path)
+        has_audio = bool(infos.get('audio_found'))
+        duration = infos.get('duration') or duration
+    except Exception as e:
+        # Unknown: plan as if there is a track and let the audio stage find out
+        print(f"Error probing audio track: {str(e)}")
+
+    return {
+        'duration_seconds': round(duration, 3),
+        'fps': round(fps, 3),
+        'frame_count': frame_count,
+        'width': width,
+        'height': height,
+        'has_audio': has_audio,
+        'decode_ms_per_frame': round(grab_ms, 3),
+        'retrieve_ms_per_frame': round(max(0.0, read_ms - grab_ms), 3),
+    }
+
+
+def costs():
+    with _costs_lock:
+        return dict(_costs)
+
+
+def face_sample_ms(detection_size, cost=None):
+    """MTCNN cost grows with the detection area; the classifier runs at 224 either way"""
+    cost = costs() if cost is None else cost
+    return cost['face_ms_per_sample'] * (detection_size / DETECTION_SIZES[0]) ** 2
+
+
+def samples_for(frame_count, duration, stage_budget_ms, decode_ms, sample_ms):
+    """Samples wanted by the density cap and samples that fit the stage budget"""
+    wanted = min(MAX_SAMPLES, max(1, int(duration * MAX_SAMPLE_FPS)), max(frame_count, 1))
+    # Every frame is decoded whatever the stride, so decoding comes off the top
+    fits = int((stage_budget_ms - frame_count * decode_ms) // sample_ms) if sample_ms > 0 else wanted
+    return wanted, fits
+
+
+def stride_for(frame_count, samples):
+    return max(1, math.ceil(frame_count / max(samples, 1)))
+
+
+def plan_analysis(probe, budget_ms, workers=1):
+    """Per-stage sampling stride and resolution that fit budget_ms (stages run in parallel,
+    face and frame each over `workers` time segments at once)"""
+    cost = costs()
+    stage_budget = budget_ms * BUDGET_HEADROOM
+    # Face/frame work that fits when it is split over the workers
+    work_budget = stage_budget * workers
+    frame_count = max(probe['frame_count'], 1)
+    duration = probe['duration_seconds']
+    decode_ms = probe['decode_ms_per_frame']
+    retrieve_ms = probe['retrieve_ms_per_frame']
+    decode_total = frame_count * decode_ms
+
+    # Face: the largest detection size that still leaves enough samples
+    for detection_size in DETECTION_SIZES:
+        face_ms = retrieve_ms + face_sample_ms(detection_size, cost)
+        wanted, fits = samples_for(frame_count, duration, work_budget, decode_ms, face_ms)
+        if fits >= min(wanted, MIN_SAMPLES):
+            break
+    face_stride = stride_for(frame_count, max(1, min(wanted, fits)))
+    face_samples = frame_count // face_stride
+    face = {
+        'skip_frames': face_stride,
+        'detection_size': detection_size,
+        'sampled_frames': face_samples,
+        'estimated_ms': round((decode_total + face_samples * face_ms) / workers),
+    }
+
+    # Frame: fixed input size, the similarity threshold is tuned for it
+    frame_ms = retrieve_ms + cost['frame_ms_per_sample']
+    wanted, fits = samples_for(frame_count, duration, work_budget, decode_ms, frame_ms)
+    frame_stride = stride_for(frame_count, max(1, min(wanted, fits)))
+    frame_samples = frame_count // frame_stride
+    frame = {
+        'skip_frames': frame_stride,
+        'input_size': FRAME_INPUT_SIZE,
+        'sampled_frames': frame_samples,
+        'estimated_ms': round((decode_total + frame_samples * frame_ms) / workers),
+    }
+
+    # Audio: one Wav2Vec2 pass over the whole track, skipped if it can't finish in time
+    audio_ms = round(cost['audio_startup_ms'] + duration * cost['audio_ms_per_second'])
+    audio = {'enabled': True, 'estimated_ms': audio_ms}
+    if not probe['has_audio']:
+        audio = {'enabled': False, 'reason': 'No audio track', 'estimated_ms': 0}
+    elif audio_ms > stage_budget:
+        audio = {'enabled': False, 'reason': 'Over latency budget', 'estimated_ms': audio_ms}
+
+    estimated = max(face['estimated_ms'], frame['estimated_ms'], audio['estimated_ms'] if audio['enabled'] else 0)
+    return {
+        'budget_ms': round(budget_ms),
+        'estimated_ms': estimated,
+        'fits_budget': estimated <= stage_budget,
+        'workers': workers,
+        'probe': probe,
+        'stages': {'face': face, 'frame': frame, 'audio': audio},
+    }
+
+
+def record_timings(plan, timings_ms):
+    """Fold one run's measured stage wall times (ms) into the cost estimates"""
+    probe = plan['probe']
+    decode_total = probe['frame_count'] * probe['decode_ms_per_frame']
+    retrieve_ms = probe['retrieve_ms_per_frame']
+    # Wall time of face/frame split over parallel workers -> total work
+    workers = plan.get('workers', 1)
+    with _costs_lock:
+        face = plan['stages']['face']
+        if 'face' in timings_ms and face['sampled_frames'] > 0:
+            per_sample = max(0.0, timings_ms['face'] * workers - decode_total) / face['sampled_frames'] - retrieve_ms
+            # Normalize back to the largest detection size
+            per_sample /= (face['detection_size'] / DETECTION_SIZES[0]) ** 2
+            update_cost('face_ms_per_sample', max(0.0, per_sample))
+
+        frame = plan['stages']['frame']
+        if 'frame' in timings_ms and frame['sampled_frames'] > 0:
+            per_sample = max(0.0, timings_ms['frame'] * workers - decode_total) / frame['sampled_frames'] - retrieve_ms
+            update_cost('frame_ms_per_sample', max(0.0, per_sample))
+
+        seconds = probe['duration_seconds']
+        if 'audio' in timings_ms and seconds > 0:
+            per_second = max(0.0, timings_ms['audio'] - _costs['audio_startup_ms']) / seconds
+            update_cost('audio_ms_per_second', per_second)
+
+
+def update_cost(key, measured):
+    """EWMA update; callers hold _costs_lock"""
+    _costs[key] = (1 - EWMA_ALPHA) * _costs[key] + EWMA_ALPHA * measured
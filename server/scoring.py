@@ -0,0 +1,162 @@
+"""
+Vectorized confidence scoring.
+
+The same formula process_video uses, written over numpy arrays so it scores
+one analysis or a whole signal store at once. Weights and thresholds live in
+a config dict (DEFAULT_CONFIG matches the live pipeline); pass a JSON file
+to try a different weighting over every stored analysis:
+
+    python scoring.py --config weights.json --output rescored.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_CONFIG = {
+    # Face counts as distorted when the classifier's fake probability exceeds this
+    'face_threshold': 0.5,
+    # Frame counts as abnormal when its similarity to the previous sampled frame is below this
+    'anomaly_threshold': 0.85,
+    # Audio-visual sync score mix
+    'sync_weights': {'cosine_similarity': 0.4, 'mismatch': 0.4, 'euclidean': 0.2},
+    # Stage weights switch on whether faces were found reliably
+    'face_detection_cutoff': 0.5,
+    'weights_reliable_faces': {'face': 0.5, 'frame': 0.3, 'audio_visual': 0.2},
+    'weights_unreliable_faces': {'face': 0.3, 'frame': 0.3, 'audio_visual': 0.4},
+}
+
+# Upper confidence bounds (inclusive) for each verdict, lowest first
+RISK_BOUNDS = [30, 45, 65, 80]
+RISK_LEVELS = ["High", "Medium-High", "Medium", "Low-Medium", "Low"]
+RISK_RESULTS = [
+    "Very likely manipulated content (<30% confidence)",
+    "Likely manipulated content (30-45% confidence)",
+    "Uncertain authenticity (45-65% confidence)",
+    "Probably authentic content (65-80% confidence)",
+    "Very likely authentic content (>80% confidence)",
+]
+
+
+def risk_for(confidence_score):
+    """(risk_level, analysis_result) for a single confidence score"""
+    risk_index = int(np.digitize(confidence_score, RISK_BOUNDS, right=True))
+    return RISK_LEVELS[risk_index], RISK_RESULTS[risk_index]
+
+
+def load_config(path=None):
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path:
+        with open(path, 'r') as file:
+            overrides = json.load(file)
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(config.get(key), dict):
+                config[key].update(value)
+            else:
+                config[key] = value
+    return config
+
+
+def score_arrays(columns, config=DEFAULT_CONFIG):
+    """Score N analyses at once.
+
+    columns holds equal-length arrays of the raw counts/metrics
+    (total_frames, distorted_faces, total_frames_processed,
+    abnormal_frames_detected, face_detection_rate, cosine_similarity,
+    mismatch_score, euclidean_distance), plus optionally has_audio: where it
+    is false the audio metrics are ignored and the face and frame weights
+    are scaled up to sum to what the three did.
+    """
+    col = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+
+    distorted_face_ratio = col['distorted_faces'] / np.maximum(col['total_frames'], 1)
+    abnormal_frame_ratio = col['abnormal_frames_detected'] / np.maximum(col['total_frames_processed'], 1)
+
+    face_score = 100 * (1 - distorted_face_ratio) * col['face_detection_rate']
+    frame_score = 100 * (1 - abnormal_frame_ratio)
+    sync = config['sync_weights']
+    av_sync_score = 100 * (
+        sync['cosine_similarity'] * col['cosine_similarity'] +
+        sync['mismatch'] * (1 - col['mismatch_score']) +
+        sync['euclidean'] * (1 - col['euclidean_distance'])
+    )
+
+    reliable = col['face_detection_rate'] > config['face_detection_cutoff']
+    high, low = config['weights_reliable_faces'], config['weights_unreliable_faces']
+    face_weight = np.where(reliable, high['face'], low['face'])
+    frame_weight = np.where(reliable, high['frame'], low['frame'])
+    av_weight = np.where(reliable, high['audio_visual'], low['audio_visual'])
+    if 'has_audio' in col:
+        has_audio = col['has_audio'] > 0
+        scale = np.where(has_audio, 1.0, (face_weight + frame_weight + av_weight) / (face_weight + frame_weight))
+        face_weight, frame_weight = face_weight * scale, frame_weight * scale
+        av_weight = np.where(has_audio, av_weight, 0.0)
+
+    confidence_score = face_weight * face_score + frame_weight * frame_score + av_weight * av_sync_score
+    return {
+        'face_score': face_score,
+        'frame_score': frame_score,
+        'av_sync_score': av_sync_score,
+        'face_weight': face_weight,
+        'frame_weight': frame_weight,
+        'av_weight': av_weight,
+        'confidence_score': np.clip(confidence_score, 0, 100),
+        'risk_index': np.digitize(confidence_score, RISK_BOUNDS, right=True),
+    }
+
+
+def rescore_table(table, config=DEFAULT_CONFIG):
+    """Re-derive the counts from the stored per-frame signals and score every video"""
+    n = len(table['hashes'])
+    distorted = np.bincount(table['face_video'], weights=table['face_fake_prob'] > config['face_threshold'], minlength=n)
+    abnormal = np.bincount(table['frame_video'], weights=table['frame_similarity'] < config['anomaly_threshold'], minlength=n)
+    return score_arrays({
+        'total_frames': table['face_sampled_frames'],
+        'distorted_faces': distorted,
+        'total_frames_processed': table['frame_sampled_frames'],
+        'abnormal_frames_detected': abnormal,
+        'face_detection_rate': table['face_detection_rate'],
+        'cosine_similarity': table['cosine_similarity'],
+        'mismatch_score': table['mismatch_score'],
+        'euclidean_distance': table['euclidean_distance'],
+        'has_audio': table['has_audio'],
+    }, config)
+
+
+def main(argv=None):
+    from signal_store import SIGNAL_STORE_DIR, load_table
+
+    parser = argparse.ArgumentParser(description="Re-score every stored analysis under a weighting config")
+    parser.add_argument('--store', default=SIGNAL_STORE_DIR, help="Signal store directory")
+    parser.add_argument('--config', help="JSON file overriding DEFAULT_CONFIG keys")
+    parser.add_argument('--output', help="Write one JSON line per video here")
+    args = parser.parse_args(argv)
+
+    start_time = time.time()
+    table = load_table(args.store)
+    load_time = time.time() - start_time
+    scores = rescore_table(table, load_config(args.config))
+    score_time = time.time() - start_time - load_time
+
+    n = len(table['hashes'])
+    print(f"Scored {n} analyses (load {load_time:.2f}s, score {score_time * 1000:.1f}ms)")
+    counts = np.bincount(scores['risk_index'], minlength=len(RISK_LEVELS))
+    for level, count in zip(RISK_LEVELS, counts):
+        print(f"  {level:12s} {count}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            for i in range(n):
+                file.write(json.dumps({
+                    'content_hash': str(table['hashes'][i]),
+                    'confidence_score': round(float(scores['confidence_score'][i]), 2),
+                    'risk_level': RISK_LEVELS[scores['risk_index'][i]],
+                }) + '\n')
+        print(f"Results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
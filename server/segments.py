@@ -0,0 +1,233 @@
+"""
+Segment-level cache of per-stage analysis results.
+
+Videos are cut into content-defined segments: a frame starts a new segment
+when the low bits of its dHash are all zero (and the current segment is
+long enough), so boundaries follow the picture, not the file. A trimmed or
+extended re-upload decodes to the same frames and therefore finds the same
+boundaries after its first one, and the shared segments get the same keys -
+a SHA-256 over their decoded frames' raw bytes - however the file was cut
+or muxed. The key is exact on purpose: a perceptual one (the dHashes) would
+also match a face swap of cached footage and hand it the authentic results.
+
+Each stage stores its partial result per segment (face probabilities, frame
+similarities plus the first/last frame features, audio and lip sums) under
+the segment key and the sampling it ran with. Audio parts are keyed on the
+segment's audio as well, since the same frames can carry other audio. On a
+new upload only segments missing from the cache are analyzed; merge_*
+rebuilds the usual whole-video counts and signals from the parts.
+
+Fingerprinting decodes the whole video once more before the stages run, so
+the cache is opt-in (SEGMENT_CACHE=1): it pays off where the same footage
+is uploaded again and again.
+"""
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from frame_prep import difference_hash
+
+SEGMENT_CACHE_DIR = os.environ.get('SEGMENT_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'segment_cache'))
+SEGMENT_CACHE = os.environ.get('SEGMENT_CACHE', '0') == '1'
+SEGMENT_MIN_FRAMES = 30
+SEGMENT_MAX_FRAMES = 300
+# A frame is a boundary candidate when this many low dHash bits are zero (1 in 32)
+BOUNDARY_BITS = 5
+# Audio fingerprint block length in samples (50 ms at 16 kHz)
+AUDIO_BLOCK_SAMPLES = 800
+
+
+def split_segments(hashes, digests, min_frames=SEGMENT_MIN_FRAMES, max_frames=SEGMENT_MAX_FRAMES):
+    """[{'start', 'end', 'key'}] covering the per-frame dHashes (which place the
+    boundaries) and the per-frame SHA-256 digests of the raw frames (which key the segments)"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    candidate = (hashes & np.uint64((1 << BOUNDARY_BITS) - 1)) == 0
+    cuts = [0]
+    for index in range(1, len(hashes)):
+        length = index - cuts[-1]
+        if (candidate[index] and length >= min_frames) or length >= max_frames:
+            cuts.append(index)
+    cuts.append(len(hashes))
+    return [{
+        'start': start,
+        'end': end,
+        'key': hashlib.sha256(b''.join(digests[start:end])).hexdigest()[:32],
+    } for start, end in zip(cuts[:-1], cuts[1:]) if end > start]
+
+
+def audio_key(segment, samples):
+    """Cache key for a segment's audio part: the frame key plus a fingerprint of its samples.
+
+    The fingerprint is a dHash of the loudness envelope - whether each 50 ms
+    block is louder than the one before - so it survives re-encoding and
+    gain changes but not swapped or dubbed audio over the same frames.
+    """
+    blocks = len(samples) // AUDIO_BLOCK_SAMPLES
+    energy = np.square(np.asarray(samples[:blocks * AUDIO_BLOCK_SAMPLES], dtype=np.float64)).reshape(
+        blocks, AUDIO_BLOCK_SAMPLES).mean(axis=1)
+    bits = np.packbits(energy[1:] > energy[:-1])
+    digest = hashlib.sha256(np.int64(blocks).tobytes() + bits.tobytes()).hexdigest()[:16]
+    return f"{segment['key']}-{digest}"
+
+
+def fingerprint_segments(video_path, cancel_token=None):
+    """Decode every frame once for its dHash and raw-byte digest and cut the
+    video into segments (None if the token trips first)"""
+    cap = cv2.VideoCapture(video_path)
+    hashes = []
+    digests = []
+    try:
+        while cap.grab():
+            if cancel_token is not None and cancel_token.cancelled():
+                return None
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            hashes.append(difference_hash(frame))
+            digests.append(hashlib.sha256(frame.data).digest())
+    finally:
+        cap.release()
+    return split_segments(hashes, digests)
+
+
+# ----------- CACHE -------------
+
+def part_path(key, stage, tag, cache_dir=SEGMENT_CACHE_DIR):
+    return os.path.join(cache_dir, stage, f"{key}.{tag}.npz")
+
+
+def load_part(key, stage, tag, cache_dir=SEGMENT_CACHE_DIR):
+    path = part_path(key, stage, tag, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError) as e:
+        print(f"Error reading segment cache {path}: {str(e)}")
+        return None
+
+
+def save_part(key, stage, tag, part, cache_dir=SEGMENT_CACHE_DIR):
+    path = part_path(key, stage, tag, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp name and rename so readers never see a half-written file
+    tmp_path = f"{path[:-len('.npz')]}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **part)
+    os.replace(tmp_path, path)
+
+
+def run_segmented(stage, tag, segments, analyze, cancel_token=None, on_segment=None, cacheable=None):
+    """Per-segment parts for one stage: cached ones are loaded, the others
+    computed with analyze(segment) and saved. Returns (parts, segments reused).
+
+    Parts computed after the token tripped are kept for this response (they
+    are partial) but not cached, nor are parts computed while cacheable()
+    is false (e.g. sampled sparser than `tag` says). on_segment(segment)
+    runs after each one.
+    """
+    parts = []
+    reused = 0
+    for segment in segments:
+        if cancel_token is not None and cancel_token.cancelled():
+            break
+        part = load_part(segment['key'], stage, tag)
+        if part is not None:
+            reused += 1
+        else:
+            part = analyze(segment)
+            if (cancel_token is None or not cancel_token.cancelled()) and (cacheable is None or cacheable()):
+                try:
+                    save_part(segment['key'], stage, tag, part)
+                except OSError as e:
+                    print(f"Error writing segment cache: {str(e)}")
+        parts.append(part)
+        if on_segment is not None:
+            on_segment(segment)
+    return parts, reused
+
+
+# ----------- PARTS / MERGING -------------
+
+def face_part(signals, distorted_faces):
+    return {
+        'frame_index': np.asarray(signals.get('face_frame_index', []), dtype=np.int32),
+        'fake_prob': np.asarray(signals.get('face_fake_prob', []), dtype=np.float32),
+        'sampled': np.int64(signals.get('face_sampled_frames', 0)),
+        'distorted': np.int64(distorted_faces),
+    }
+
+
+def merge_face(segments, parts, signals=None):
+    """(total frames, distorted faces) over all segments; signals get absolute frame numbers"""
+    total_frames = sum(int(part['sampled']) for part in parts)
+    distorted_faces = sum(int(part['distorted']) for part in parts)
+    if signals is not None:
+        signals['face_frame_index'] = [int(i) + segment['start'] for segment, part in zip(segments, parts) for i in part['frame_index']]
+        signals['face_fake_prob'] = [float(p) for part in parts for p in part['fake_prob']]
+        signals['face_sampled_frames'] = total_frames
+    return total_frames, distorted_faces
+
+
+def frame_part(signals, abnormal_frames, skip_frames):
+    empty = np.zeros(0, dtype=np.float32)
+    return {
+        'frame_index': np.asarray(signals.get('frame_index', []), dtype=np.int32),
+        'similarity': np.asarray(signals.get('frame_similarity', []), dtype=np.float32),
+        'first_features': np.asarray(signals.get('frame_first_features', empty), dtype=np.float32),
+        'last_features': np.asarray(signals.get('frame_last_features', empty), dtype=np.float32),
+        # Frame number (from the segment start) of the first sampled frame
+        'first_index': np.int64(signals.get('frame_first_index', skip_frames)),
+        'sampled': np.int64(signals.get('frame_sampled_frames', 0)),
+        'abnormal': np.int64(abnormal_frames),
+    }
+
+
+def merge_frame(segments, parts, threshold, signals=None):
+    """(frames processed, abnormal frames) over all segments.
+
+    Each segment compares its sampled frames among themselves; the first
+    sampled frame of a segment is compared here with the last sampled frame
+    of the segment before it, exactly as a single pass over the video would.
+    """
+    total_frames = 0
+    abnormal_frames = 0
+    frame_index, similarities = [], []
+    previous = None
+    for segment, part in zip(segments, parts):
+        total_frames += int(part['sampled'])
+        abnormal_frames += int(part['abnormal'])
+        if part['first_features'].size:
+            if previous is not None:
+                a, b = previous, part['first_features']
+                similarity = float(np.dot(a, b) / max(np.linalg.norm(a) * np.linalg.norm(b), 1e-12))
+                frame_index.append(segment['start'] + int(part['first_index']))
+                similarities.append(similarity)
+                if similarity < threshold:
+                    abnormal_frames += 1
+            previous = part['last_features'] if part['last_features'].size else part['first_features']
+        frame_index.extend(int(i) + segment['start'] for i in part['frame_index'])
+        similarities.extend(float(s) for s in part['similarity'])
+
+    if signals is not None:
+        order = np.argsort(frame_index, kind='stable')
+        signals['frame_index'] = [frame_index[i] for i in order]
+        signals['frame_similarity'] = [similarities[i] for i in order]
+        signals['frame_sampled_frames'] = total_frames
+    return total_frames, abnormal_frames
+
+
+def merge_audio(parts):
+    """(mean audio embedding, mean lip vector, face detection rate) from the per-segment sums"""
+    hidden_count = sum(int(part['hidden_count']) for part in parts)
+    lip_count = sum(int(part['lip_count']) for part in parts)
+    frame_total = sum(int(part['frame_count']) for part in parts)
+    if hidden_count == 0:
+        raise ValueError("No audio in the video.")
+    if lip_count == 0:
+        raise ValueError("No face detected in the video.")
+    audio_embeddings = sum(part['hidden_sum'] for part in parts) / hidden_count
+    visual_embeddings = sum(part['lip_sum'] for part in parts) / lip_count
+    return audio_embeddings, visual_embeddings, lip_count / frame_total
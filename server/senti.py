@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
 import subprocess
 import sys
 import cv2
-from deepface import DeepFace
+import model_store
 from moviepy import VideoFileClip
 import numpy as np
 import json
@@ -16,7 +17,17 @@ def install_packages():
     except subprocess.CalledProcessError as e:
         print(f"Error installing packages: {e}")
 
-install_packages()
+def frame_emotion(frame):
+    """DeepFace's dominant emotion for one frame (raises if DeepFace fails on it)"""
+    result = model_store.load_emotion_analyzer()(frame, actions=['emotion'], enforce_detection=False)
+    return result[0]['dominant_emotion']
+
+def count_emotions(emotions):
+    """{emotion: number of frames it was dominant in}"""
+    sentiment_summary = {}
+    for emotion in emotions:
+        sentiment_summary[emotion] = sentiment_summary.get(emotion, 0) + 1
+    return sentiment_summary
 
 def analyze_video_sentiment(video_path):
     """
@@ -37,18 +48,14 @@ def analyze_video_sentiment(video_path):
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             try:
                 # Analyze emotions using DeepFace
-                result = DeepFace.analyze(frame_rgb, actions=['emotion'], enforce_detection=False)
-                # Extract dominant emotion
-                dominant_emotion = result[0]['dominant_emotion']
+                dominant_emotion = frame_emotion(frame_rgb)
                 sentiment_scores.append(dominant_emotion)
                 print(f"Frame {i+1}/{total_frames}: Dominant Emotion = {dominant_emotion}")
             except Exception as e:
                 print(f"Frame {i+1}/{total_frames}: No face detected or error - {e}")
         
         # Summarize sentiment results
-        sentiment_summary = {}
-        for emotion in sentiment_scores:
-            sentiment_summary[emotion] = sentiment_summary.get(emotion, 0) + 1
+        sentiment_summary = count_emotions(sentiment_scores)
         
         # Save results to JSON
         output_path = "./sentiment_summary.json"
@@ -79,7 +86,7 @@ def analyze_video_sentiment(video_path):
 
             try:
                 # Analyze emotions using DeepFace
-                result = DeepFace.analyze(frame_rgb, actions=['emotion'], enforce_detection=False)
+                result = model_store.load_emotion_analyzer()(frame_rgb, actions=['emotion'], enforce_detection=False)
 
                 # Extract dominant emotion
                 dominant_emotion = result[0]['dominant_emotion']
@@ -110,5 +117,7 @@ def analyze_video_sentiment(video_path):
 
 # Run analysis
 if __name__ == "__main__":
+    # Only when run as a script: importing this module (the server does) must not need network access
+    install_packages()
     video_path = "./uploads/download_3.mp4"  # Change this to your video path
     analyze_video_sentiment(video_path)
@@ -0,0 +1,125 @@
+"""
+On-disk store of the raw per-frame signals behind each analysis.
+
+One compressed .npz per video, keyed by the SHA-256 of the file contents:
+per-face fake probabilities, the frame-to-frame similarity series and the
+audio-visual sync metrics. load_table() concatenates every entry into flat
+columns (plus a video index per row) so scoring.py can re-score the whole
+store in a few vectorized numpy passes.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+SIGNAL_STORE_DIR = os.environ.get('SIGNAL_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signal_store'))
+TABLE_FILENAME = '_table.npz'
+
+# Scalars stored per video, all as float64
+SCALAR_FIELDS = [
+    'face_sampled_frames',
+    'frame_sampled_frames',
+    'face_detection_rate',
+    'cosine_similarity',
+    'mismatch_score',
+    'euclidean_distance',
+    # 0 when the audio stage was skipped and the metrics above are placeholders
+    'has_audio',
+]
+# Values for scalars added after older entries were written
+SCALAR_DEFAULTS = {'has_audio': 1.0}
+
+# Per-frame series: name -> dtype
+SERIES_FIELDS = {
+    'face_frame_index': np.int32,
+    'face_fake_prob': np.float32,
+    'frame_index': np.int32,
+    'frame_similarity': np.float32,
+}
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def signals_path(digest, store_dir=SIGNAL_STORE_DIR):
+    return os.path.join(store_dir, f"{digest}.npz")
+
+
+def save_signals(digest, signals, store_dir=SIGNAL_STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    arrays = {name: np.asarray(signals.get(name, []), dtype=dtype) for name, dtype in SERIES_FIELDS.items()}
+    for name in SCALAR_FIELDS:
+        arrays[name] = np.float64(signals.get(name, 0))
+
+    # Write to a temp name and rename so readers never see a half-written file
+    tmp_path = os.path.join(store_dir, f"{digest}.tmp.npz")
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, signals_path(digest, store_dir))
+
+
+def load_signals(digest, store_dir=SIGNAL_STORE_DIR):
+    path = signals_path(digest, store_dir)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def list_entries(store_dir=SIGNAL_STORE_DIR):
+    if not os.path.isdir(store_dir):
+        return []
+    # <64 hex chars>.npz; skips the table and in-flight temp files
+    return sorted(
+        (entry for entry in os.scandir(store_dir) if entry.name.endswith('.npz') and len(entry.name) == 68),
+        key=lambda entry: entry.name,
+    )
+
+
+def build_table(store_dir=SIGNAL_STORE_DIR):
+    """Concatenate every stored analysis into flat columns and cache the result"""
+    hashes = []
+    scalars = {name: [] for name in SCALAR_FIELDS}
+    series = {name: [] for name in SERIES_FIELDS}
+    face_video = []
+    frame_video = []
+
+    for video_id, entry in enumerate(list_entries(store_dir)):
+        with np.load(entry.path) as data:
+            hashes.append(entry.name[:-4])
+            for name in SCALAR_FIELDS:
+                scalars[name].append(float(data[name]) if name in data.files else SCALAR_DEFAULTS[name])
+            for name in SERIES_FIELDS:
+                series[name].append(data[name])
+            face_video.append(np.full(len(data['face_fake_prob']), video_id, dtype=np.int32))
+            frame_video.append(np.full(len(data['frame_similarity']), video_id, dtype=np.int32))
+
+    table = {'hashes': np.array(hashes, dtype='U64')}
+    for name in SCALAR_FIELDS:
+        table[name] = np.array(scalars[name], dtype=np.float64)
+    for name, dtype in SERIES_FIELDS.items():
+        table[name] = np.concatenate(series[name]) if series[name] else np.zeros(0, dtype=dtype)
+    table['face_video'] = np.concatenate(face_video) if face_video else np.zeros(0, dtype=np.int32)
+    table['frame_video'] = np.concatenate(frame_video) if frame_video else np.zeros(0, dtype=np.int32)
+
+    if hashes:
+        tmp_path = os.path.join(store_dir, '_table.tmp.npz')
+        np.savez(tmp_path, **table)
+        os.replace(tmp_path, os.path.join(store_dir, TABLE_FILENAME))
+    return table
+
+
+def load_table(store_dir=SIGNAL_STORE_DIR):
+    """Load the consolidated table, rebuilding it if any entry is newer"""
+    table_path = os.path.join(store_dir, TABLE_FILENAME)
+    entries = list_entries(store_dir)
+    if os.path.exists(table_path):
+        table_mtime = os.path.getmtime(table_path)
+        with np.load(table_path) as data:
+            if len(data['hashes']) == len(entries) and all(entry.stat().st_mtime <= table_mtime for entry in entries):
+                return {name: data[name] for name in data.files}
+    return build_table(store_dir)